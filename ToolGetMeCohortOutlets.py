@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import argparse
+import multiprocessing
+import os
+
+from src.CohortPipeline import CohortPipeline, GetCaseName, \
+    ProcessOutletsCase, WriteOutletsTable
+from src.ResultStore import ResultStore, ComputeFileHash
+from src.WindkesselParameters import GetOutletsArrays, \
+    ComputeWindkesselParameters, WriteWindkesselParameters
+from src.WorkQueue import WorkQueue, LEASEDURATION
+
+CENTERLINEFILETYPES = ('vtk', 'vtp')
+
+
+def Program(inputDirectory, outputDirectory, localRadii, numberOfWorkers,
+    prefetch, verboseprint, resultStoreFileName='', printStatistics=False,
+    meanInflow=0.0, meanPressure=0.0, totalCompliance=0.0, queueDirectory='',
+    leaseDuration=LEASEDURATION):
+
+    parameters = {'localRadii': float(localRadii)}
+    store = None
+    if resultStoreFileName:
+        store = ResultStore(resultStoreFileName)
+    if printStatistics:
+        if store is None:
+            raise RuntimeError('The statistics are read from a result store.')
+        print('{:<30} {:>8} {:>12} {:>12} {:>12}'.format('Case', 'Outlets', 
+            'Min %', 'Mean %', 'Max %'))
+        for caseName, nOutlets, minBeta, meanBeta, maxBeta in \
+            store.GetCohortStatistics(parameters):
+            print('{:<30} {:>8} {:>12.2f} {:>12.2f} {:>12.2f}'.format(caseName, 
+                nOutlets, 100.0*minBeta, 100.0*meanBeta, 100.0*maxBeta))
+        store.Close()
+        return
+
+    if meanPressure > 0.0 and meanInflow <= 0.0:
+        raise RuntimeError('The RCR parameters need the mean inflow (-rcrInflow).')
+    if queueDirectory and store is not None:
+        raise RuntimeError('The result store cannot be shared by the nodes '
+            'of a work queue.')
+
+    def WriteCaseTables(fileName, result):
+        WriteOutletsTable(os.path.join(outputDirectory,
+            GetCaseName(fileName) + '_outlets.csv'), result)
+        # Lumped parameters of the outlets, for the 3D solvers.
+        if meanPressure > 0.0:
+            elementIds, betas, areas, inletArea = GetOutletsArrays(result)
+            WriteWindkesselParameters(os.path.join(outputDirectory,
+                GetCaseName(fileName) + '_rcr.csv'), elementIds,
+                ComputeWindkesselParameters(betas, areas, meanInflow,
+                meanPressure, totalCompliance))
+
+    fileNames = sorted(os.path.join(inputDirectory, f)
+        for f in os.listdir(inputDirectory)
+        if f[-3:] in CENTERLINEFILETYPES)
+    if not(os.path.isdir(outputDirectory)):
+        try:
+            os.makedirs(outputDirectory)
+        except OSError:
+            # Created meanwhile by another node of the work queue.
+            if not(os.path.isdir(outputDirectory)):
+                raise
+    # Resume: the cases already in the store are not recomputed.
+    inputHashes = {}
+    if store is not None:
+        for fileName in fileNames:
+            inputHashes[fileName] = ComputeFileHash(fileName)
+        nFiles = len(fileNames)
+        storedFileNames = [fileName for fileName in fileNames
+            if store.HasRun(inputHashes[fileName], parameters)]
+        for fileName in storedFileNames:
+            WriteCaseTables(fileName,
+                store.GetRun(inputHashes[fileName], parameters))
+        fileNames = [fileName for fileName in fileNames
+            if not(fileName in storedFileNames)]
+        print("> %i of %i cases served from the result store."
+            % (len(storedFileNames), nFiles))
+    print(">")
+    print("> --- Outlets flow splitting of %i cases, %i workers, %i cases "
+        "prefetched per worker." % (len(fileNames), numberOfWorkers, prefetch))
+
+    def WriteResult(fileName, result):
+        if store is not None:
+            store.AddRun(GetCaseName(fileName), os.path.abspath(fileName),
+                inputHashes[fileName], parameters, result)
+        WriteCaseTables(fileName, result)
+
+    pipeline = CohortPipeline(ProcessOutletsCase, WriteResult, verboseprint,
+        numberOfWorkers=numberOfWorkers, prefetch=prefetch)
+    if queueDirectory:
+        # The cases are shared with the nodes running on the same queue.
+        workQueue = WorkQueue(queueDirectory, leaseDuration=leaseDuration)
+        print("> %i cases added to the work queue." 
+            % workQueue.Submit(fileNames))
+        failures = pipeline.RunQueue(workQueue, parameters)
+        nTasks, nDone, nFailed = workQueue.GetStatus()
+        print("> Work queue: %i of %i cases done, %i failed (%i on this "
+            "node)." % (nDone, nTasks, nFailed, len(failures)))
+    else:
+        failures = pipeline.Run(fileNames, parameters)
+        print("> %i cases done, %i failed." % (len(fileNames) - len(failures),
+            len(failures)))
+    if store is not None:
+        store.Close()
+    for fileName, error in failures:
+        print(">   " + GetCaseName(fileName) + ": " + error)
+
+
+if __name__ == "__main__":
+
+    '''Command-line arguments.'''
+    parser = argparse.ArgumentParser(
+        description = "GetMeCohortOutlets: outlets flow splitting of a directory of centerlines.")
+    parser.add_argument('-v', '--verbosity',  action = "store_true", dest='verbosity',
+        default = False, help = "Activates the verbose mode.")
+    parser.add_argument('-i', '--inputDirectory', type = str, required = True, dest = 'inputDirectory',
+        help = "Directory containing the centerlines files in a vtk compliant format.")
+    parser.add_argument('-o', '--outputDirectory', type = str, required = False, default = '', 
+        dest = 'outputDirectory',
+        help = "Directory where the outlets tables are written, one csv file per case.")
+    parser.add_argument('-localRadii', '--localRadii', required = False, default = 0, type=float,
+        dest='localRadii',
+        help = "Instead of averaging a radius along the branches, a local radius can be computed.")
+    parser.add_argument('-workers', '--numberOfWorkers', type = int, required = False,
+        default = multiprocessing.cpu_count(), dest = 'numberOfWorkers',
+        help = "Number of parallel processes.")
+    parser.add_argument('-prefetch', '--prefetch', type = int, required = False,
+        default = 2, dest = 'prefetch',
+        help = "Number of cases read ahead by each process.")
+    parser.add_argument('-store', '--resultStore', type = str, required = False,
+        default = '', dest = 'resultStoreFileName',
+        help = "SQLite file storing the results. Stored cases are not recomputed.")
+    parser.add_argument('-statistics', '--statistics', required = False, default = False,
+        dest = 'printStatistics', action = "store_true",
+        help = "Print the cohort statistics of the result store and exit.")
+    parser.add_argument('-rcrPressure', '--rcrMeanPressure', type = float, required = False,
+        default = 0.0, dest = 'meanPressure',
+        help = "Target mean pressure: the outlets RCR parameters are also written (case_rcr.csv).")
+    parser.add_argument('-rcrInflow', '--rcrMeanInflow', type = float, required = False,
+        default = 0.0, dest = 'meanInflow',
+        help = "Mean inflow of the RCR parameters.")
+    parser.add_argument('-rcrCompliance', '--rcrTotalCompliance', type = float, required = False,
+        default = 0.0, dest = 'totalCompliance',
+        help = "Total compliance distributed to the outlets in proportion of their flows.")
+    parser.add_argument('-queue', '--queueDirectory', type = str, required = False,
+        default = '', dest = 'queueDirectory',
+        help = "Work queue directory on a shared filesystem: the nodes running on the same queue share the cases.")
+    parser.add_argument('-lease', '--leaseDuration', type = float, required = False,
+        default = LEASEDURATION, dest = 'leaseDuration',
+        help = "Time (s) after which the cases claimed by a crashed node are claimed again.")
+    args = parser.parse_args()
+    if not(args.printStatistics) and args.outputDirectory == '':
+        parser.error('the output directory (-o) is required.')
+
+    if args.verbosity:
+        print(">")
+        print("> --- VERBOSE MODE ACTIVATED ---")
+        def verboseprint(*args):
+            for arg in args:
+                print(arg)
+    else:
+        verboseprint = lambda *a: None
+
+    # Start the script.
+    Program(args.inputDirectory, args.outputDirectory, args.localRadii,
+        args.numberOfWorkers, args.prefetch, verboseprint,
+        resultStoreFileName=args.resultStoreFileName,
+        printStatistics=args.printStatistics, meanInflow=args.meanInflow,
+        meanPressure=args.meanPressure, totalCompliance=args.totalCompliance,
+        queueDirectory=args.queueDirectory, leaseDuration=args.leaseDuration)
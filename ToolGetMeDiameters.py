@@ -3,13 +3,28 @@
 
 import argparse
 import numpy
+import os
 import vtk
 
 import src.ImportData as ImportData
-from src.DisplayData import DisplayModel, VtkText, VtkPointCloud
+from src.BifurcationAnalysis import DIRECTIONRADII, \
+    ComputeBifurcationGeometry, WriteBifurcationGeometry
+from src.CenterlineResampling import ResampleCenterline
+from src.DiameterProfile import ComputeDiameterProfiles, WriteDiameterProfiles
+from src.SubtreeEvaluation import SetSubtreeNetworkStructure
+from src.VesselMorphometry import ComputeMorphometry, WriteMorphometry
+from src.WorkQueue import WorkQueue, ProcessQueue, LEASEDURATION
+from src.DisplayData import DisplayModel, VtkText, VtkPointCloud, \
+    VtkLabelHierarchy
 
 def Program(fileNameCenterline, fileNameModel, writeProbePoints, 
-    localRadii, verboseprint):
+    localRadii, verboseprint, resampleSpacing=0.0, resampleRelative=False, numberOfWorkers=1, 
+    fileNameProfile='', displayModel=True, pipeline=None, rootCellId=-1, 
+    rootPoint=None, fileNameMorphometry='', smoothingIterations=0, 
+    fileNameBifurcations='', directionRadii=DIRECTIONRADII):
+    '''Compute and display the branches diameters of a centerline. In a
+    scripted session, a src.Pipeline.Pipeline can be passed and reused
+    between the calls to memoize the computation stages.'''
 
     print ">" 
     print "> --- Input files:" 
@@ -24,30 +39,57 @@ def Program(fileNameCenterline, fileNameModel, writeProbePoints,
     else:
         PowerLawUsesLocalRadii = False
 
-    # Load the centerline vtk data from the file 'fileNameCenterline'.
-    centerline = ImportData.loadFile(fileNameCenterline)
-
-    # Set the corresponding 0D network.
-    network = ImportData.Network()
     ptIntegration=[]
-    ImportData.SetNetworkStructure(centerline, network, verboseprint, 
-        isConnectivityNeeded=True, isLocalRadiiNeeded=PowerLawUsesLocalRadii,
-        localRadii=localRadii)
+    elementIds = None
+    if rootCellId >= 0 or rootPoint is not None:
+        # Only the subtree of the root element is connected and evaluated.
+        centerline = ImportData.loadFile(fileNameCenterline)
+        if resampleSpacing > 0.0:
+            centerline, resamplingReport = ResampleCenterline(centerline, 
+                resampleSpacing, verboseprint, relativeToRadius=resampleRelative)
+        network = ImportData.Network()
+        centerline, subtree = SetSubtreeNetworkStructure(centerline, network, 
+            verboseprint, rootCellId=rootCellId if rootCellId >= 0 else None, 
+            rootPoint=rootPoint, localRadii=localRadii, 
+            numberOfWorkers=numberOfWorkers)
+        elementIds = sorted(subtree.subtreeIds)
+        print "> Subtree of the element %i: %i elements out of %i." % (
+            subtree.rootId, len(elementIds), len(network.elements))
+    elif pipeline is not None:
+        stageParameters = {'fileName': fileNameCenterline, 
+            'resampleSpacing': resampleSpacing, 
+            'resampleRelative': resampleRelative, 'localRadii': localRadii}
+        centerline = pipeline.Run('split', stageParameters)
+        network = pipeline.Run('localRadii', stageParameters)
+    else:
+        # Load the centerline vtk data from the file 'fileNameCenterline'.
+        centerline = ImportData.loadFile(fileNameCenterline)
+        if resampleSpacing > 0.0:
+            centerline, resamplingReport = ResampleCenterline(centerline, 
+                resampleSpacing, verboseprint, relativeToRadius=resampleRelative)
+
+        # Set the corresponding 0D network.
+        network = ImportData.Network()
+        centerline = ImportData.SetNetworkStructure(centerline, network, 
+            verboseprint, isConnectivityNeeded=True, 
+            isLocalRadiiNeeded=PowerLawUsesLocalRadii, localRadii=localRadii, 
+            numberOfWorkers=numberOfWorkers)
 
     # Extract the mid points coords and Diameters.
+    metrics = network.GetCenterlineMetrics()
     points = vtk.vtkPoints()
     scalar = vtk.vtkDoubleArray()
     scalar.SetNumberOfComponents(1)
-    for element in network.elements:
+    if elementIds is None:
+        elementIds = range(0, len(network.elements))
+    for Id in elementIds:
+        element = network.elements[Id]
         if element.IsBlanked():
             continue
         desiredLength = element.GetLength() * 0.666
         branchId = element.GetVtkCellIdList()[0]
-        midPointId = ImportData.GetIndexCenterlineForADefinedLength(centerline, 
-            branchId, desiredLength, verboseprint)
-        midPoint = [0.0, 0.0, 0.0]
-        centerline.GetCell(branchId).GetPoints().GetPoint(midPointId, midPoint)
-        points.InsertNextPoint(midPoint)
+        midPointId = metrics.GetIndexForLength(branchId, desiredLength)
+        points.InsertNextPoint(metrics.GetPoint(branchId, midPointId))
         if localRadii:
             scalar.InsertNextValue(2.0 * element.GetLocalRadius())
         else:
@@ -56,19 +98,78 @@ def Program(fileNameCenterline, fileNameModel, writeProbePoints,
     polydata.SetPoints(points)
     polydata.GetPointData().SetScalars(scalar)
 
-    labelMapper = vtk.vtkLabeledDataMapper()
-    if vtk.VTK_MAJOR_VERSION <= 5:
-        labelMapper.SetInputConnection(polydata.GetProducerPort())
-    else:
-        labelMapper.SetInputData(polydata)
-    labelMapper.SetLabelModeToLabelScalars()
-    labelProperties = labelMapper.GetLabelTextProperty()
-    labelProperties.SetFontFamilyToArial()
-    #labelProperties.SetColor(0, 1, 0)
+    # Diameter versus arc length profile of every branch.
+    if fileNameProfile:
+        profilePoints, profileBranches = ComputeDiameterProfiles(network, metrics, 
+            elementIds=elementIds)
+        WriteDiameterProfiles(fileNameProfile, profilePoints, profileBranches)
+        print "> Diameter profiles of %i branches (%i points) written in %s." \
+            % (len(profileBranches['element']), len(profilePoints['diameter']),
+               fileNameProfile.rsplit('/', 1)[-1])
+        print '{:^8}  {:^10}  {:^10}  {:^10}  {:^10}  {:^10}'.format('Element', 
+            'Length', 'Mean D', 'Min D', 'Min at', 'D 5th %')
+        for i in range(0, len(profileBranches['element'])):
+            print '{:^8d}  {:^10.3f}  {:^10.3f}  {:^10.3f}  {:^10.3f}  {:^10.3f}'. \
+                format(profileBranches['element'][i], profileBranches['length'][i],
+                    profileBranches['meanDiameter'][i], 
+                    profileBranches['minDiameter'][i],
+                    profileBranches['minDiameterArcLength'][i],
+                    profileBranches['diameterP5'][i])
+        print ">"
+
+    # Curvature, torsion and tortuosity of every branch.
+    if fileNameMorphometry:
+        morphometryPoints, morphometryBranches = ComputeMorphometry(network, 
+            metrics, smoothingIterations=smoothingIterations, 
+            elementIds=elementIds)
+        WriteMorphometry(fileNameMorphometry, morphometryPoints, 
+            morphometryBranches)
+        print "> Morphometry of %i branches (%i points) written in %s." \
+            % (len(morphometryBranches['element']), 
+               len(morphometryPoints['curvature']),
+               fileNameMorphometry.rsplit('/', 1)[-1])
+        print '{:^8}  {:^10}  {:^10}  {:^10}  {:^10}  {:^10}'.format('Element', 
+            'Length', 'Tortuosity', 'Mean curv.', 'Max curv.', 'Mean tors.')
+        for i in range(0, len(morphometryBranches['element'])):
+            print '{:^8d}  {:^10.3f}  {:^10.4f}  {:^10.4f}  {:^10.4f}  {:^10.4f}'. \
+                format(morphometryBranches['element'][i], 
+                    morphometryBranches['length'][i],
+                    morphometryBranches['tortuosity'][i], 
+                    morphometryBranches['meanCurvature'][i],
+                    morphometryBranches['maxCurvature'][i],
+                    morphometryBranches['meanTorsion'][i])
+        print ">"
+
+    # Angles, planarity and area ratio of every division.
+    if fileNameBifurcations:
+        bifurcations = ComputeBifurcationGeometry(network, metrics, 
+            nDiameter=directionRadii, 
+            PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+        isInSubtree = numpy.in1d(bifurcations['parent'], elementIds)
+        bifurcations = dict((key, value[isInSubtree]) 
+            for key, value in bifurcations.items())
+        WriteBifurcationGeometry(fileNameBifurcations, bifurcations)
+        print "> Geometry of %i divisions written in %s." \
+            % (len(set(bifurcations['division'])), 
+               fileNameBifurcations.rsplit('/', 1)[-1])
+        print '{:^8}  {:^8}  {:^8}  {:^10}  {:^10}  {:^10}  {:^10}'.format(
+            'Parent', 'Daughter', 'Division', 'Angle', 'Daughters', 
+            'Planarity', 'Area ratio')
+        for i in range(0, len(bifurcations['division'])):
+            print '{:^8d}  {:^8d}  {:^8d}  {:^10.2f}  {:^10.2f}  {:^10.2f}  {:^10.3f}'. \
+                format(bifurcations['parent'][i], bifurcations['daughter'][i],
+                    bifurcations['division'][i], 
+                    bifurcations['parentDaughterAngle'][i],
+                    bifurcations['daughtersAngle'][i],
+                    bifurcations['planarity'][i], 
+                    bifurcations['areaRatio'][i])
+        print ">"
 
-    labels = vtk.vtkActor2D()
-    labels.SetMapper(labelMapper)
-    labelMapper.SetLabelFormat("%2.2f mm")
+    if not(displayModel):
+        return
+
+    # Labels prioritized by diameter, the overlapping ones are hidden.
+    labels = VtkLabelHierarchy(polydata, labelFormat="%2.2f mm")
 
     # GUI text.
     text = ''
@@ -85,7 +186,7 @@ def Program(fileNameCenterline, fileNameModel, writeProbePoints,
     # Create the renderer
     renderer = vtk.vtkRenderer()
     renderer.AddActor(guiText.text)
-    renderer.AddActor(labels)
+    renderer.AddActor(labels.vtkActor)
     # Read 3D model if necessary.
     opacity = 1.0
     if not(fileNameModel == ''):
@@ -113,6 +214,48 @@ def Program(fileNameCenterline, fileNameModel, writeProbePoints,
     windowTitle = "Mean diameters - AneuTools version 0.0.1."
     DisplayModel().renderWindow(renderer, windowTitle)
 
+def ProgramQueue(inputDirectory, outputDirectory, queueDirectory, localRadii, 
+    verboseprint, leaseDuration=LEASEDURATION, fileNameProfile='', 
+    fileNameMorphometry='', fileNameBifurcations='', **parameters):
+    '''Compute the diameters of the centerlines of a directory, the cases 
+    being shared through a src.WorkQueue.WorkQueue by the nodes running on 
+    the same queue directory. The output files of each case are written in 
+    the output directory, prefixed by the case name.'''
+    fileNames = sorted(os.path.join(inputDirectory, f) 
+        for f in os.listdir(inputDirectory) if f[-3:] in ('vtk', 'vtp'))
+    if not(os.path.isdir(outputDirectory)):
+        try:
+            os.makedirs(outputDirectory)
+        except OSError:
+            # Created meanwhile by another node of the work queue.
+            if not(os.path.isdir(outputDirectory)):
+                raise
+    workQueue = WorkQueue(queueDirectory, leaseDuration=leaseDuration)
+    print "> %i cases added to the work queue." % workQueue.Submit(fileNames)
+
+    def OutputFileName(fileNameCenterline, fileName):
+        if not(fileName):
+            return ''
+        caseName = os.path.splitext(os.path.basename(fileNameCenterline))[0]
+        return os.path.join(outputDirectory, 
+            caseName + '_' + os.path.basename(fileName))
+
+    def ProcessFile(fileNameCenterline):
+        Program(fileNameCenterline, '', False, localRadii, verboseprint, 
+            fileNameProfile=OutputFileName(fileNameCenterline, fileNameProfile), 
+            fileNameMorphometry=OutputFileName(fileNameCenterline, 
+                fileNameMorphometry), 
+            fileNameBifurcations=OutputFileName(fileNameCenterline, 
+                fileNameBifurcations), 
+            displayModel=False, **parameters)
+
+    failures = ProcessQueue(workQueue, ProcessFile, verboseprint)
+    nTasks, nDone, nFailed = workQueue.GetStatus()
+    print "> Work queue: %i of %i cases done, %i failed (%i on this node)." \
+        % (nDone, nTasks, nFailed, len(failures))
+    for name, error in failures:
+        print ">   " + name + ": " + error
+
 
 if __name__ == "__main__":
         
@@ -131,6 +274,48 @@ if __name__ == "__main__":
     parser.add_argument('-localRadii', '--localRadii', required = False, default = 0, type=int,
         dest='localRadii', 
         help = "Instead of averaging a radius along the branches, a local radius can be computed.")
+    parser.add_argument('-resample', '--resampleSpacing', required = False, default = 0.0, type=float,
+        dest='resampleSpacing', 
+        help = "Resample the centerline cells with this spacing before the computations (0 to disable).")
+    parser.add_argument('-resampleRelative', '--resampleRelative', required = False, default = False, 
+        dest='resampleRelative', action = "store_true", 
+        help = "The resampling spacing is a fraction of the local radius instead of a length.")
+    parser.add_argument('-workers', '--numberOfWorkers', required = False, default = 1, type=int,
+        dest='numberOfWorkers', 
+        help = "Number of processes computing the centerline geometry, for very large centerlines.")
+    parser.add_argument('-profile', '--profile', type=str, required = False, default = '', 
+        dest='fileNameProfile', 
+        help = "Output npz file with the diameter versus arc length profile of every branch.")
+    parser.add_argument('-nd', '--notDisplayModel', required = False, default = True, 
+        dest='displayModel', action = "store_false", 
+        help = "Set this argument to not display the model and the diameters.")
+    parser.add_argument('-root', '--rootCellId', required = False, default = -1, 
+        type=int, dest='rootCellId', 
+        help = "Only compute the diameters downstream of the element holding this VTK cell.")
+    parser.add_argument('-rootPoint', '--rootPoint', required = False, default = None, 
+        type=float, nargs=3, dest='rootPoint', 
+        help = "Only compute the diameters downstream of the element nearest to this point.")
+    parser.add_argument('-morphometry', '--morphometry', type=str, required = False, default = '', 
+        dest='fileNameMorphometry', 
+        help = "Output npz file with the curvature and torsion of the points and the tortuosity of every branch.")
+    parser.add_argument('-smoothing', '--smoothingIterations', required = False, default = 0, type=int,
+        dest='smoothingIterations', 
+        help = "Number of Laplacian smoothing iterations of the centerline, resampled to a uniform spacing, before the morphometry.")
+    parser.add_argument('-bifurcations', '--bifurcations', type=str, required = False, default = '', 
+        dest='fileNameBifurcations', 
+        help = "Output csv file with the angles, planarity and area ratio of every bifurcation.")
+    parser.add_argument('-directionRadii', '--directionRadii', required = False, 
+        default = DIRECTIONRADII, type=float, dest='directionRadii', 
+        help = "Distance, in radii, of the points giving the branches directions at the bifurcations.")
+    parser.add_argument('-queue', '--queueDirectory', type=str, required = False, default = '', 
+        dest='queueDirectory', 
+        help = "Work queue directory on a shared filesystem: the input is a directory of centerlines whose cases are shared by the nodes running on the same queue.")
+    parser.add_argument('-o', '--outputDirectory', type=str, required = False, default = '', 
+        dest='outputDirectory', 
+        help = "Output directory of the work queue mode, the output files are prefixed by the case names.")
+    parser.add_argument('-lease', '--leaseDuration', required = False, default = LEASEDURATION, 
+        type=float, dest='leaseDuration', 
+        help = "Time (s) after which the cases claimed by a crashed node are claimed again.")
     args = parser.parse_args()
 
     if args.verbosity:
@@ -144,5 +329,31 @@ if __name__ == "__main__":
         verboseprint = lambda *a: None
 
     # Start the script.    
-    Program(args.fileNameCenterline, args.fileNameModel, args.writePoints, 
-        args.localRadii, verboseprint)
+    if args.queueDirectory:
+        if args.outputDirectory == '':
+            parser.error('the output directory (-o) is required with -queue.')
+        if not(args.fileNameProfile or args.fileNameMorphometry 
+            or args.fileNameBifurcations):
+            parser.error('an output (-profile, -morphometry or -bifurcations) '
+                'is required with -queue.')
+        ProgramQueue(args.fileNameCenterline, args.outputDirectory, 
+            args.queueDirectory, args.localRadii, verboseprint, 
+            leaseDuration=args.leaseDuration, 
+            fileNameProfile=args.fileNameProfile, 
+            fileNameMorphometry=args.fileNameMorphometry, 
+            fileNameBifurcations=args.fileNameBifurcations, 
+            resampleSpacing=args.resampleSpacing, 
+            resampleRelative=args.resampleRelative, 
+            numberOfWorkers=args.numberOfWorkers, 
+            smoothingIterations=args.smoothingIterations, 
+            directionRadii=args.directionRadii)
+    else:
+        Program(args.fileNameCenterline, args.fileNameModel, args.writePoints, 
+            args.localRadii, verboseprint, resampleSpacing=args.resampleSpacing, 
+            resampleRelative=args.resampleRelative, numberOfWorkers=args.numberOfWorkers, 
+            fileNameProfile=args.fileNameProfile, displayModel=args.displayModel, 
+            rootCellId=args.rootCellId, rootPoint=args.rootPoint, 
+            fileNameMorphometry=args.fileNameMorphometry, 
+            smoothingIterations=args.smoothingIterations, 
+            fileNameBifurcations=args.fileNameBifurcations, 
+            directionRadii=args.directionRadii)
@@ -7,12 +7,38 @@ import vtk
 
 
 import src.ImportData as ImportData
-from src.DisplayData import DisplayModel, VtkText
-from src.NetworkBoundaryConditions import FlowSplitting
+from src.CenterlineResampling import ResampleCenterline
+from src.DisplayData import DisplayModel, VtkText, VtkLabelHierarchy, VtkSlider
+from src.NetworkCoarsening import CoarsenNetwork, ExpandFlowSplitting
+from src.NetworkDiff import DiffNetworks, UpdateFlowSplitting, WriteNetworkDiff
+from src.NetworkBoundaryConditions import FlowSplitting, FlowSplittingUncertainty, \
+    FlowSplittingSensitivity, FlowSplittingExplorer
+from src.OutletWaveforms import LoadWaveform, ResampleWaveform, \
+    ScaleWaveformToInlet, WriteOutletWaveforms, ComputeMeanFlow
+from src.ResultStore import ResultStore, ComputeFileHash, GetNetworkTables
+from src.SubtreeEvaluation import SetSubtreeNetworkStructure
+from src.SurfaceSections import SetSurfaceSectionAreas, SetSectionMeanRadius, \
+    SetSectionLocalRadius
+from src.SurfaceCaps import ExtractSurfaceCaps, ComputeCapsFlowFractions, \
+    WriteCapsTable
+from src.WindkesselParameters import GetOutletsArrays, \
+    ComputeWindkesselParameters, WriteWindkesselParameters
 
 
 def Program(fileNameCenterline, fileNameModel, outputFlowrates, 
-    displayModel, localRadii, verboseprint):
+    displayModel, localRadii, verboseprint, uncertaintySamples=0, 
+    radiusError=0.1, perturbPoints=False, resampleSpacing=0.0, 
+    resampleRelative=False, numberOfWorkers=1, resultStoreFileName='', 
+    capsFileName='', waveformFileName='', waveformOutputFileName='', 
+    numberOfTimeSteps=0, inflowCoefficient=0.0, inflowExponent=1.0, 
+    pipeline=None, sensitivityRanking=0, coarsenNetwork=False, rootCellId=-1, 
+    rootPoint=None, compact=False, compactCheck=False, compareFileName='', 
+    compareOutputFileName='', rcrFileName='', meanInflow=0.0, 
+    meanPressure=0.0, totalCompliance=0.0, waveSpeed=0.0, density=0.0, 
+    surfaceSections=False):
+    '''Compute and display the outlets flow splitting of a centerline. In a
+    scripted session, a src.Pipeline.Pipeline can be passed and reused
+    between the calls to memoize the computation stages.'''
 
     print  
     print "--- Input files:" 
@@ -28,32 +54,190 @@ def Program(fileNameCenterline, fileNameModel, outputFlowrates,
     else:
         PowerLawUsesLocalRadii = False
 
-    # Load the centerline vtk data from the file 'fileNameCenterline'.
-    centerline = ImportData.loadFile(fileNameCenterline)
+    # Restriction to the subtree of a root element.
+    isSubtree = rootCellId >= 0 or rootPoint is not None
+    if isSubtree and (uncertaintySamples > 0 or sensitivityRanking > 0 
+        or coarsenNetwork or compareFileName):
+        raise RuntimeError('The uncertainty, sensitivity, coarsening and '
+            'comparison modes need the whole network, not a subtree.')
+    if compareFileName and coarsenNetwork:
+        # The comparison is done on the elements of the full network.
+        raise RuntimeError('The comparison (-compare) cannot be combined '
+            'with the coarsening of the network.')
+    if surfaceSections and (fileNameModel == '' or isSubtree or compareFileName):
+        raise RuntimeError('The surface sections need the surface model '
+            '(-iModel), on the whole network and without comparison.')
 
-    # Set the corresponding 0D network.
-    network = ImportData.Network()
-    ImportData.SetNetworkStructure(centerline, network, verboseprint, 
-        isConnectivityNeeded=True, isLocalRadiiNeeded=PowerLawUsesLocalRadii,
-        localRadii=localRadii)
+    # Serve the case from the result store if it was already computed.
+    store = None
+    result = None
+    if resultStoreFileName:
+        store = ResultStore(resultStoreFileName)
+        inputHash = ComputeFileHash(fileNameCenterline)
+        parameters = {'localRadii': localRadii}
+        if resampleSpacing > 0.0:
+            parameters['resampleSpacing'] = resampleSpacing
+            parameters['resampleRelative'] = resampleRelative
+        if coarsenNetwork:
+            parameters['coarsen'] = True
+        if compact:
+            parameters['compact'] = True
+        if surfaceSections:
+            parameters['surfaceSections'] = True
+        if rootCellId >= 0:
+            parameters['rootCellId'] = rootCellId
+        elif rootPoint is not None:
+            parameters['rootPoint'] = list(rootPoint)
+        # The network is not stored, only its tables.
+        if uncertaintySamples == 0 and inflowCoefficient == 0.0 \
+            and sensitivityRanking == 0 and not(compactCheck) \
+            and compareFileName == '':
+            result = store.GetRun(inputHash, parameters)
+            if result is not None:
+                print "Outlets flow splitting read from the result store."
+                print
+
+    centerline = None
+    network = None
+    model = None
+    if result is None and isSubtree:
+        # Only the subtree of the root, the path to the inlet and the 
+        # divisions of this path are connected and evaluated.
+        centerline = ImportData.loadFile(fileNameCenterline)
+        if resampleSpacing > 0.0:
+            centerline, resamplingReport = ResampleCenterline(centerline, 
+                resampleSpacing, verboseprint, relativeToRadius=resampleRelative)
+        network = ImportData.Network()
+        centerline, subtree = SetSubtreeNetworkStructure(centerline, network, 
+            verboseprint, rootCellId=rootCellId if rootCellId >= 0 else None, 
+            rootPoint=rootPoint, localRadii=localRadii, 
+            numberOfWorkers=numberOfWorkers, compact=compact)
+        rootInflow, fractions = subtree.ComputeFlowSplitting(verboseprint, 
+            PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+        print "Subtree of the element %i (VTK cell %i): %.2f %% of the inflow," \
+            % (subtree.rootId, network.elements[subtree.rootId].GetVtkCellIdList()[0],
+               100.0*rootInflow)
+        print "%i outlets, %i elements evaluated out of %i." % (
+            len(subtree.outletIds), len(subtree.evaluatedIds), len(network.elements))
+        print '{:^10}  {:^12}  {:^12}'.format('Outlet', '% root flow', '% outflow')
+        for Id, fraction in zip(subtree.outletIds, fractions):
+            print '{:^10d}  {:^12.2f}  {:^12.2f}'.format(Id, 100.0*fraction, 
+                100.0*rootInflow*fraction)
+        print
+        result = GetNetworkTables(network)
+        if store is not None:
+            store.AddRun(fileNameCenterline.rsplit('/', 1)[-1].rsplit('.', 1)[0], 
+                fileNameCenterline, inputHash, parameters, result)
+    if result is None and pipeline is not None and not(coarsenNetwork) \
+        and not(compact) and not(surfaceSections):
+        # Scripted use: only the stages depending on a changed input or
+        # parameter are recomputed.
+        stageParameters = {'fileName': fileNameCenterline, 
+            'resampleSpacing': resampleSpacing, 
+            'resampleRelative': resampleRelative, 'localRadii': localRadii}
+        centerline = pipeline.Run('split', stageParameters)
+        network = pipeline.Run('betas', stageParameters)
+        result = pipeline.Run('output', stageParameters)
+        if store is not None:
+            store.AddRun(fileNameCenterline.rsplit('/', 1)[-1].rsplit('.', 1)[0], 
+                fileNameCenterline, inputHash, parameters, result)
+    if result is None:
+        # Load the centerline vtk data from the file 'fileNameCenterline'.
+        centerline = ImportData.loadFile(fileNameCenterline)
+        if resampleSpacing > 0.0:
+            centerline, resamplingReport = ResampleCenterline(centerline, 
+                resampleSpacing, verboseprint, relativeToRadius=resampleRelative)
+
+        # Set the corresponding 0D network.
+        network = ImportData.Network()
+        centerline = ImportData.SetNetworkStructure(centerline, network, verboseprint, 
+            isConnectivityNeeded=True, isLocalRadiiNeeded=PowerLawUsesLocalRadii,
+            localRadii=localRadii, numberOfWorkers=numberOfWorkers, 
+            compact=compact)
+
+        # Mean radii of the true sections of the surface model instead of
+        # the inscribed spheres.
+        if surfaceSections:
+            model = ImportData.loadFile(fileNameModel)
+            metrics = network.GetCenterlineMetrics()
+            areas = SetSurfaceSectionAreas(model, metrics, verboseprint, 
+                numberOfWorkers=numberOfWorkers)
+            SetSectionMeanRadius(network, metrics, verboseprint)
+            if PowerLawUsesLocalRadii:
+                SetSectionLocalRadius(network, metrics, localRadii, 
+                    verboseprint)
+            print "Surface sections: %i of %i centerline points sliced." % (
+                numpy.count_nonzero(areas > 0.0), 
+                len(numpy.unique(metrics.cellPointIds)))
+            print
 
-    # Compute the outlet boundary conditions.
-    flowSplitting = FlowSplitting()
-    flowSplitting.ComputeAlphas(network, verboseprint, 
-        PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
-    flowSplitting.ComputeBetas(network, verboseprint)
-    flowSplitting.CheckTotalFlowRate(network, verboseprint)
+        # Compute the outlet boundary conditions, on the network where the
+        # chains of elements are collapsed if requested.
+        splitNetwork = network
+        if coarsenNetwork:
+            splitNetwork, fineToCoarse, chains = CoarsenNetwork(network, 
+                verboseprint)
+            print "Coarsened network: %i elements instead of %i." \
+                % (len(splitNetwork.elements), len(network.elements))
+        flowSplitting = FlowSplitting()
+        flowSplitting.ComputeAlphas(splitNetwork, verboseprint, 
+            PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+        flowSplitting.ComputeBetas(splitNetwork, verboseprint)
+        flowSplitting.CheckTotalFlowRate(splitNetwork, verboseprint)
+        if coarsenNetwork:
+            ExpandFlowSplitting(splitNetwork, network, chains)
+        if compact and compactCheck:
+            # Same computation in double precision, for comparison.
+            referenceNetwork = ImportData.Network()
+            ImportData.SetNetworkStructure(centerline, referenceNetwork, 
+                verboseprint, isConnectivityNeeded=True, 
+                isLocalRadiiNeeded=PowerLawUsesLocalRadii, 
+                localRadii=localRadii, numberOfWorkers=numberOfWorkers)
+            if surfaceSections:
+                # Same section areas, in double precision.
+                referenceMetrics = referenceNetwork.GetCenterlineMetrics()
+                referenceMetrics.sectionAreas = areas.astype(numpy.float64)
+                referenceMetrics.resistanceIndex = None
+                SetSectionMeanRadius(referenceNetwork, referenceMetrics, 
+                    verboseprint)
+                if PowerLawUsesLocalRadii:
+                    SetSectionLocalRadius(referenceNetwork, referenceMetrics, 
+                        localRadii, verboseprint)
+            referenceSplitNetwork = referenceNetwork
+            if coarsenNetwork:
+                referenceSplitNetwork, referenceFineToCoarse, referenceChains = \
+                    CoarsenNetwork(referenceNetwork, verboseprint)
+            referenceFlowSplitting = FlowSplitting()
+            referenceFlowSplitting.ComputeAlphas(referenceSplitNetwork, 
+                verboseprint, PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+            referenceFlowSplitting.ComputeBetas(referenceSplitNetwork, 
+                verboseprint)
+            if coarsenNetwork:
+                ExpandFlowSplitting(referenceSplitNetwork, referenceNetwork, 
+                    referenceChains)
+            difference = ImportData.CheckCompactMode(network, 
+                referenceNetwork, verboseprint)
+            nBytes, nBytes64 = network.GetCenterlineMetrics().GetMemoryUsage()
+            print "Compact mode: centerline arrays of %.1f MB instead of %.1f MB," \
+                % (nBytes / 1048576.0, nBytes64 / 1048576.0)
+            print "maximal outflow difference %.2e %% (tolerance %.2e %%)." \
+                % (100.0*difference, 100.0*ImportData.COMPACTTOLERANCE)
+            print
+        result = GetNetworkTables(network)
+        if store is not None:
+            store.AddRun(fileNameCenterline.rsplit('/', 1)[-1].rsplit('.', 1)[0], 
+                fileNameCenterline, inputHash, parameters, result)
+    if store is not None:
+        store.Close()
 
     # Outlets coords and outlets %.
     points = vtk.vtkPoints()
     scalar = vtk.vtkDoubleArray()
     scalarBis = vtk.vtkDoubleArray()
     scalar.SetNumberOfComponents(1)
-    for element in network.elements:
-        if not(element.IsAnOutlet()):
-            continue
-        points.InsertNextPoint(element.GetOutPointsx1()[0])
-        scalar.InsertNextValue(100.0*element.GetBeta())
+    for Id, x, y, z, beta in result['outlets']:
+        points.InsertNextPoint([x, y, z])
+        scalar.InsertNextValue(100.0*beta)
     polydata = vtk.vtkPolyData()
     polydata.SetPoints(points)
     polydata.GetPointData().SetScalars(scalar)
@@ -69,21 +253,147 @@ def Program(fileNameCenterline, fileNameModel, outputFlowrates,
                     GetScalars().GetTuple(i)[0])
         print
 
-    if displayModel:
-        labelMapper = vtk.vtkLabeledDataMapper()
-        if vtk.VTK_MAJOR_VERSION <= 5:
-            labelMapper.SetInputConnection(polydata.GetProducerPort())
-        else:
-            labelMapper.SetInputData(polydata)
-        labelMapper.SetLabelModeToLabelScalars()
+    if uncertaintySamples > 0:
+        uncertainty = FlowSplittingUncertainty(network, verboseprint, 
+            PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+        if perturbPoints:
+            uncertainty.SetPointRadiiSampling(centerline, network, verboseprint)
+        percentiles = uncertainty.ComputeBetaPercentiles(uncertaintySamples, 
+            radiusError, verboseprint, perturbPoints=perturbPoints)
+        print 'Outflow uncertainty: %i samples, radius relative error %g.' \
+            % (uncertaintySamples, radiusError)
+        print '{:^12}  {:^12}  {:^12} {:^12} {:^12} {:^12}'.format('X', 'Y', 'Z', 
+            '5th %', 'median %', '95th %')
+        for j, outletId in enumerate(uncertainty.outletIds):
+            x = network.elements[outletId].GetOutPointsx1()[0]
+            print '{:^12.4f}  {:^12.4f}  {:^12.4f} {:^12.2f} {:^12.2f} {:^12.2f}'. \
+                format(x[0], x[1], x[2], 100.0*percentiles[0, j], 
+                    100.0*percentiles[1, j], 100.0*percentiles[2, j])
+        print
+
+    if sensitivityRanking > 0:
+        sensitivity = FlowSplittingSensitivity(network, verboseprint, 
+            PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+        betas, rows, columns, elasticities = sensitivity.ComputeElasticities()
+        elementIds, influences = sensitivity.RankElements(
+            numberOfElements=sensitivityRanking)
+        print 'Elements radii ranked by influence on the outflows, sum over the'
+        print 'outlets of |d log(beta) / d log(radius)|:'
+        print '{:^10}  {:^12}  {:^12} {:^12}'.format('Element', 'VTK cell', 
+            'Radius', 'Influence')
+        for Id, influence in zip(elementIds, influences):
+            print '{:^10d}  {:^12d}  {:^12.4f} {:^12.4f}'.format(Id, 
+                network.elements[Id].GetVtkCellIdList()[0], 
+                sensitivity.radii[Id], influence)
+        print 'Most influential radius for each outlet:'
+        print '{:^10}  {:^12}  {:^12} {:^12}'.format('Outlet', '% outflow', 
+            'Element', 'd log(beta)')
+        for j, outletId in enumerate(sensitivity.outletIds):
+            entries = numpy.nonzero(rows == j)[0]
+            if len(entries) == 0:
+                continue
+            k = entries[numpy.argmax(numpy.abs(elasticities[entries]))]
+            print '{:^10d}  {:^12.2f}  {:^12d} {:^12.4f}'.format(outletId, 
+                100.0*betas[j], columns[k], elasticities[k])
+        print
+
+    # Outflows of a second centerline of the same vasculature (e.g. after 
+    # a treatment): only the divisions changed between the two networks 
+    # are recomputed.
+    if compareFileName:
+        otherCenterline = ImportData.loadFile(compareFileName)
+        if resampleSpacing > 0.0:
+            otherCenterline, resamplingReport = ResampleCenterline(
+                otherCenterline, resampleSpacing, verboseprint, 
+                relativeToRadius=resampleRelative)
+        otherNetwork = ImportData.Network()
+        ImportData.SetNetworkStructure(otherCenterline, otherNetwork, 
+            verboseprint, isConnectivityNeeded=True, 
+            isLocalRadiiNeeded=PowerLawUsesLocalRadii, localRadii=localRadii, 
+            numberOfWorkers=numberOfWorkers, compact=compact)
+        diff = DiffNetworks(network, otherNetwork, verboseprint, 
+            PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+        diffTable, nDivisions = UpdateFlowSplitting(network, otherNetwork, 
+            diff, verboseprint, PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+        print "Comparison with %s: %i removed, %i added and %i changed elements," \
+            % (compareFileName.rsplit('/', 1)[-1], len(diff['removed']), 
+               len(diff['added']), len(diff['changed']))
+        print "%i divisions recomputed." % nDivisions
+        print '{:^10}  {:^10}  {:^12}  {:^12} {:^12}'.format('Outlet', 
+            'Before', '% before', '% after', 'Change')
+        for IdAfter, IdBefore, betaBefore, betaAfter in diffTable:
+            print '{:^10d}  {:^10d}  {:^12.2f}  {:^12.2f} {:^+12.2f}'.format(
+                IdAfter, IdBefore, 100.0*betaBefore, 100.0*betaAfter, 
+                100.0*(betaAfter - betaBefore))
+        if compareOutputFileName:
+            WriteNetworkDiff(compareOutputFileName, diffTable)
+        print
+
+    # Flow rate waveform of every outlet.
+    if waveformFileName:
+        times, flow = LoadWaveform(waveformFileName)
+        period = times[-1] - times[0]
+        if numberOfTimeSteps > 0:
+            times, flow = ResampleWaveform(times, flow, numberOfTimeSteps)
+        if inflowCoefficient > 0.0:
+            flow = ScaleWaveformToInlet(times, flow, 
+                network.GetNetworkInletRadius(), inflowCoefficient, 
+                exponent=inflowExponent, period=period)
+        if waveformOutputFileName == '':
+            waveformOutputFileName = \
+                fileNameCenterline.rsplit('.', 1)[0] + '_outletsWaveforms.csv'
+        WriteOutletWaveforms(waveformOutputFileName, 
+            [row[0] for row in result['outlets']], 
+            [row[4] for row in result['outlets']], times, flow)
+        print "> Waveforms of %i outlets over %i time steps written in %s." \
+            % (len(result['outlets']), len(times), 
+               waveformOutputFileName.rsplit('/', 1)[-1])
+        print
 
-        labelProperties = labelMapper.GetLabelTextProperty()
-        labelProperties.SetFontFamilyToArial()
-        #tprop.SetColor(0.0,0.0,0.0)
+    # Lumped parameters of the outlets for the 3D solvers. The mean inflow
+    # is given, or the one of the inflow waveform, or the one of the inflow
+    # scaling law.
+    if rcrFileName:
+        elementIds, betas, areas, inletArea = GetOutletsArrays(result)
+        if meanInflow <= 0.0 and waveformFileName:
+            meanInflow = ComputeMeanFlow(times, flow, period=period)
+        elif meanInflow <= 0.0 and inflowCoefficient > 0.0:
+            meanInflow = inflowCoefficient*inletArea**inflowExponent
+        rcrParameters = ComputeWindkesselParameters(betas, areas, meanInflow, 
+            meanPressure, totalCompliance, waveSpeed=waveSpeed, density=density)
+        WriteWindkesselParameters(rcrFileName, elementIds, rcrParameters)
+        print "> RCR parameters of %i outlets (mean inflow %g) written in %s." \
+            % (len(elementIds), meanInflow, rcrFileName.rsplit('/', 1)[-1])
+        print "> Total resistance %g, proximal resistances %g to %g." % (
+            meanPressure / meanInflow, rcrParameters['proximalResistances'].min(), 
+            rcrParameters['proximalResistances'].max())
+        print
+
+    # Flow fractions of the open boundary caps of the surface model.
+    if capsFileName:
+        if fileNameModel == '':
+            raise RuntimeError('The caps matching needs the surface model (-iModel).')
+        if model is None:
+            model = ImportData.loadFile(fileNameModel)
+        caps = ExtractSurfaceCaps(model)
+        inletPoint = None
+        if network is not None:
+            inletPoint = network.elements[0].GetInPointsx0()[0]
+        capsTable, nUnmatched = ComputeCapsFlowFractions(caps, result['outlets'], 
+            inletPoint=inletPoint)
+        WriteCapsTable(capsFileName, capsTable)
+        print "> %i caps, %i outlets matched, written in %s." % (len(capsTable), 
+            len(result['outlets']) - nUnmatched, capsFileName.rsplit('/', 1)[-1])
+        if nUnmatched > 0:
+            print "> Warning: %i outlets without a surface cap." % nUnmatched
+        distances = [row[11] for row in capsTable if row[1] == 'outlet']
+        if distances:
+            print "> Maximum outlet to cap distance: %.4f." % max(distances)
+        print
 
-        labels = vtk.vtkActor2D()
-        labels.SetMapper(labelMapper)
-        labelMapper.SetLabelFormat("%2.2f %%")
+    if displayModel:
+        # Labels prioritized by outflow, the overlapping ones are hidden.
+        labels = VtkLabelHierarchy(polydata, labelFormat="%2.2f %%")
 
         # GUI text.
         text = ''
@@ -100,23 +410,68 @@ def Program(fileNameCenterline, fileNameModel, outputFlowrates,
         # Create the renderer
         renderer = vtk.vtkRenderer()
         renderer.AddActor(guiText.text)
-        renderer.AddActor(labels)
+        renderer.AddActor(labels.vtkActor)
 
         # Read 3D model if necessary.
         if not(fileNameModel == ''):
-            model = ImportData.loadFile(fileNameModel)
+            if model is None:
+                model = ImportData.loadFile(fileNameModel)
             opacity = 0.3
             renderer.AddActor(DisplayModel().polyDataToActor(model, opacity))
         else:
+            if centerline is None:
+                centerline = ImportData.loadFile(fileNameCenterline)
             renderer.AddActor(DisplayModel().polyDataToActor(centerline, 1.0))
         renderer.SetBackground(.2, .3, .4)
 
         # Set the lights of the renderer
         DisplayModel().setLight(renderer)
 
+        # Live update of the outflows with a slider for nDiameter, M 
+        # switching between the mean and the local radii. Only the betas 
+        # are recomputed and the labels updated in place.
+        setupInteractor = None
+        if network is not None and not(coarsenNetwork) and not(isSubtree):
+            explorer = FlowSplittingExplorer(network, verboseprint)
+            outletIds = [row[0] for row in result['outlets']]
+            state = {'nDiameter': localRadii if PowerLawUsesLocalRadii else 2.0, 
+                'isLocal': PowerLawUsesLocalRadii}
+
+            def UpdateFlowSplitting(renderWindow):
+                nDiameter = state['nDiameter'] if state['isLocal'] else 0.0
+                betas = explorer.ComputeBetas(nDiameter, outletIds)
+                for i in range(0, len(betas)):
+                    scalar.SetValue(i, 100.0*betas[i])
+                scalar.Modified()
+                labels.Update()
+                if state['isLocal']:
+                    mode = "Local radii at %.1f radii" % nDiameter
+                else:
+                    mode = "Mean radii"
+                guiText.text.SetInput(text + "\n" + mode 
+                    + ", M to switch the radii.")
+                renderWindow.Render()
+
+            def SetupInteractor(interactor, renderWindow):
+                def OnSlider(value):
+                    state['nDiameter'] = value
+                    state['isLocal'] = True
+                    UpdateFlowSplitting(renderWindow)
+                def OnKeyPress(caller, event):
+                    if caller.GetKeySym() in ('m', 'M'):
+                        state['isLocal'] = not(state['isLocal'])
+                        UpdateFlowSplitting(renderWindow)
+                state['slider'] = VtkSlider("nDiameter", 0.5, 10.0, 
+                    state['nDiameter'], OnSlider)
+                state['slider'].Attach(interactor)
+                interactor.AddObserver("KeyPressEvent", OnKeyPress)
+                UpdateFlowSplitting(renderWindow)
+            setupInteractor = SetupInteractor
+
         # Create the RenderWindow and RenderWindowInteractor
         windowTitle = "Percents of the inflow - AneuTool version 0.0.1."
-        DisplayModel().renderWindow(renderer, windowTitle)
+        DisplayModel().renderWindow(renderer, windowTitle, 
+            setupInteractor=setupInteractor)
 
 if __name__ == "__main__":
         
@@ -138,6 +493,90 @@ if __name__ == "__main__":
     parser.add_argument('-localRadii', '--localRadii', required = False, default = 0, type=int,
         dest='localRadii', 
         help = "Instead of averaging a radius along the branches, a local radius can be computed.")
+    parser.add_argument('-uncertainty', '--uncertaintySamples', required = False, default = 0, type=int,
+        dest='uncertaintySamples', 
+        help = "Number of Monte Carlo samples of perturbed radii used to compute the outflow percentiles.")
+    parser.add_argument('-radiusError', '--radiusError', required = False, default = 0.1, type=float,
+        dest='radiusError', 
+        help = "Relative standard deviation of the radii perturbation for the uncertainty mode.")
+    parser.add_argument('-perturbPoints', '--perturbPoints', required = False, default = False, 
+        dest='perturbPoints', action = "store_true", 
+        help = "Perturb the centerline points radii before averaging instead of the branches radii.")
+    parser.add_argument('-resample', '--resampleSpacing', required = False, default = 0.0, type=float,
+        dest='resampleSpacing', 
+        help = "Resample the centerline cells with this spacing before the computations (0 to disable).")
+    parser.add_argument('-resampleRelative', '--resampleRelative', required = False, default = False, 
+        dest='resampleRelative', action = "store_true", 
+        help = "The resampling spacing is a fraction of the local radius instead of a length.")
+    parser.add_argument('-workers', '--numberOfWorkers', required = False, default = 1, type=int,
+        dest='numberOfWorkers', 
+        help = "Number of processes computing the centerline geometry, for very large centerlines.")
+    parser.add_argument('-store', '--resultStore', type = str, required = False,
+        default = '', dest = 'resultStoreFileName',
+        help = "SQLite file storing the results. A case already stored is not recomputed.")
+    parser.add_argument('-caps', '--capsFile', type = str, required = False,
+        default = '', dest = 'capsFileName',
+        help = "Output csv file with the outflow of each open boundary cap of the model (needs -iModel).")
+    parser.add_argument('-waveform', '--waveform', type = str, required = False,
+        default = '', dest = 'waveformFileName',
+        help = "Inflow waveform file (two columns: time, flow rate). The outlets flow rates are written.")
+    parser.add_argument('-waveformOut', '--waveformOutput', type = str, required = False,
+        default = '', dest = 'waveformOutputFileName',
+        help = "Output file of the outlets flow rates, csv or npy (default: next to the centerline).")
+    parser.add_argument('-timeSteps', '--timeSteps', required = False, default = 0, type=int,
+        dest='numberOfTimeSteps', 
+        help = "Resample the inflow waveform on this number of time steps (0 to keep it).")
+    parser.add_argument('-inflowCoefficient', '--inflowCoefficient', required = False, 
+        default = 0.0, type=float, dest='inflowCoefficient', 
+        help = "Scale the mean inflow to coefficient * (inlet area)^exponent (0 to keep the waveform).")
+    parser.add_argument('-inflowExponent', '--inflowExponent', required = False, 
+        default = 1.0, type=float, dest='inflowExponent', 
+        help = "Exponent of the inlet area in the inflow scaling law.")
+    parser.add_argument('-sensitivity', '--sensitivity', required = False, default = 0, 
+        type=int, dest='sensitivityRanking', 
+        help = "Print this number of elements whose radius most influences the outflows.")
+    parser.add_argument('-coarsen', '--coarsen', required = False, default = False, 
+        dest='coarsenNetwork', action = "store_true", 
+        help = "Collapse the chains of non-bifurcating elements before the flow splitting (equivalent radii).")
+    parser.add_argument('-root', '--rootCellId', required = False, default = -1, 
+        type=int, dest='rootCellId', 
+        help = "Only compute the flow splitting downstream of the element holding this VTK cell.")
+    parser.add_argument('-rootPoint', '--rootPoint', required = False, default = None, 
+        type=float, nargs=3, dest='rootPoint', 
+        help = "Only compute the flow splitting downstream of the element nearest to this point.")
+    parser.add_argument('-compact', '--compact', required = False, default = False, 
+        dest='compact', action = "store_true", 
+        help = "Store the centerline arrays in single precision and 32 bits ids (whole-brain centerlines).")
+    parser.add_argument('-compactCheck', '--compactCheck', required = False, default = False, 
+        dest='compactCheck', action = "store_true", 
+        help = "With -compact, also compute in double precision and check the outflows differences.")
+    parser.add_argument('-compare', '--compare', type = str, required = False,
+        default = '', dest = 'compareFileName',
+        help = "Second centerline of the same vessels (e.g. after treatment): print the outflows changes.")
+    parser.add_argument('-compareOut', '--compareOutput', type = str, required = False,
+        default = '', dest = 'compareOutputFileName',
+        help = "Output csv file of the outflows changes of the comparison mode.")
+    parser.add_argument('-rcr', '--rcrFile', type = str, required = False,
+        default = '', dest = 'rcrFileName',
+        help = "Output file of the outlets RCR parameters, csv or rcrt.dat ('.dat').")
+    parser.add_argument('-meanInflow', '--meanInflow', required = False, default = 0.0, 
+        type=float, dest='meanInflow', 
+        help = "Mean inflow of the RCR parameters (default: mean of the waveform or of the inflow law).")
+    parser.add_argument('-meanPressure', '--meanPressure', required = False, default = 0.0, 
+        type=float, dest='meanPressure', 
+        help = "Target mean pressure of the RCR parameters.")
+    parser.add_argument('-compliance', '--totalCompliance', required = False, default = 0.0, 
+        type=float, dest='totalCompliance', 
+        help = "Total compliance distributed to the outlets in proportion of their flows.")
+    parser.add_argument('-waveSpeed', '--waveSpeed', required = False, default = 0.0, 
+        type=float, dest='waveSpeed', 
+        help = "Wave speed of the proximal resistances rho c / A (0: fixed fraction of the resistance).")
+    parser.add_argument('-density', '--density', required = False, default = 0.0, 
+        type=float, dest='density', 
+        help = "Blood density of the proximal resistances, needed with -waveSpeed, in the length unit of the centerline (e.g. 1.06e-6 kg/mm^3).")
+    parser.add_argument('-sections', '--surfaceSections', required = False, default = False, 
+        dest='surfaceSections', action = "store_true", 
+        help = "Use the areas of the sections of the model (-iModel) normal to the centerline instead of the inscribed spheres radii.")
     args = parser.parse_args()
 
     if args.verbosity:
@@ -152,4 +591,20 @@ if __name__ == "__main__":
 
     # Start the script.    
     Program(args.fileNameCenterline, args.fileNameModel, args.writePoints, 
-        args.displayModel, args.localRadii, verboseprint)
+        args.displayModel, args.localRadii, verboseprint, 
+        uncertaintySamples=args.uncertaintySamples, radiusError=args.radiusError, 
+        perturbPoints=args.perturbPoints, resampleSpacing=args.resampleSpacing, 
+        resampleRelative=args.resampleRelative, numberOfWorkers=args.numberOfWorkers, 
+        resultStoreFileName=args.resultStoreFileName, 
+        capsFileName=args.capsFileName, waveformFileName=args.waveformFileName, 
+        waveformOutputFileName=args.waveformOutputFileName, 
+        numberOfTimeSteps=args.numberOfTimeSteps, 
+        inflowCoefficient=args.inflowCoefficient, inflowExponent=args.inflowExponent, 
+        sensitivityRanking=args.sensitivityRanking, 
+        coarsenNetwork=args.coarsenNetwork, rootCellId=args.rootCellId, 
+        rootPoint=args.rootPoint, compact=args.compact, 
+        compactCheck=args.compactCheck, compareFileName=args.compareFileName, 
+        compareOutputFileName=args.compareOutputFileName, 
+        rcrFileName=args.rcrFileName, meanInflow=args.meanInflow, 
+        meanPressure=args.meanPressure, totalCompliance=args.totalCompliance, 
+        waveSpeed=args.waveSpeed, density=args.density, surfaceSections=args.surfaceSections)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import argparse
+import multiprocessing
+import os
+
+import src.ImportData as ImportData
+
+CENTERLINEFILETYPES = ('vtk', 'vtp')
+
+
+def SplitFile(arguments):
+    '''Split one centerline file and return a status message.
+
+    The split centerline is stored in the cache, and also written in the
+    output directory if one is given. Files that are already split are
+    skipped.
+
+    '''
+    fileName, outputDirectory, cacheDirectory = arguments
+    verboseprint = lambda *a: None
+    centerline = ImportData.loadFile(fileName)
+    if ImportData.IsArrayDefined(centerline, ImportData.GROUPIDSARRAYNAME):
+        return '> Already split: ' + fileName.rsplit('/', 1)[-1]
+    splitCenterline = ImportData.SplitCenterline(centerline, verboseprint,
+        cacheDirectory=cacheDirectory, isPreprocessing=True)
+    if outputDirectory:
+        baseName = os.path.splitext(os.path.basename(fileName))[0]
+        ImportData.writeFile(splitCenterline,
+            os.path.join(outputDirectory, baseName + '_split.vtp'))
+
+    return '> Split: ' + fileName.rsplit('/', 1)[-1]
+
+def Program(inputDirectory, outputDirectory, cacheDirectory, numberOfWorkers,
+    verboseprint):
+
+    fileNames = sorted(os.path.join(inputDirectory, f)
+        for f in os.listdir(inputDirectory)
+        if f[-3:] in CENTERLINEFILETYPES)
+    print(">")
+    print("> --- Splitting %i centerline files with %i workers."
+        % (len(fileNames), numberOfWorkers))
+    if outputDirectory and not(os.path.isdir(outputDirectory)):
+        os.makedirs(outputDirectory)
+    tasks = [(fileName, outputDirectory, cacheDirectory)
+        for fileName in fileNames]
+    pool = multiprocessing.Pool(numberOfWorkers)
+    try:
+        for message in pool.imap_unordered(SplitFile, tasks):
+            verboseprint(message)
+    finally:
+        pool.close()
+        pool.join()
+    print("> Done.")
+
+
+if __name__ == "__main__":
+
+    '''Command-line arguments.'''
+    parser = argparse.ArgumentParser(
+        description = "GetMeSplitCenterlines: split a directory of centerlines into branches ahead of time.")
+    parser.add_argument('-v', '--verbosity',  action = "store_true", dest='verbosity',
+        default = False, help = "Activates the verbose mode.")
+    parser.add_argument('-i', '--inputDirectory', type = str, required = True, dest = 'inputDirectory',
+        help = "Directory containing the centerlines files in a vtk compliant format.")
+    parser.add_argument('-o', '--outputDirectory', type = str, required = False, default = '',
+        dest = 'outputDirectory',
+        help = "Directory where the split centerlines are written. They are always stored in the cache.")
+    parser.add_argument('-cache', '--cacheDirectory', type = str, required = False,
+        default = ImportData.BRANCHCACHEDIRECTORY, dest = 'cacheDirectory',
+        help = "Directory of the split centerlines cache.")
+    parser.add_argument('-n', '--numberOfWorkers', type = int, required = False,
+        default = multiprocessing.cpu_count(), dest = 'numberOfWorkers',
+        help = "Number of parallel processes.")
+    args = parser.parse_args()
+
+    if args.verbosity:
+        print(">")
+        print("> --- VERBOSE MODE ACTIVATED ---")
+        def verboseprint(*args):
+            for arg in args:
+                print(arg)
+    else:
+        verboseprint = lambda *a: None
+
+    # Start the script.
+    Program(args.inputDirectory, args.outputDirectory, args.cacheDirectory,
+        args.numberOfWorkers, verboseprint)
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import os
+
+import numpy as np
+
+# Distance, in radii of the bifurcation extremity, of the point giving the
+# direction of a branch (as nDiameter in GetIndexCenterlineForADefinedLength
+# with isDirectionNeeded).
+DIRECTIONRADII = 1.0
+
+
+def GetPointsAtDistance(metrics, cellIds, distances, fromEnd):
+    '''Return the coordinates of the points of cells at an arc length
+    distance of their first point (or of their last point where fromEnd),
+    all the cells at once. The point is the first one reaching the
+    distance, the cell extremity if the cell is shorter.'''
+    arcLength = metrics.GetResistanceIndex().arcLength
+    cellIds = np.asarray(cellIds, dtype=np.int64)
+    firstSlots = metrics.cellOffsets[cellIds]
+    lastSlots = metrics.cellOffsets[cellIds + 1] - 1
+    fromEnd = np.asarray(fromEnd, dtype=bool)
+    slots = np.where(fromEnd,
+        np.searchsorted(arcLength, arcLength[lastSlots] - distances,
+            side='right') - 1,
+        np.searchsorted(arcLength, arcLength[firstSlots] + distances,
+            side='left'))
+    slots = np.clip(slots, firstSlots, lastSlots)
+    return np.asarray(metrics.points[metrics.cellPointIds[slots]],
+        dtype=np.float64)
+
+def _Angles(u, v):
+    '''Angles in degrees between the unit vectors of two arrays.'''
+    return np.degrees(np.arccos(np.clip((u*v).sum(axis=1), -1.0, 1.0)))
+
+def _Normalize(vectors):
+    norms = np.sqrt((vectors**2.0).sum(axis=1))
+    return vectors / np.maximum(norms, 1e-300)[:, np.newaxis]
+
+def ComputeBifurcationGeometry(network, metrics, nDiameter=DIRECTIONRADII,
+    PowerLawUsesLocalRadii=False):
+    '''Return the geometry of all the divisions of a network.
+
+    A division is made of the blanked elements sharing their x0 point, as
+    grouped by FlowSplitting.ComputeAlphas; its parent is the element
+    behind them and its daughters the elements in front of them. The
+    direction of the parent is the one from its point at nDiameter radii
+    from its end to its end, and the direction of a daughter the one from
+    its first point to its point at nDiameter radii, the radius being the
+    one of the bifurcation extremity. All the divisions are computed at
+    once. Returns a dictionary of columns, one row per daughter: division
+    index, parent, daughter and blanked elements, bifurcation point, angle
+    between the parent and daughter directions (0 for a straight
+    continuation), daughter area, and for its division the parent area,
+    the area ratio sum(daughters areas) / parent area, the largest angle
+    between two daughters and the planarity angle (angle between the
+    parent direction and the plane of the two largest daughters, 0 for a
+    planar bifurcation). The areas are the mean areas, or the local areas
+    with PowerLawUsesLocalRadii.
+
+    '''
+    elements = network.elements
+    divisions = {}
+    for el in elements:
+        if el.IsBlanked() and el.GetBehindSegment() is not None:
+            divisions.setdefault(el.GetInPointsx0Id(), []).append(el.GetId())
+    divisionMembers = [sorted(members) for key, members in
+        sorted(divisions.items())]
+    if len(divisionMembers) == 0:
+        raise RuntimeError('The network has no division.')
+
+    def Area(el):
+        if PowerLawUsesLocalRadii:
+            return el.GetLocalArea()
+        return el.GetMeanArea()
+
+    blankedIds = np.array([Id for members in divisionMembers for Id in members],
+        dtype=np.int64)
+    rows = np.repeat(np.arange(len(divisionMembers)),
+        [len(members) for members in divisionMembers])
+    daughterIds = np.array([Id if elements[Id].GetFrontSegment() is None
+        else elements[Id].GetFrontSegment() for Id in blankedIds],
+        dtype=np.int64)
+    parentIds = np.array([elements[members[0]].GetBehindSegment()
+        for members in divisionMembers], dtype=np.int64)
+    daughterAreas = np.array([Area(elements[Id]) for Id in daughterIds])
+    parentAreas = np.array([Area(elements[Id]) for Id in parentIds])
+
+    # Directions, from the points at nDiameter radii of the bifurcation.
+    parentCells = np.array([elements[Id].GetVtkCellIdList()[0]
+        for Id in parentIds], dtype=np.int64)
+    daughterCells = np.array([elements[Id].GetVtkCellIdList()[0]
+        for Id in daughterIds], dtype=np.int64)
+    parentEnds = np.asarray(metrics.lastPoints[parentCells], dtype=np.float64)
+    parentDirections = _Normalize(parentEnds - GetPointsAtDistance(metrics,
+        parentCells, nDiameter*metrics.lastPointRadii[parentCells],
+        np.ones(len(parentCells), dtype=bool)))
+    daughterStarts = np.asarray(metrics.firstPoints[daughterCells],
+        dtype=np.float64)
+    daughterDirections = _Normalize(GetPointsAtDistance(metrics,
+        daughterCells, nDiameter*metrics.firstPointRadii[daughterCells],
+        np.zeros(len(daughterCells), dtype=bool)) - daughterStarts)
+    parentDaughterAngles = _Angles(parentDirections[rows], daughterDirections)
+
+    # Pairs of daughters of each division.
+    firstDaughters = []
+    secondDaughters = []
+    offsets = np.concatenate(([0], np.cumsum(np.bincount(rows))))
+    for i in range(0, len(divisionMembers)):
+        for j in range(offsets[i], offsets[i + 1]):
+            for k in range(j + 1, offsets[i + 1]):
+                firstDaughters.append(j)
+                secondDaughters.append(k)
+    firstDaughters = np.array(firstDaughters, dtype=np.int64)
+    secondDaughters = np.array(secondDaughters, dtype=np.int64)
+    pairAngles = _Angles(daughterDirections[firstDaughters],
+        daughterDirections[secondDaughters])
+    daughtersAngles = np.zeros(len(divisionMembers))
+    np.maximum.at(daughtersAngles, rows[firstDaughters], pairAngles)
+
+    # Planarity: plane of the two largest daughters of each division.
+    order = np.lexsort((-daughterAreas, rows))
+    largest = order[offsets[:-1]]
+    second = order[np.minimum(offsets[:-1] + 1, offsets[1:] - 1)]
+    normals = np.cross(daughterDirections[largest], daughterDirections[second])
+    norms = np.sqrt((normals**2.0).sum(axis=1))
+    planarity = np.zeros(len(divisionMembers))
+    hasPlane = norms > 1e-12
+    planarity[hasPlane] = np.degrees(np.arcsin(np.clip(np.abs(
+        (parentDirections[hasPlane]*normals[hasPlane]).sum(axis=1))
+        / norms[hasPlane], 0.0, 1.0)))
+
+    areaRatios = np.bincount(rows, weights=daughterAreas) / parentAreas
+    return {'division': rows.astype(np.int32),
+            'parent': parentIds[rows].astype(np.int32),
+            'daughter': daughterIds.astype(np.int32),
+            'blanked': blankedIds.astype(np.int32),
+            'x': parentEnds[rows, 0],
+            'y': parentEnds[rows, 1],
+            'z': parentEnds[rows, 2],
+            'parentDaughterAngle': parentDaughterAngles,
+            'daughterArea': daughterAreas,
+            'parentArea': parentAreas[rows],
+            'areaRatio': areaRatios[rows],
+            'daughtersAngle': daughtersAngles[rows],
+            'planarity': planarity[rows]}
+
+def WriteBifurcationGeometry(fileName, table):
+    '''Write the table of ComputeBifurcationGeometry in a csv file,
+    atomically.'''
+    temporaryFileName = '%s.%i.tmp' % (fileName, os.getpid())
+    columns = ('division', 'parent', 'daughter', 'blanked', 'x', 'y', 'z',
+        'parentDaughterAngle', 'daughterArea', 'parentArea', 'areaRatio',
+        'daughtersAngle', 'planarity')
+    outputFile = open(temporaryFileName, 'w')
+    try:
+        outputFile.write(','.join(columns) + '\n')
+        for i in range(0, len(table['division'])):
+            outputFile.write('%i,%i,%i,%i,%.6f,%.6f,%.6f,%.4f,%.6f,%.6f,%.6f,'
+                '%.4f,%.4f\n' % tuple(table[name][i] for name in columns))
+    finally:
+        outputFile.close()
+    os.rename(temporaryFileName, fileName)
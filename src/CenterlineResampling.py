@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk, \
+    numpy_to_vtkIdTypeArray
+
+from . import ImportData
+
+
+def ResampleCenterline(centerline, spacing, verboseprint,
+    relativeToRadius=False):
+    '''Resample each cell of a centerline with a uniform spacing.
+
+    The points of each cell are replaced by points equally spaced along its
+    arc length, the first and last points being kept so that the
+    connectivity is unchanged. With relativeToRadius, the spacing is a
+    fraction of the local radius: the points are equally spaced in the
+    coordinate integral(ds / r). The coordinates and all the point data
+    arrays (radius, section area, ...) are linearly interpolated in one
+    numpy pass and the cell data arrays (GroupIds, Blanking, ...) are
+    copied. Returns the resampled centerline and a report with the points
+    reduction and the change of the cells hydraulic resistance radii.
+
+    '''
+    if spacing <= 0.0:
+        raise RuntimeError('The resampling spacing should be positive.')
+    metrics = ImportData.CenterlineMetrics(centerline)
+    nCells = metrics.numberOfCells
+    nPoints = np.diff(metrics.cellOffsets)
+
+    # Coordinate along each cell (arc length or integral of ds/r). A gap
+    # is left between the cells so that the global coordinate is strictly
+    # increasing from one cell to the next.
+    increments = metrics.segmentLengths
+    if relativeToRadius:
+        increments = increments / metrics.segmentRadii
+    slotIncrements = np.ones(len(metrics.cellPointIds))
+    isSegmentStart = np.ones(len(metrics.cellPointIds), dtype=bool)
+    isSegmentStart[metrics.cellOffsets[1:] - 1] = False
+    slotIncrements[isSegmentStart] = increments
+    coordinate = np.concatenate(([0.0], np.cumsum(slotIncrements)[:-1]))
+    firstSlots = metrics.cellOffsets[:-1]
+    lastSlots = metrics.cellOffsets[1:] - 1
+    cellExtents = coordinate[lastSlots] - coordinate[firstSlots]
+
+    # New points per cell, the extremities being kept.
+    newPoints = np.where(nPoints > 1,
+        np.maximum(2, np.ceil(cellExtents / spacing).astype(np.int64) + 1), 1)
+    newOffsets = np.concatenate(([0], np.cumsum(newPoints)))
+    newCells = np.repeat(np.arange(nCells), newPoints)
+    rank = np.arange(newOffsets[-1]) - newOffsets[newCells]
+    fraction = rank / np.maximum(newPoints[newCells] - 1, 1).astype(np.float64)
+    targets = coordinate[firstSlots[newCells]] + fraction*cellExtents[newCells]
+
+    # Linear interpolation weights between the slots k and k + 1.
+    slots = np.searchsorted(coordinate, targets, side='right') - 1
+    slots = np.clip(slots, firstSlots[newCells],
+        np.maximum(firstSlots[newCells], lastSlots[newCells] - 1))
+    nextSlots = np.minimum(slots + 1, lastSlots[newCells])
+    width = coordinate[nextSlots] - coordinate[slots]
+    weights = np.zeros(len(targets))
+    hasWidth = width > 0.0
+    weights[hasWidth] = (targets[hasWidth] - coordinate[slots][hasWidth]) \
+        / width[hasWidth]
+    weights = np.clip(weights, 0.0, 1.0)
+    ids0 = metrics.cellPointIds[slots]
+    ids1 = metrics.cellPointIds[nextSlots]
+
+    def Interpolate(values):
+        if values.ndim == 1:
+            return (1.0 - weights)*values[ids0] + weights*values[ids1]
+        return (1.0 - weights)[:, np.newaxis]*values[ids0] + \
+            weights[:, np.newaxis]*values[ids1]
+
+    # New polydata.
+    resampled = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_to_vtk(Interpolate(metrics.points), deep=1))
+    resampled.SetPoints(points)
+    connectivity = np.insert(np.arange(newOffsets[-1]),
+        newOffsets[:-1], newPoints).astype(np.int64)
+    cells = vtk.vtkCellArray()
+    cells.SetCells(nCells, numpy_to_vtkIdTypeArray(connectivity, deep=1))
+    resampled.SetLines(cells)
+    pointData = centerline.GetPointData()
+    for i in range(0, pointData.GetNumberOfArrays()):
+        array = pointData.GetArray(i)
+        if array is None:
+            continue
+        values = vtk_to_numpy(array).astype(np.float64)
+        newArray = numpy_to_vtk(Interpolate(values), deep=1,
+            array_type=vtk.VTK_DOUBLE)
+        newArray.SetName(pointData.GetArrayName(i))
+        resampled.GetPointData().AddArray(newArray)
+    resampled.GetCellData().DeepCopy(centerline.GetCellData())
+
+    # Report.
+    newMetrics = ImportData.CenterlineMetrics(resampled)
+    radiusChange = np.abs(newMetrics.resistanceRadii - metrics.resistanceRadii) \
+        / metrics.resistanceRadii
+    report = {
+        'originalNumberOfPoints': int(len(metrics.cellPointIds)),
+        'numberOfPoints': int(newOffsets[-1]),
+        'maxRadiusRelativeChange': float(radiusChange.max()) if nCells else 0.0,
+        'meanRadiusRelativeChange': float(radiusChange.mean()) if nCells else 0.0}
+    report['pointsReduction'] = 1.0 - float(report['numberOfPoints']) \
+        / max(1, report['originalNumberOfPoints'])
+    print('> Resampling: %i points -> %i points (%.1f %% reduction).'
+        % (report['originalNumberOfPoints'], report['numberOfPoints'],
+           100.0*report['pointsReduction']))
+    print('> Resampling: radii relative change, mean %.2e, max %.2e.'
+        % (report['meanRadiusRelativeChange'], report['maxRadiusRelativeChange']))
+
+    return resampled, report
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import multiprocessing
+import os
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+from . import ImportData
+from .NetworkBoundaryConditions import FlowSplitting
+from .ResultStore import GetNetworkTables
+from .WorkQueue import POLLINTERVAL
+
+
+def GetCaseName(fileName):
+    return os.path.splitext(os.path.basename(fileName))[0]
+
+def ProcessOutletsCase(centerline, parameters):
+    '''Compute the outlets flow splitting of one case.
+
+    parameters is a dictionary with the key 'localRadii' (0 for the mean
+    radii). Returns a dictionary with the outlets table (x, y, z, beta)
+    and the elements table (id, VTK cell id, blanking, outlet, length,
+    mean radius, local radius, alpha, beta).
+
+    '''
+    verboseprint = lambda *a: None
+    localRadii = float(parameters.get('localRadii', 0.0))
+    PowerLawUsesLocalRadii = localRadii > 0.0
+    network = ImportData.Network()
+    centerline = ImportData.SetNetworkStructure(centerline, network,
+        verboseprint, isConnectivityNeeded=True,
+        isLocalRadiiNeeded=PowerLawUsesLocalRadii, localRadii=localRadii)
+    flowSplitting = FlowSplitting()
+    flowSplitting.ComputeAlphas(network, verboseprint,
+        PowerLawUsesLocalRadii=PowerLawUsesLocalRadii)
+    flowSplitting.ComputeBetas(network, verboseprint)
+    flowSplitting.CheckTotalFlowRate(network, verboseprint)
+
+    return GetNetworkTables(network)
+
+def WriteOutletsTable(fileName, result):
+    '''Write the outlets table of a case in a csv file, atomically.'''
+    temporaryFileName = '%s.%i.tmp' % (fileName, os.getpid())
+    outputFile = open(temporaryFileName, 'w')
+    try:
+        outputFile.write('element,x,y,z,percent_outflow\n')
+        for Id, x, y, z, beta in result['outlets']:
+            outputFile.write('%i,%.6f,%.6f,%.6f,%.6f\n'
+                % (Id, x, y, z, 100.0*beta))
+    finally:
+        outputFile.close()
+    os.rename(temporaryFileName, fileName)
+
+def _Worker(taskQueue, resultQueue, processCase, parameters, prefetch,
+    claimQueue=None, workerIndex=0):
+    '''Load and process the cases of the task queue.
+
+    A reader thread loads the next cases in a bounded queue while the
+    current case is computed. The reader stops taking tasks when the
+    queue is full, which caps the memory of the worker. The cases taken
+    are reported in claimQueue (workerIndex, fileName), if any, so that
+    the cases of a worker which died can be reported.
+
+    '''
+    loaded = queue.Queue(maxsize=prefetch)
+
+    def Reader():
+        while True:
+            fileName = taskQueue.get()
+            if fileName is None:
+                loaded.put(None)
+                return
+            if claimQueue is not None:
+                claimQueue.put((workerIndex, fileName))
+            try:
+                loaded.put((fileName, ImportData.loadFile(fileName), None))
+            except Exception as error:
+                loaded.put((fileName, None, repr(error)))
+
+    reader = threading.Thread(target=Reader)
+    reader.daemon = True
+    reader.start()
+    while True:
+        item = loaded.get()
+        if item is None:
+            break
+        fileName, centerline, error = item
+        start = time.time()
+        result = None
+        if error is None:
+            try:
+                result = processCase(centerline, parameters)
+            except Exception as exception:
+                error = repr(exception)
+        del centerline
+        resultQueue.put((fileName, result, error, time.time() - start))
+    resultQueue.put(None)
+
+
+class CohortPipeline(object):
+    '''Streaming execution of a case processing over a cohort.
+
+    Each of the numberOfWorkers processes overlaps the reading of its next
+    cases (at most prefetch cases in memory) with the computation of the
+    current one. The results are handed to writeResult(fileName, result)
+    in the main process as soon as they complete, with a progress report.
+
+    '''
+
+    def __init__(self, processCase, writeResult, verboseprint,
+        numberOfWorkers=1, prefetch=2):
+        self.processCase = processCase
+        self.writeResult = writeResult
+        self.verboseprint = verboseprint
+        self.numberOfWorkers = max(1, numberOfWorkers)
+        self.prefetch = max(1, prefetch)
+
+    def _StartWorkers(self, parameters, claimQueue=None):
+        taskQueue = multiprocessing.Queue()
+        resultQueue = multiprocessing.Queue(
+            maxsize=self.numberOfWorkers*self.prefetch)
+        workers = [multiprocessing.Process(target=_Worker,
+            args=(taskQueue, resultQueue, self.processCase, parameters,
+                self.prefetch, claimQueue, i))
+            for i in range(0, self.numberOfWorkers)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        return taskQueue, resultQueue, workers
+
+    def Run(self, fileNames, parameters, pollInterval=POLLINTERVAL):
+        '''Process all the files. Returns the list of (fileName, error)
+        of the failed cases.
+
+        The workers are polled every pollInterval: the cases taken by a
+        worker which died (e.g. killed when out of memory) are reported as
+        failed and the other workers go on.
+
+        '''
+        claimQueue = multiprocessing.Queue()
+        taskQueue, resultQueue, workers = self._StartWorkers(parameters,
+            claimQueue=claimQueue)
+        for fileName in fileNames:
+            taskQueue.put(fileName)
+        for i in range(0, self.numberOfWorkers):
+            taskQueue.put(None)
+        failures = []
+        pending = set(fileNames)
+        owners = {}
+        isDead = [False]*len(workers)
+        nDone = 0
+        nRunning = len(workers)
+        start = time.time()
+
+        def Report(fileName, status):
+            print('> [%i/%i] %s %s (%.1f s elapsed)' % (nDone,
+                len(fileNames), GetCaseName(fileName), status,
+                time.time() - start))
+
+        try:
+            while nRunning > 0:
+                try:
+                    item = resultQueue.get(timeout=pollInterval)
+                except queue.Empty:
+                    item = False
+                while True:
+                    try:
+                        workerIndex, fileName = claimQueue.get_nowait()
+                    except queue.Empty:
+                        break
+                    owners[fileName] = workerIndex
+                if item is False:
+                    for i, worker in enumerate(workers):
+                        if isDead[i] or worker.exitcode in (None, 0):
+                            continue
+                        isDead[i] = True
+                        nRunning -= 1
+                        error = 'The worker process died (exit code %i).' \
+                            % worker.exitcode
+                        for fileName in [fileName for fileName in pending
+                            if owners.get(fileName) == i]:
+                            pending.discard(fileName)
+                            nDone += 1
+                            failures.append((fileName, error))
+                            Report(fileName, 'FAILED: ' + error)
+                    continue
+                if item is None:
+                    nRunning -= 1
+                    continue
+                fileName, result, error, elapsed = item
+                pending.discard(fileName)
+                nDone += 1
+                if error is None:
+                    self.writeResult(fileName, result)
+                    status = 'done in %.2f s' % elapsed
+                else:
+                    failures.append((fileName, error))
+                    status = 'FAILED: ' + error
+                Report(fileName, status)
+            # Cases taken by a worker which died before reporting them.
+            for fileName in sorted(pending):
+                failures.append((fileName, 'The case was lost by a worker '
+                    'process which died.'))
+        except:
+            for worker in workers:
+                worker.terminate()
+            raise
+        for worker in workers:
+            worker.join()
+
+        return failures
+
+    def RunQueue(self, workQueue, parameters, pollInterval=POLLINTERVAL):
+        '''Process the cases of a src.WorkQueue.WorkQueue shared with the
+        workers of other nodes, until all its cases are finished.
+
+        The cases are claimed as the workers need them (at most
+        prefetch + 1 claimed at a time per live worker) and marked done
+        once handed to writeResult, which should write the results
+        atomically. The workers are polled every pollInterval: the cases
+        taken by a worker which died are marked as failed, as in Run, and
+        the other workers go on. Returns the list of (fileName, error) of
+        the cases failed on this node.
+
+        '''
+        claimQueue = multiprocessing.Queue()
+        taskQueue, resultQueue, workers = self._StartWorkers(parameters,
+            claimQueue=claimQueue)
+        claimed = {}
+        owners = {}
+        isDead = [False]*len(workers)
+        failures = []
+        start = time.time()
+
+        def Report(name, status):
+            nTasks, nDone, nFailed = workQueue.GetStatus()
+            print('> [%i/%i] %s %s (%.1f s elapsed)' % (nDone + nFailed,
+                nTasks, name, status, time.time() - start))
+
+        def CheckWorkers():
+            while True:
+                try:
+                    workerIndex, fileName = claimQueue.get_nowait()
+                except queue.Empty:
+                    break
+                owners[fileName] = workerIndex
+            for i, worker in enumerate(workers):
+                if isDead[i] or worker.exitcode in (None, 0):
+                    continue
+                isDead[i] = True
+                error = 'The worker process died (exit code %i).' \
+                    % worker.exitcode
+                for fileName in [fileName for fileName in claimed
+                    if owners.get(fileName) == i]:
+                    name = claimed.pop(fileName)
+                    failures.append((fileName, error))
+                    workQueue.Complete(name, error=error)
+                    Report(name, 'FAILED: ' + error)
+            if all(isDead):
+                raise RuntimeError('All the worker processes died.')
+
+        workQueue.StartHeartbeat()
+        try:
+            while True:
+                capacity = isDead.count(False)*(self.prefetch + 1)
+                while len(claimed) < capacity:
+                    task = workQueue.Claim()
+                    if task is None:
+                        break
+                    claimed[task[1]] = task[0]
+                    taskQueue.put(task[1])
+                if len(claimed) == 0:
+                    if workQueue.IsFinished():
+                        break
+                    self.verboseprint('> Waiting for the cases claimed by '
+                        'other nodes.')
+                    time.sleep(pollInterval)
+                    continue
+                try:
+                    fileName, result, error, elapsed = \
+                        resultQueue.get(timeout=pollInterval)
+                except queue.Empty:
+                    CheckWorkers()
+                    continue
+                if not(fileName in claimed):
+                    # Already failed with its worker.
+                    continue
+                name = claimed.pop(fileName)
+                if error is None:
+                    self.writeResult(fileName, result)
+                    status = 'done in %.2f s' % elapsed
+                else:
+                    failures.append((fileName, error))
+                    status = 'FAILED: ' + error
+                workQueue.Complete(name, error=error)
+                Report(name, status)
+            for worker in workers:
+                taskQueue.put(None)
+            nRunning = isDead.count(False)
+            while nRunning > 0:
+                try:
+                    item = resultQueue.get(timeout=pollInterval)
+                except queue.Empty:
+                    if all(worker.exitcode is not None for worker in workers):
+                        break
+                    continue
+                if item is None:
+                    nRunning -= 1
+        except:
+            for worker in workers:
+                worker.terminate()
+            workQueue.Release()
+            raise
+        finally:
+            workQueue.StopHeartbeat()
+        for worker in workers:
+            worker.join()
+
+        return failures
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import os
+
+import numpy as np
+
+PROFILEPERCENTILES = (5.0, 25.0, 50.0, 75.0, 95.0)
+
+
+def GroupPercentiles(values, groups, numberOfGroups, percentiles):
+    '''Return the percentiles (numberOfGroups x nPercentiles) of values per
+    group, with the linear interpolation of numpy.percentile. Every group
+    should have at least one value.'''
+    order = np.lexsort((values, groups))
+    sortedValues = values[order]
+    counts = np.bincount(groups, minlength=numberOfGroups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    result = np.zeros((numberOfGroups, len(percentiles)))
+    for j, p in enumerate(percentiles):
+        position = starts + (counts - 1)*(p / 100.0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, starts + counts - 1)
+        weight = position - lower
+        result[:, j] = (1.0 - weight)*sortedValues[lower] + \
+            weight*sortedValues[upper]
+    return result
+
+def ComputeDiameterProfiles(network, metrics, percentiles=PROFILEPERCENTILES,
+    elementIds=None):
+    '''Return the diameter profiles of the non-blanked branches.
+
+    For each non-blanked element, the diameter (twice the maximum inscribed
+    sphere radius) is taken at every point of its first VTK cell, with the
+    arc length from the beginning of the cell. All the branches are done
+    in one vectorized pass over the centerline arrays. Returns two
+    dictionaries of columns: the points (branch index, arc length,
+    diameter, coordinates) and the branches (element id, VTK cell id,
+    length, mean and minimum diameter, location of the minimum and
+    diameter percentiles). elementIds restricts the profiles to some
+    elements.
+
+    '''
+    if elementIds is None:
+        elementIds = range(0, len(network.elements))
+    elements = [network.elements[Id] for Id in elementIds
+        if not(network.elements[Id].IsBlanked())]
+    elementIds = np.array([el.GetId() for el in elements], dtype=np.int64)
+    cellIds = np.array([el.GetVtkCellIdList()[0] for el in elements],
+        dtype=np.int64)
+    nBranches = len(cellIds)
+    if nBranches == 0:
+        raise RuntimeError('The network has no non-blanked branch.')
+    firstSlots = metrics.cellOffsets[cellIds]
+    nPoints = metrics.cellOffsets[cellIds + 1] - firstSlots
+    pointOffsets = np.concatenate(([0], np.cumsum(nPoints)))
+    branches = np.repeat(np.arange(nBranches), nPoints)
+    ranks = np.arange(pointOffsets[-1]) - pointOffsets[branches]
+    pointIds = metrics.cellPointIds[firstSlots[branches] + ranks]
+
+    # Arc length: the segment k of a cell ends at its point k + 1.
+    firstSegments = metrics.segmentOffsets[cellIds]
+    dx = np.zeros(pointOffsets[-1])
+    hasSegment = ranks > 0
+    dx[hasSegment] = metrics.segmentLengths[
+        firstSegments[branches[hasSegment]] + ranks[hasSegment] - 1]
+    cumulative = np.cumsum(dx)
+    arcLength = cumulative - cumulative[pointOffsets[:-1]][branches]
+    diameters = 2.0*metrics.radii[pointIds]
+    coordinates = metrics.points[pointIds]
+
+    # Per-branch statistics.
+    minimumOrder = np.lexsort((diameters, branches))
+    minimumSlots = minimumOrder[pointOffsets[:-1]]
+    points = {'branch': branches.astype(np.int32),
+              'arcLength': arcLength,
+              'diameter': diameters,
+              'x': coordinates[:, 0],
+              'y': coordinates[:, 1],
+              'z': coordinates[:, 2]}
+    branchesTable = {'element': elementIds.astype(np.int32),
+                     'cellId': cellIds.astype(np.int32),
+                     'length': metrics.cellLengths[cellIds],
+                     'meanDiameter': np.bincount(branches, weights=diameters,
+                         minlength=nBranches) / nPoints,
+                     'minDiameter': diameters[minimumSlots],
+                     'minDiameterArcLength': arcLength[minimumSlots],
+                     'minDiameterX': coordinates[minimumSlots, 0],
+                     'minDiameterY': coordinates[minimumSlots, 1],
+                     'minDiameterZ': coordinates[minimumSlots, 2]}
+    branchPercentiles = GroupPercentiles(diameters, branches, nBranches,
+        percentiles)
+    for j, p in enumerate(percentiles):
+        branchesTable['diameterP%g' % p] = branchPercentiles[:, j]
+
+    return points, branchesTable
+
+def WriteDiameterProfiles(fileName, points, branchesTable):
+    '''Write the profiles as a compressed columnar numpy file (npz). The
+    points columns are prefixed by 'point_' and the branches columns by
+    'branch_'. The floats are stored in single precision.'''
+    columns = {}
+    for prefix, table in (('point_', points), ('branch_', branchesTable)):
+        for name, values in table.items():
+            if values.dtype == np.float64:
+                values = values.astype(np.float32)
+            columns[prefix + name] = values
+    # Written atomically, with the extension numpy adds to file names.
+    if not(fileName.endswith('.npz')):
+        fileName += '.npz'
+    temporaryFileName = '%s.%i.tmp' % (fileName, os.getpid())
+    outputFile = open(temporaryFileName, 'wb')
+    try:
+        np.savez_compressed(outputFile, **columns)
+    finally:
+        outputFile.close()
+    os.rename(temporaryFileName, fileName)
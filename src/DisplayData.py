@@ -50,6 +50,108 @@ class VtkText:
         self.text.SetDisplayPosition(20, 30)
 
 
+class VtkLabelHierarchy:
+    '''Labels of the scalars of a vtkPolyData, placed through a label 
+    hierarchy. The labels are prioritized by their scalar value (beta, 
+    diameter, ...) and only the non-overlapping labels of highest priority 
+    are drawn at the current zoom: zooming in reveals the others. With 
+    useDepthBuffer, the labels behind rendered geometry are also hidden, 
+    which hides the labels of points inside an opaque model (e.g. the 
+    centerline points). The hierarchy is built once, so the interaction 
+    cost does not grow with the number of labels. '''
+
+    def __init__(self, polyData, labelFormat="%2.2f", targetLabelCount=32,
+        fontSize=12, useDepthBuffer=False):
+        self.polyData = polyData
+        self.labelFormat = labelFormat
+        self.labelText = vtk.vtkStringArray()
+        self.labelText.SetName("LabelText")
+        self.priority = vtk.vtkDoubleArray()
+        self.priority.SetName("Priority")
+        self.polyData.GetPointData().AddArray(self.labelText)
+        self.polyData.GetPointData().AddArray(self.priority)
+        self.Update()
+
+        textProperty = vtk.vtkTextProperty()
+        textProperty.SetFontFamilyToArial()
+        textProperty.SetFontSize(fontSize)
+        textProperty.SetColor(1, 1, 1)
+        textProperty.ShadowOn()
+
+        self.hierarchy = vtk.vtkPointSetToLabelHierarchy()
+        if vtk.VTK_MAJOR_VERSION <= 5:
+            self.hierarchy.SetInput(self.polyData)
+        else:
+            self.hierarchy.SetInputData(self.polyData)
+        self.hierarchy.SetLabelArrayName("LabelText")
+        self.hierarchy.SetPriorityArrayName("Priority")
+        self.hierarchy.SetTargetLabelCount(targetLabelCount)
+        self.hierarchy.SetMaximumDepth(15)
+        self.hierarchy.SetTextProperty(textProperty)
+
+        self.mapper = vtk.vtkLabelPlacementMapper()
+        self.mapper.SetInputConnection(self.hierarchy.GetOutputPort())
+        # Only the overlapping labels are culled by default; the culling of
+        # the labels behind the surface (depth buffer) is opt-in.
+        self.mapper.SetUseDepthBuffer(useDepthBuffer)
+        self.mapper.PlaceAllLabelsOff()
+        self.mapper.SetIteratorType(vtk.vtkLabelHierarchy.QUEUE)
+        self.mapper.SetMaximumLabelFraction(0.2)
+        self.vtkActor = vtk.vtkActor2D()
+        self.vtkActor.SetMapper(self.mapper)
+
+    def Update(self):
+        '''Update the labels texts and priorities from the scalars, after 
+        they were changed in place. '''
+        scalars = self.polyData.GetPointData().GetScalars()
+        nPoints = self.polyData.GetNumberOfPoints()
+        self.labelText.SetNumberOfValues(nPoints)
+        self.priority.SetNumberOfValues(nPoints)
+        for i in range(0, nPoints):
+            value = scalars.GetTuple1(i)
+            self.labelText.SetValue(i, self.labelFormat % value)
+            self.priority.SetValue(i, abs(value))
+        self.labelText.Modified()
+        self.priority.Modified()
+        self.polyData.Modified()
+
+
+class VtkSlider:
+    '''Slider widget calling callback(value) when it is moved. It is 
+    attached to the interactor of the window by Attach. '''
+
+    def __init__(self, title, minimum, maximum, value, callback, 
+        position=(0.55, 0.1)):
+        self.callback = callback
+        self.representation = vtk.vtkSliderRepresentation2D()
+        self.representation.SetMinimumValue(minimum)
+        self.representation.SetMaximumValue(maximum)
+        self.representation.SetValue(value)
+        self.representation.SetTitleText(title)
+        self.representation.SetLabelFormat("%2.1f")
+        for coordinate, x in ((self.representation.GetPoint1Coordinate(), 
+            position[0]), (self.representation.GetPoint2Coordinate(), 
+            position[0] + 0.4)):
+            coordinate.SetCoordinateSystemToNormalizedDisplay()
+            coordinate.SetValue(x, position[1])
+        self.representation.SetSliderLength(0.02)
+        self.representation.SetSliderWidth(0.03)
+        self.representation.SetTubeWidth(0.005)
+        self.representation.SetTitleHeight(0.025)
+        self.representation.SetLabelHeight(0.025)
+        self.widget = vtk.vtkSliderWidget()
+        self.widget.SetRepresentation(self.representation)
+        self.widget.SetAnimationModeToJump()
+        self.widget.AddObserver("InteractionEvent", self.OnInteraction)
+
+    def OnInteraction(self, widget, event):
+        self.callback(self.representation.GetValue())
+
+    def Attach(self, interactor):
+        self.widget.SetInteractor(interactor)
+        self.widget.EnabledOn()
+
+
 class DisplayModel(object):
 
     def polyDataToActor(self, polyData, opacity=.25):
@@ -88,7 +190,10 @@ class DisplayModel(object):
         lightKit.SetKeyToBackRatio(1000.)
         lightKit.AddLightsToRenderer(renderer)
 
-    def renderWindow(self, renderer, titleWindow):
+    def renderWindow(self, renderer, titleWindow, setupInteractor=None):
+        '''Render and start the interaction. setupInteractor(interactor, 
+        renderWindow) is called before the start, to add widgets and 
+        observers.'''
         renderWindow = vtk.vtkRenderWindow()
         renderWindow.SetSize(700, 700)
 
@@ -103,6 +208,8 @@ class DisplayModel(object):
         renderWindow.AddRenderer(renderer)
         renderWindow.Render()
         renderWindow.SetWindowName(titleWindow)
+        if setupInteractor is not None:
+            setupInteractor(interactor, renderWindow)
         
         # Initialize and start the interactor.
         interactor.Initialize()
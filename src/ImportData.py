@@ -1,16 +1,33 @@
 #!/usr/bin/env python
 ## Christophe.Chnafa@gmail.com
 
+import hashlib
 import math
+import os
 import numpy as np
 import vtk
 
+from .NetworkTopology import NetworkTopology
+from .ParallelGeometry import ComputeCellsGeometry, ComputeCellsGeometryParallel
+
 # Array names used by VMTK.
 BLANKINGARRAYNAME = 'Blanking'
 GROUPIDSARRAYNAME = 'GroupIds'
 RADIUSARRAYNAME = 'MaximumInscribedSphereRadius'
 SECTIONARRAYNAME = 'CenterlineSectionArea'
 
+# Compact precision mode: types of the coordinates and radii and of the
+# ids and offsets, and maximal difference of the outlets betas with the
+# double precision mode (checked by CheckCompactMode).
+COMPACTFLOATTYPE = np.float32
+COMPACTINTTYPE = np.int32
+COMPACTTOLERANCE = 1e-4
+
+# Directory of the split centerlines cache. It can be changed with the
+# environment variable ANEUTOOLS_CACHE.
+BRANCHCACHEDIRECTORY = os.environ.get('ANEUTOOLS_CACHE',
+    os.path.join(os.path.expanduser('~'), '.aneuTools', 'cache'))
+
 
 def loadFile(fileName):
     '''Load the given file, and return a vtkPolyData object for it. '''
@@ -36,6 +53,82 @@ def loadFile(fileName):
 
     return(polyData)
 
+def writeFile(polyData, fileName):
+    '''Write the given vtkPolyData object in a vtp file. 
+
+    The file is first written under a temporary name and then renamed, so 
+    concurrent readers never see a partially written file.
+
+    '''
+    root, extension = os.path.splitext(fileName)
+    temporaryFileName = '%s.%i.tmp%s' % (root, os.getpid(), extension)
+    writer = vtk.vtkXMLPolyDataWriter()
+    writer.SetFileName(temporaryFileName)
+    if vtk.VTK_MAJOR_VERSION <= 5:
+        writer.SetInput(polyData)
+    else:
+        writer.SetInputData(polyData)
+    writer.SetDataModeToBinary()
+    if writer.Write() != 1:
+        raise RuntimeError('Cannot write the file %s' % fileName)
+    os.rename(temporaryFileName, fileName)
+
+def ComputeCenterlineHash(centerline):
+    '''Return a hash of the centerline points, radii and connectivity.'''
+    points, radii, cellOffsets, cellPointIds = GetCenterlineArrays(centerline)
+    sha = hashlib.sha1()
+    sha.update(RADIUSARRAYNAME.encode('ascii'))
+    for array in (points, radii, cellOffsets, cellPointIds):
+        sha.update(np.ascontiguousarray(array))
+
+    return sha.hexdigest()
+
+def SplitCenterline(centerline, verboseprint, cacheDirectory=None, 
+    isPreprocessing=False):
+    '''Split the centerline into its constituent branches.
+
+    The split is done with vmtkBranchExtractor, which is expensive. The 
+    output is saved in a cache directory, under the hash of the input 
+    centerline, and reused by later runs on the same input. Set 
+    cacheDirectory to '' to disable the cache. isPreprocessing silences 
+    the warning advising to split the centerlines beforehand, for the 
+    batch split of ToolGetMeSplitCenterlines.py.
+
+    '''
+    if cacheDirectory is None:
+        cacheDirectory = BRANCHCACHEDIRECTORY
+    cachedFileName = ''
+    if cacheDirectory:
+        cachedFileName = os.path.join(cacheDirectory, 
+            ComputeCenterlineHash(centerline) + '.vtp')
+        if os.path.isfile(cachedFileName):
+            verboseprint('> Split centerline read from the cache ' 
+                + cachedFileName + '.')
+            return loadFile(cachedFileName)
+    if not(isPreprocessing):
+        print('Warning: the centerline is not pre-processed. Is it needed to split \n' 
+            + 'the vessel into its constituent branches. It is not a problem if VMTK \n'
+            + 'is installed. However, it would be faster to do this operation before \n'
+            + '(see ToolGetMeSplitCenterlines.py). The result will be cached. \n')
+    from vmtk import vmtkscripts
+    centerlines = vmtkscripts.vmtkBranchExtractor()
+    centerlines.Centerlines = centerline
+    centerlines.RadiusArrayName = RADIUSARRAYNAME
+    centerlines.Execute()
+    splitCenterline = centerlines.Centerlines
+    if cachedFileName:
+        if not(os.path.isdir(cacheDirectory)):
+            try:
+                os.makedirs(cacheDirectory)
+            except OSError:
+                if not(os.path.isdir(cacheDirectory)):
+                    raise
+        writeFile(splitCenterline, cachedFileName)
+        verboseprint('> Split centerline saved in the cache ' 
+            + cachedFileName + '.')
+
+    return splitCenterline
+
 def GetMaxGroupId(centerline):
     maxGroupId = 0
     groupIdsArray = centerline.GetCellData().GetArray(GROUPIDSARRAYNAME)
@@ -60,7 +153,7 @@ def GetBlankedGroupsIdList(centerline):
 
     return(blankedGroupdsArray)
 
-def GetRedundantBlankedIdList(centerline, blankedGroupsIdList):
+def GetRedundantBlankedIdList(centerline, blankedGroupsIdList, metrics=None):
     ''' Get the redundant blanked segments.
 
     Nominaly, the x0 and x1 coordinates should be the same. Thus, the
@@ -73,35 +166,53 @@ def GetRedundantBlankedIdList(centerline, blankedGroupsIdList):
     segment, a lil' something and another blanked segment. In case of 
     weird branch splittings, try to lower the tol. It is cheating since 
     branches that should not be merge will be merged anyway.
+    The segments extremities are read from the centerline metrics, and
+    only the segments with close x0 points are compared.
 
     '''
-    currentX0 = [0.0, 0.0, 0.0]
-    currentX1 = [0.0, 0.0, 0.0]
-    otherX0 = [0.0, 0.0, 0.0]
-    otherX1 = [0.0, 0.0, 0.0]
-    minLength, maxLength = ComputeGeometricTolerance(centerline)
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
+    minLength, maxLength = metrics.GetGeometricTolerance()
     tol = maxLength*0.1 #10**(-5) 
     redundantBranchesIndex = []
-    for currentBranch in blankedGroupsIdList:
-        currentBranchIndex = currentBranch[0]
-        if currentBranchIndex in redundantBranchesIndex:
+    if tol <= 0.0:
+        return(redundantBranchesIndex)
+    # The x0 points are hashed in a grid of cells of size sqrt(tol): the 
+    # segments to compare with a segment are in the 27 cells around its x0,
+    # instead of all the blanked segments.
+    branchesIndex = [branch[0] for branch in blankedGroupsIdList]
+    firstPoints = np.asarray(metrics.firstPoints[branchesIndex], 
+        dtype=np.float64)
+    lastPoints = np.asarray(metrics.lastPoints[branchesIndex], 
+        dtype=np.float64)
+    cellSize = math.sqrt(tol)
+    keys = np.floor(firstPoints / cellSize).astype(np.int64)
+    grid = {}
+    for j in range(0, len(branchesIndex)):
+        grid.setdefault(tuple(keys[j]), []).append(j)
+    shifts = [(a, b, c) for a in (-1, 0, 1) for b in (-1, 0, 1) 
+        for c in (-1, 0, 1)]
+    isRedundant = set()
+    for j in range(0, len(branchesIndex)):
+        currentBranchIndex = branchesIndex[j]
+        if currentBranchIndex in isRedundant:
             continue
-        centerline.GetCell(currentBranchIndex).GetPoints().GetPoint(0, currentX0)
-        npts = centerline.GetCell(currentBranchIndex).GetPoints().GetNumberOfPoints()
-        centerline.GetCell(currentBranchIndex).GetPoints().GetPoint(npts - 1, currentX1)
-        for otherBranch in blankedGroupsIdList:
-            otherBranchIndex = otherBranch[0]
+        key = keys[j]
+        candidates = sorted(k for shift in shifts for k in 
+            grid.get((key[0] + shift[0], key[1] + shift[1], 
+                key[2] + shift[2]), []))
+        for k in candidates:
+            otherBranchIndex = branchesIndex[k]
             if otherBranchIndex == currentBranchIndex:
                 continue
-            if otherBranchIndex in redundantBranchesIndex:
+            if otherBranchIndex in isRedundant:
                 continue
-            centerline.GetCell(otherBranchIndex).GetPoints().GetPoint(0, otherX0)
-            otherNpts = centerline.GetCell(otherBranchIndex).GetPoints().GetNumberOfPoints()
-            centerline.GetCell(otherBranchIndex).GetPoints().GetPoint(otherNpts - 1, otherX1)
-            if vtk.vtkMath.Distance2BetweenPoints(currentX0,otherX0) < tol and \
-               vtk.vtkMath.Distance2BetweenPoints(currentX1,otherX1) < tol:
+            distanceX0 = np.sum((firstPoints[j] - firstPoints[k])**2.0)
+            if distanceX0 < tol and \
+                np.sum((lastPoints[j] - lastPoints[k])**2.0) < tol:
                 redundantBranchesIndex.append(otherBranchIndex)
-                if vtk.vtkMath.Distance2BetweenPoints(currentX0,otherX0) > minLength:
+                isRedundant.add(otherBranchIndex)
+                if distanceX0 > minLength:
                     print 'WARNING: POTENTIAL ISSUE DURING THE MERGING OF REDUNDANTS BLANKED SEGMENTS.'
                     print '         A distance between segments is suspicious.' 
                     print '         The blanked segments of VTK Cell Id ' + repr(currentBranchIndex)
@@ -127,7 +238,80 @@ def IsArrayDefined(centerline, arrayName):
 
     return(found)
 
-def ComputeGeometricTolerance(centerline):
+def GetCenterlineArrays(centerline, compact=False):
+    '''Return the centerline data as numpy arrays.
+
+    The points coordinates (nPoints x 3) and the radius array are returned
+    together with the cells connectivity stored in a compressed form: the
+    point ids of the cell i are cellPointIds[cellOffsets[i]:cellOffsets[i+1]].
+    With compact, the coordinates and radii are single precision floats 
+    and the ids and offsets 32 bits integers.
+
+    '''
+    from vtk.util.numpy_support import vtk_to_numpy
+    floatType = COMPACTFLOATTYPE if compact else np.float64
+    points = vtk_to_numpy(centerline.GetPoints().GetData()).astype(floatType)
+    radii = vtk_to_numpy(
+        centerline.GetPointData().GetArray(RADIUSARRAYNAME)).astype(floatType)
+    numberOfCells = centerline.GetNumberOfCells()
+    lines = centerline.GetLines()
+    if hasattr(lines, 'GetOffsetsArray') and \
+        lines.GetNumberOfCells() == numberOfCells:
+        # VTK >= 9 stores the connectivity as offsets and point ids.
+        cellOffsets = vtk_to_numpy(lines.GetOffsetsArray()).astype(np.int64)
+        cellPointIds = vtk_to_numpy(
+            lines.GetConnectivityArray()).astype(np.int64)
+    else:
+        cellOffsets, cellPointIds = _GetCellsConnectivity(centerline)
+    if compact:
+        return points, radii, CompactIds(cellOffsets), CompactIds(cellPointIds)
+    return points, radii, cellOffsets, cellPointIds
+
+def _GetCellsConnectivity(centerline):
+    '''Return the compressed connectivity of the cells, cell by cell.'''
+    numberOfCells = centerline.GetNumberOfCells()
+    cellOffsets = np.zeros(numberOfCells + 1, dtype=np.int64)
+    cellPointIdsList = []
+    for i in range(0, numberOfCells):
+        pointIds = centerline.GetCell(i).GetPointIds()
+        npts = pointIds.GetNumberOfIds()
+        cellPointIdsList.append(
+            [pointIds.GetId(k) for k in range(0, npts)])
+        cellOffsets[i + 1] = cellOffsets[i] + npts
+    if cellOffsets[-1] > 0:
+        cellPointIds = np.concatenate(
+            [np.asarray(ids, dtype=np.int64) for ids in cellPointIdsList])
+    else:
+        cellPointIds = np.zeros(0, dtype=np.int64)
+    return cellOffsets, cellPointIds
+
+def CompactIds(values):
+    '''Return integer values as 32 bits integers when they fit.'''
+    if len(values) and values.max() >= np.iinfo(COMPACTINTTYPE).max:
+        return values
+    return values.astype(COMPACTINTTYPE, copy=False)
+
+def CheckCompactMode(network, referenceNetwork, verboseprint, 
+    tolerance=COMPACTTOLERANCE):
+    '''Compare the outlets betas of a network computed in compact mode with
+    the ones of the same network computed in double precision. Returns the
+    maximal absolute difference, an error is raised above tolerance.'''
+    betas = np.array([el.GetBeta() for el in network.elements 
+        if el.IsAnOutlet()])
+    referenceBetas = np.array([el.GetBeta() for el in referenceNetwork.elements
+        if el.IsAnOutlet()])
+    if len(betas) != len(referenceBetas):
+        raise RuntimeError('The compact mode changed the number of outlets '
+            '(%i instead of %i).' % (len(betas), len(referenceBetas)))
+    difference = float(np.abs(betas - referenceBetas).max()) if len(betas) \
+        else 0.0
+    verboseprint('> Compact mode: maximal beta difference %.3e.' % difference)
+    if difference > tolerance:
+        raise RuntimeError('The compact mode changed the outlets betas by '
+            '%.3e (tolerance %.1e).' % (difference, tolerance))
+    return difference
+
+def ComputeGeometricTolerance(centerline, metrics=None):
     '''Return the min and max length for branches.
 
     This routine compute the delta x minimum and maximum in the network. 
@@ -135,45 +319,17 @@ def ComputeGeometricTolerance(centerline):
     is used for merging the blanked segments.
 
     '''
-    groupIdsArray = centerline.GetCellData().GetArray(GROUPIDSARRAYNAME)
-    numberOfCells = centerline.GetNumberOfCells()
-    minLength = 10000.0
-    maxLength = 0.0
-    numberOfCells = centerline.GetNumberOfCells()
-    for i in range(0, numberOfCells):
-        groupId = groupIdsArray.GetValue(i)
-        npts =  centerline.GetCell(i).GetPoints().GetNumberOfPoints()
-        for k in range(0, npts - 1):
-            point0 = [0.0, 0.0, 0.0]
-            point1 = [0.0, 0.0, 0.0]
-            centerline.GetCell(i).GetPoints().GetPoint(k, point0)
-            centerline.GetCell(i).GetPoints().GetPoint(k + 1, point1)
-            if math.sqrt(vtk.vtkMath.Distance2BetweenPoints(point0,point1)) < minLength:
-                if math.sqrt(vtk.vtkMath.Distance2BetweenPoints(point0,point1)) == 0.0:
-                    continue
-                minLength = math.sqrt(vtk.vtkMath.Distance2BetweenPoints(point0,point1))
-            if math.sqrt(vtk.vtkMath.Distance2BetweenPoints(point0,point1))>maxLength:
-                maxLength = math.sqrt(vtk.vtkMath.Distance2BetweenPoints(point0,point1))
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
 
-    return minLength, maxLength
+    return metrics.GetGeometricTolerance()
 
-def ComputeGroupLength(centerline, branchGroupId):
+def ComputeGroupLength(centerline, branchGroupId, metrics=None):
     '''Return the mean length for branches of branchGroupId.'''
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
 
-    groupLength = 0.0
-    lengthWeightSum = 0.0
-    groupIdsArray = centerline.GetCellData().GetArray(GROUPIDSARRAYNAME)
-    numberOfCells = centerline.GetNumberOfCells()
-    for i in range(0, numberOfCells):
-        groupId = groupIdsArray.GetValue(i)
-        if groupId != branchGroupId:
-            continue
-        length = ComputeBranchLength(centerline, i)
-        groupLength += length
-        lengthWeightSum += 1.0
-    groupLength /= lengthWeightSum
-
-    return groupLength
+    return metrics.GetGroupLength(branchGroupId)
 
 def ComputeBranchLength(centerline, branchId):
     '''Return the length for the branch of index branchId.'''
@@ -189,7 +345,7 @@ def ComputeBranchLength(centerline, branchId):
 
     return length
 
-def ComputeGroupRadius(centerline, branchGroupId):
+def ComputeGroupRadius(centerline, branchGroupId, metrics=None):
     '''Return the mean radius of a group.
 
     The mean radius is computed using the hydraulic resistance for 
@@ -199,18 +355,10 @@ def ComputeGroupRadius(centerline, branchGroupId):
     pressure drops', Journal of Biomechanics, 2017, C. Chnafa et al.
 
     '''
-    groupRadius = 0.0
-    radiusWeightSum = 0.0
-    groupIdsArray = centerline.GetCellData().GetArray(GROUPIDSARRAYNAME)
-    numberOfCells = centerline.GetNumberOfCells()
-    for i in range(0, numberOfCells):
-        if groupIdsArray.GetValue(i) != branchGroupId:
-            continue
-        groupRadius += ComputeBranchRadius(centerline, i)
-        radiusWeightSum += 1.0
-    groupRadius /= radiusWeightSum
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
 
-    return groupRadius
+    return metrics.GetGroupRadius(branchGroupId)
 
 def ComputeBranchRadius(centerline, branchId):
     '''Return the radius for a branch with index branchId. '''
@@ -251,22 +399,20 @@ def ComputeLocalGroupRadius(centerline, branchGroupId, nDiameter):
 
     return groupRadius
 
-def ComputeLocalBranchRadius(centerline, branchId, nDiameter, verboseprint):
+def ComputeLocalBranchRadius(centerline, branchId, nDiameter, verboseprint,
+    metrics=None):
     '''Return the radius for a branch with index branchId. '''
-    length = 0.0
-    resistance = 0.0
-    radiusArray = centerline.GetPointData().GetArray(RADIUSARRAYNAME)
-    npts = centerline.GetCell(branchId).GetPoints().GetNumberOfPoints()
-    idx = GetIndexCenterlineForADefinedLength(centerline, branchId, 
-        1.0, verboseprint, isDirectionNeeded = True, nDiameter = nDiameter)
-    branchRadius = radiusArray.GetComponent(centerline.GetCell(branchId).GetPointId(idx),0)
-    print branchRadius
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
+    branchRadius = metrics.ComputeLocalRadius(branchId, nDiameter)
+    verboseprint('> Local radius of the VTK cell %i: %f' % (branchId, branchRadius))
 
     return branchRadius
 
 def GetListsUniqueBlankedBranches(blankedGroupsIdList, redundantBlankedBranchesIdList):
     blankedGroupsIndex = []
     blankedUniqueBranchesIndex = []
+    redundantBlankedBranchesIdList = set(redundantBlankedBranchesIdList)
     for i in range(0, len(blankedGroupsIdList)):
         if blankedGroupsIdList[i][0] in redundantBlankedBranchesIdList:
             continue
@@ -277,7 +423,8 @@ def GetListsUniqueBlankedBranches(blankedGroupsIdList, redundantBlankedBranchesI
 
 def SetNetworkStructure(centerline, network, verboseprint,
     isConnectivityNeeded = True, isRadiusInletNeeded = True,
-    isLocalRadiiNeeded = False, localRadii=0.0):
+    isLocalRadiiNeeded = False, localRadii=0.0, numberOfWorkers=1, 
+    compact=False):
     '''Fills a network structure with a vtkPolyData object.
 
     Each element has an unique index. The groups length and radius are
@@ -287,84 +434,88 @@ def SetNetworkStructure(centerline, network, verboseprint,
     see Antiga, L., & Steinman, D. A. (2004). Robust and objective 
     decomposition and mapping of bifurcating vessels. Medical Imaging, 
     IEEE Transactions on, 23(6), 704-713.
+    The centerline used to fill the network is returned: it is the split 
+    centerline when the input was not split into branches. The geometry of
+    very large centerlines can be computed by numberOfWorkers processes.
+    With compact, the centerline arrays and the topology are stored with
+    the compact types (see CenterlineMetrics).
 
     '''
     verboseprint("> Filling the network structure with the raw data.")
     if not(IsArrayDefined(centerline, GROUPIDSARRAYNAME)):
-        print('Warning: the centerline is not pre-processed. Is it needed to split \n' 
-            + 'the vessel into its constituent branches. It is not a problem if VMTK \n'
-            + 'is installed. However, it would be faster to do this operation before. \n')
-        from vmtk import vmtkscripts
-        centerlines = vmtkscripts.vmtkBranchExtractor()
-        centerlines.Centerlines = centerline
-        centerlines.RadiusArrayName = RADIUSARRAYNAME
-        centerlines.Execute()
-        centerline = centerlines.Centerlines
-    # Treat the splitted centerline.
+        centerline = SplitCenterline(centerline, verboseprint)
+    # Treat the splitted centerline. The geometric metrics are computed
+    # once and shared by all the stages.
+    metrics = CenterlineMetrics(centerline, numberOfWorkers=numberOfWorkers,
+        nDiameter=localRadii if isLocalRadiiNeeded else 0.0, compact=compact)
+    BuildNetworkElements(centerline, network, verboseprint, metrics)
+    if isConnectivityNeeded:
+        SetNetworkConnectivity(network, metrics, verboseprint)
+    SetRadiusX0(centerline, network, verboseprint, metrics=metrics)
+    network.SetNetworkInletRadius(
+        ComputeInletAverageRadius(centerline, 0.0, verboseprint, metrics=metrics))
+    # XXXX
+    if isLocalRadiiNeeded:
+        SetLocalBifurcationRadius(centerline, network, localRadii, verboseprint,
+            metrics=metrics)
+    network.SetCenterlineMetrics(metrics)
+
+    return(centerline)
+
+def BuildNetworkElements(centerline, network, verboseprint, metrics):
+    '''Add to the network one element per group of the split centerline 
+    and one per unique blanked branch, with their lengths, radii and 
+    extremities (see SetNetworkStructure).'''
     maxGroupId = GetMaxGroupId(centerline)
     blankedGroupsIdList = GetBlankedGroupsIdList(centerline)
     redundantBlankedBranchesIdList = GetRedundantBlankedIdList(centerline, 
-        blankedGroupsIdList)
+        blankedGroupsIdList, metrics=metrics)
     blankedGroupsIndex, blankedUniqueBranchesIndex = \
         GetListsUniqueBlankedBranches(blankedGroupsIdList, 
         redundantBlankedBranchesIdList)
+    # Unique blanked branches of each group, in their order.
+    blankedGroupsPositions = {}
+    for j in range(0, len(blankedGroupsIndex)):
+        blankedGroupsPositions.setdefault(blankedGroupsIndex[j], []).append(j)
     indexUniqueBranches = 0
     for i in range(0, maxGroupId + 1):
         x0List = []
         x1List = []
         VtkCellIdList = []
         VtkGroupIdList = []
-        if i in blankedGroupsIndex:
-            for j in range(0,len(blankedGroupsIndex)):    
-                if blankedGroupsIndex[j] == i:
-                    el = Element(Id = indexUniqueBranches)
-                    el.SetMeanRadius(ComputeBranchRadius(centerline,
-                        blankedUniqueBranchesIndex[j]))
-                    el.SetLength(ComputeBranchLength(centerline,
-                        blankedUniqueBranchesIndex[j]))
-                    el.SetBlanking(1)
-                    npts = centerline.GetCell(blankedUniqueBranchesIndex[j]). \
-                        GetPoints().GetNumberOfPoints()
-                    x0 = [0.0, 0.0, 0.0]
-                    x1 = [0.0, 0.0, 0.0]
-                    centerline.GetCell(blankedUniqueBranchesIndex[j]). \
-                        GetPoints().GetPoint(0, x0)
-                    centerline.GetCell(blankedUniqueBranchesIndex[j]). \
-                        GetPoints().GetPoint(npts - 1, x1)
-                    x0List = []
-                    x1List = []
-                    VtkCellIdList =[]
-                    VtkGroupIdList = []
-                    x1List.append(x1)
-                    x0List.append(x0)
-                    el.SetInOutPointsCoordinates(x0List, x1List)
-                    VtkCellIdList.append(blankedUniqueBranchesIndex[j])
-                    VtkGroupIdList.append(i)
-                    el.SetVtkGroupIdList(VtkGroupIdList)
-                    el.SetVtkCellIdList(VtkCellIdList)
-                    network.AddElement(el)
-                    verboseprint("> Edge Id " + repr(indexUniqueBranches) 
-                        + ", Length = " + repr(el.GetLength()) + " and Radius = "
-                        + repr(el.GetMeanRadius()) + ".")
-                    indexUniqueBranches += 1
-        else:
-            el = Element(Id = indexUniqueBranches)
-            el.SetMeanRadius(ComputeGroupRadius(centerline, i))
-            el.SetLength(ComputeGroupLength(centerline, i))
-            groupIdsArray = centerline.GetCellData().GetArray(GROUPIDSARRAYNAME)
-            numberOfCells = centerline.GetNumberOfCells()
-            for k in range(0, numberOfCells):
-                groupId = groupIdsArray.GetValue(k)
-                if groupId != i:
-                    continue
-                x0 = [0.0, 0.0, 0.0]
-                x1 = [0.0, 0.0, 0.0]
-                npts = centerline.GetCell(k).GetPoints().GetNumberOfPoints()
-                centerline.GetCell(k).GetPoints().GetPoint(npts - 1, x1)
+        if i in blankedGroupsPositions:
+            for j in blankedGroupsPositions[i]:
+                cellId = blankedUniqueBranchesIndex[j]
+                el = Element(Id = indexUniqueBranches)
+                el.SetMeanRadius(float(metrics.resistanceRadii[cellId]))
+                el.SetLength(float(metrics.cellLengths[cellId]))
+                el.SetBlanking(1)
+                x0 = metrics.firstPoints[cellId].tolist()
+                x1 = metrics.lastPoints[cellId].tolist()
+                x0List = []
+                x1List = []
+                VtkCellIdList =[]
+                VtkGroupIdList = []
                 x1List.append(x1)
-                centerline.GetCell(k).GetPoints().GetPoint(0, x0)
                 x0List.append(x0)
-                VtkCellIdList.append(k)
+                el.SetInOutPointsCoordinates(x0List, x1List)
+                VtkCellIdList.append(blankedUniqueBranchesIndex[j])
+                VtkGroupIdList.append(i)
+                el.SetVtkGroupIdList(VtkGroupIdList)
+                el.SetVtkCellIdList(VtkCellIdList)
+                network.AddElement(el)
+                verboseprint("> Edge Id " + repr(indexUniqueBranches) 
+                    + ", Length = " + repr(el.GetLength()) + " and Radius = "
+                    + repr(el.GetMeanRadius()) + ".")
+                indexUniqueBranches += 1
+        else:
+            el = Element(Id = indexUniqueBranches)
+            el.SetMeanRadius(metrics.GetGroupRadius(i))
+            el.SetLength(metrics.GetGroupLength(i))
+            for k in metrics.GetGroupCellIds(i):
+                x1List.append(metrics.lastPoints[k].tolist())
+                x0List.append(metrics.firstPoints[k].tolist())
+                VtkCellIdList.append(int(k))
                 VtkGroupIdList.append(i)
             uniqueX0List = [list(x) for x in set(tuple(x) for x in x0List)]
             uniqueX1List = [list(x) for x in set(tuple(x) for x in x1List)]
@@ -378,15 +529,17 @@ def SetNetworkStructure(centerline, network, verboseprint,
             indexUniqueBranches += 1
     verboseprint("> ")
 
-    if isConnectivityNeeded:
-        minLength, maxLength = ComputeGeometricTolerance(centerline)
-        ComputeConnectivity(network, minLength, verboseprint)
-    SetRadiusX0(centerline, network, verboseprint)
-    network.SetNetworkInletRadius(
-        ComputeInletAverageRadius(centerline, 0.0, verboseprint))
-    # XXXX
-    if isLocalRadiiNeeded:
-        SetLocalBifurcationRadius(centerline, network, localRadii, verboseprint)
+def SetNetworkConnectivity(network, metrics, verboseprint):
+    '''Compute the connectivity of the network elements with the geometric
+    tolerance of the centerline, and build the topology index.'''
+    minLength, maxLength = metrics.GetGeometricTolerance()
+    ComputeConnectivity(network, minLength, verboseprint)
+    topology = network.BuildTopology(compact=metrics.compact)
+    if topology.numberOfReachedElements < network.GetNumberOfElements():
+        print('Warning: %i elements are not connected to the inlet.' 
+            % (network.GetNumberOfElements() 
+               - topology.numberOfReachedElements))
+    return topology
 
 def ComputeConnectivity(network, tolerance, verboseprint):
     '''Compute the branches connectivity in the network.
@@ -434,7 +587,7 @@ def ComputeConnectivity(network, tolerance, verboseprint):
                             treatedBranch.GetOutPointsx1Id(), 
                             otherBranch.GetId() + 2)
                         otherBranch.SetBehindSegment(treatedBranch.GetId())
-                        treatedBranch.SetFrontSegment(otherBranch.GetId())
+                        treatedBranch.AddFrontSegment(otherBranch.GetId())
                         atLeastOneFound = True
 
         if not(atLeastOneFound):
@@ -443,20 +596,25 @@ def ComputeConnectivity(network, tolerance, verboseprint):
                 treatedBranch.GetInPointsx0Id(), 
                 treatedBranch.GetId() + 2)
 
-def SetLocalBifurcationRadius(centerline, network, nDiameter, verboseprint):
+def SetLocalBifurcationRadius(centerline, network, nDiameter, verboseprint,
+    metrics=None):
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
     for branch in network.elements:
         cellID = branch.GetVtkCellIdList()
-        r = ComputeLocalBranchRadius(centerline, cellID[0], nDiameter, verboseprint)
+        r = ComputeLocalBranchRadius(centerline, cellID[0], nDiameter, 
+            verboseprint, metrics=metrics)
         branch.SetLocalRadius(r)
 
-def SetRadiusX0(centerline, network, verboseprint):
+def SetRadiusX0(centerline, network, verboseprint, metrics=None):
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
     for branch in network.elements:
         cellID = branch.GetVtkCellIdList()
-        radiusArray = centerline.GetPointData().GetArray(RADIUSARRAYNAME)
-        r = radiusArray.GetComponent(centerline.GetCell(cellID[0]).GetPointId(0),0)
-        branch.SetInletRadius(r)
+        branch.SetInletRadius(float(metrics.firstPointRadii[cellID[0]]))
 
-def ComputeInletAverageRadius(centerline, desiredLength, verboseprint):
+def ComputeInletAverageRadius(centerline, desiredLength, verboseprint, 
+    metrics=None):
     '''Compute the inlet radius as an averaged radius.
 
     Computes an average radius over a certain length of the ICA. The mean
@@ -465,30 +623,19 @@ def ComputeInletAverageRadius(centerline, desiredLength, verboseprint):
     an elliptical shape.
 
     '''
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
     branchId = 0
-    length = 0.0
-    resistance = 0.0
-    radiusArray = centerline.GetPointData().GetArray(RADIUSARRAYNAME)
-    npts = GetIndexCenterlineForADefinedLength(centerline, branchId, 
-        desiredLength, verboseprint)
-    for k in range(0, npts - 1):
-        point0 = [0.0, 0.0, 0.0]
-        point1 = [0.0, 0.0, 0.0]
-        centerline.GetCell(branchId).GetPoints().GetPoint(k, point0)
-        centerline.GetCell(branchId).GetPoints().GetPoint(k + 1, point1)
-        dx = math.sqrt(vtk.vtkMath.Distance2BetweenPoints(point0,point1))
-        length += dx
-        r = radiusArray.GetComponent(centerline.GetCell(branchId).GetPointId(k),0)
-        resistance += dx / r**(4.0)
-    if npts < 2:
-        branchMeanRadius = radiusArray.GetComponent(
-            centerline.GetCell(branchId).GetPointId(0),0)
-    else:
-        branchMeanRadius = (length / resistance)**(0.25)
+    npts = metrics.GetIndexForLength(branchId, desiredLength)
+    if npts is None or npts < 2:
+        return float(metrics.firstPointRadii[branchId])
+    index = metrics.GetResistanceIndex()
 
-    return branchMeanRadius
+    return float(index.ComputeEquivalentRadii([branchId], [0.0], 
+        [index.GetArcLength(branchId, npts - 1)])[0])
 
-def ComputeInletAverageCrossSectionArea(centerline, desiredLength, verboseprint):
+def ComputeInletAverageCrossSectionArea(centerline, desiredLength, verboseprint,
+    metrics=None):
     '''Compute the inlet radius as an averaged radius.
 
     Computes an average radius over a certain length of the ICA. The mean
@@ -498,31 +645,17 @@ def ComputeInletAverageCrossSectionArea(centerline, desiredLength, verboseprint)
     seems wrong, that is why I am taking the second point of the centerline.
 
     '''
+    if metrics is None:
+        metrics = CenterlineMetrics(centerline)
     branchId = 0
-    length = 0.0
-    resistance = 0.0
-    sectionArray = centerline.GetPointData().GetArray(SECTIONARRAYNAME)
-    npts = GetIndexCenterlineForADefinedLength(centerline, branchId, 
-        desiredLength, verboseprint)
-    for k in range(1, npts - 1):
-        point0 = [0.0, 0.0, 0.0]
-        point1 = [0.0, 0.0, 0.0]
-        S = sectionArray.GetComponent(centerline.GetCell(branchId).GetPointId(k),0)
-        if S == 0.0:
-            continue
-        centerline.GetCell(branchId).GetPoints().GetPoint(k, point0)
-        centerline.GetCell(branchId).GetPoints().GetPoint(k + 1, point1)
-        dx = math.sqrt(vtk.vtkMath.Distance2BetweenPoints(point0,point1))
-        length += dx
-        r = math.sqrt(S/np.pi)
-        resistance += dx / r**(4.0)
-    if npts < 2:
-        S = sectionArray.GetComponent(centerline.GetCell(branchId).GetPointId(1),0)
-        branchMeanRadius = math.sqrt(S/np.pi)
-    else:
-        branchMeanRadius = (length / resistance)**(0.25)
+    index = metrics.GetResistanceIndex()
+    npts = metrics.GetIndexForLength(branchId, desiredLength)
+    if npts is None or npts < 3:
+        return float(np.sqrt(metrics.GetPointSectionArea(branchId, 1) / np.pi))
 
-    return branchMeanRadius
+    return float(index.ComputeEquivalentRadii([branchId], 
+        [index.GetArcLength(branchId, 1)], 
+        [index.GetArcLength(branchId, npts - 1)], useSectionArea=True)[0])
 
 def GetIndexCenterlineForADefinedLength(centerline, branchId, desiredLength, 
     verboseprint, isDirectionNeeded = False, nDiameter = 1.0):
@@ -600,6 +733,331 @@ def GetListProbePoints(centerline, network, verboseprint):
     return(pointsList)
 
 
+class CenterlineMetrics(object):
+    '''Geometric metrics of a centerline computed in one sweep.
+
+    All the stages filling a network need the same quantities: the length 
+    of the cells, the min and max spacing between points, the hydraulic
+    resistance radius of the cells and the radii and coordinates of the 
+    cells extremities. They are computed at once with numpy from the 
+    centerline arrays, so each point is read only once per run. The 
+    segments of the cell i (between its points k and k+1) are stored in
+    segmentLengths[segmentOffsets[i]:segmentOffsets[i+1]].
+    With numberOfWorkers > 1, the cells are shared between a pool of 
+    processes (see ParallelGeometry). When nDiameter is positive, the local
+    radii of all the cells are also computed.
+    With compact, the per-point and per-segment arrays are stored in single
+    precision and the ids and offsets as 32 bits integers, for whole-brain
+    centerlines. The sums (lengths, resistances) are still accumulated in
+    double precision, and the per-cell arrays are kept in double precision.
+
+    '''
+
+    def __init__(self, centerline, numberOfWorkers=1, nDiameter=0.0,
+        compact=False):
+        from vtk.util.numpy_support import vtk_to_numpy
+        self.compact = compact
+        self.points, self.radii, self.cellOffsets, self.cellPointIds = \
+            GetCenterlineArrays(centerline, compact=compact)
+        self.numberOfCells = len(self.cellOffsets) - 1
+        nPoints = np.diff(self.cellOffsets)
+        if np.any(nPoints == 0):
+            raise RuntimeError('The centerline has an empty cell.')
+        self.sectionAreas = None
+        if IsArrayDefined(centerline, SECTIONARRAYNAME):
+            self.sectionAreas = vtk_to_numpy(centerline.GetPointData().GetArray(
+                SECTIONARRAYNAME)).astype(self.radii.dtype)
+        self.resistanceIndex = None
+        self.groupIds = None
+        self.groupCellIds = None
+        self.groupOffsets = None
+        if IsArrayDefined(centerline, GROUPIDSARRAYNAME):
+            self.groupIds = vtk_to_numpy(
+                centerline.GetCellData().GetArray(GROUPIDSARRAYNAME))
+
+        # Segments between consecutive points of each cell and cells 
+        # quantities, computed by a pool of workers for large centerlines.
+        nSegments = nPoints - 1
+        self.segmentOffsets = np.concatenate(([0], np.cumsum(nSegments)))
+        self.localRadiiDiameter = nDiameter
+        if numberOfWorkers > 1 and self.numberOfCells > 1:
+            geometry = ComputeCellsGeometryParallel(self.points, self.radii, 
+                self.cellOffsets, self.cellPointIds, numberOfWorkers, 
+                nDiameter=nDiameter)
+        else:
+            geometry = ComputeCellsGeometry(self.points, self.radii, 
+                self.cellOffsets, self.cellPointIds, 0, self.numberOfCells, 
+                nDiameter=nDiameter)
+        for name in ('segmentLengths', 'segmentPointIds', 'cellLengths', 
+            'resistanceRadii', 'firstPoints', 'lastPoints', 'firstPointRadii', 
+            'lastPointRadii', 'localRadii'):
+            setattr(self, name, geometry[name])
+        if compact:
+            self.segmentOffsets = CompactIds(self.segmentOffsets)
+            self.segmentLengths = self.segmentLengths.astype(COMPACTFLOATTYPE, 
+                copy=False)
+            self.segmentPointIds = CompactIds(self.segmentPointIds)
+        self.segmentRadii = self.radii[self.segmentPointIds]
+
+        # Spacing between points.
+        nonZeroLengths = self.segmentLengths[self.segmentLengths > 0.0]
+        self.minSpacing = 10000.0
+        self.maxSpacing = 0.0
+        if len(nonZeroLengths) > 0:
+            self.minSpacing = min(self.minSpacing, float(nonZeroLengths.min()))
+            self.maxSpacing = float(nonZeroLengths.max())
+
+    def GetMemoryUsage(self):
+        '''Return the memory of the numpy arrays, in bytes, and the memory
+        they would take with the double precision and 64 bits types.'''
+        nBytes = 0
+        nBytes64 = 0
+        for value in self.__dict__.values():
+            if isinstance(value, np.ndarray):
+                nBytes += value.nbytes
+                nBytes64 += value.size*(8 if value.dtype.kind in 'fiu' 
+                    else value.itemsize)
+        return nBytes, nBytes64
+
+    def GetGeometricTolerance(self):
+        '''Return the min and max distances between consecutive points.'''
+        return self.minSpacing, self.maxSpacing
+
+    def GetGroupCellIds(self, groupId):
+        if self.groupOffsets is None:
+            # Cells of each group in a compressed sparse row form.
+            groupIds = self.groupIds.astype(np.int64)
+            self.groupCellIds = np.argsort(groupIds, kind='mergesort')
+            self.groupOffsets = np.concatenate(([0], 
+                np.cumsum(np.bincount(groupIds))))
+        if groupId < 0 or groupId + 1 >= len(self.groupOffsets):
+            raise RuntimeError('No VTK cell found for the group %i.' % groupId)
+        cellIds = self.groupCellIds[
+            self.groupOffsets[groupId]:self.groupOffsets[groupId + 1]]
+        if len(cellIds) == 0:
+            raise RuntimeError('No VTK cell found for the group %i.' % groupId)
+        return cellIds
+
+    def GetGroupLength(self, groupId):
+        '''Return the mean length of the cells of a group.'''
+        return float(self.cellLengths[self.GetGroupCellIds(groupId)].mean())
+
+    def GetGroupRadius(self, groupId):
+        '''Return the mean hydraulic resistance radius of the cells of a 
+        group.'''
+        return float(self.resistanceRadii[self.GetGroupCellIds(groupId)].mean())
+
+    def GetSegmentLengths(self, cellId):
+        return self.segmentLengths[
+            self.segmentOffsets[cellId]:self.segmentOffsets[cellId + 1]]
+
+    def GetSegmentRadii(self, cellId):
+        return self.segmentRadii[
+            self.segmentOffsets[cellId]:self.segmentOffsets[cellId + 1]]
+
+    def GetPoint(self, cellId, index):
+        '''Return the coordinates of the index-th point of a cell.'''
+        return self.points[self.cellPointIds[self.cellOffsets[cellId] + index]].tolist()
+
+    def GetPointSectionArea(self, cellId, index):
+        '''Return the section area of the index-th point of a cell.'''
+        if self.sectionAreas is None:
+            raise RuntimeError('The array %s is not defined.' % SECTIONARRAYNAME)
+        return float(self.sectionAreas[
+            self.cellPointIds[self.cellOffsets[cellId] + index]])
+
+    def GetResistanceIndex(self):
+        '''Return the hydraulic resistance index, built on first use.'''
+        if self.resistanceIndex is None:
+            self.resistanceIndex = HydraulicResistanceIndex(self)
+        return self.resistanceIndex
+
+    def GetPointRadius(self, cellId, index):
+        '''Return the radius of the index-th point of a cell.'''
+        return float(self.radii[self.cellPointIds[self.cellOffsets[cellId] + index]])
+
+    def GetIndexForLength(self, cellId, desiredLength):
+        '''Get the index of the point such as the desired distance between 
+        the index and the beginning of the cell is reached. Same convention 
+        as GetIndexCenterlineForADefinedLength.'''
+        dx = self.GetSegmentLengths(cellId)
+        if len(dx) == 0:
+            return None
+        k = np.searchsorted(np.cumsum(dx), desiredLength, side='left')
+        return int(min(k, len(dx) - 1))
+
+    def ComputeAverageRadius(self, cellId, desiredLength):
+        '''Return the hydraulic resistance radius over the first 
+        desiredLength of a cell. The radius of the first point is returned
+        when the length covers less than two points.'''
+        npts = self.GetIndexForLength(cellId, desiredLength)
+        if npts is None or npts < 2:
+            return float(self.firstPointRadii[cellId])
+        dx = self.GetSegmentLengths(cellId)[:npts - 1]
+        r = self.GetSegmentRadii(cellId)[:npts - 1]
+        return float((dx.sum() / (dx / r**4.0).sum())**0.25)
+
+    def ComputeLocalRadius(self, cellId, nDiameter):
+        '''Return the radius at nDiameter radii from the bifurcation.
+
+        The bifurcation is assumed to be at the cell extremity with the 
+        largest radius, as in GetIndexCenterlineForADefinedLength with
+        isDirectionNeeded.
+
+        '''
+        if nDiameter == self.localRadiiDiameter and nDiameter > 0.0:
+            return float(self.localRadii[cellId])
+        dx = self.GetSegmentLengths(cellId)
+        if len(dx) == 0:
+            return float(self.firstPointRadii[cellId])
+        if self.lastPointRadii[cellId] > self.firstPointRadii[cellId]:
+            desiredLength = nDiameter*self.lastPointRadii[cellId]
+            k = np.searchsorted(np.cumsum(dx[::-1]), desiredLength, side='left')
+            index = len(dx) - int(min(k, len(dx) - 1))
+        else:
+            desiredLength = nDiameter*self.firstPointRadii[cellId]
+            index = self.GetIndexForLength(cellId, desiredLength)
+        return self.GetPointRadius(cellId, index)
+
+    def ComputeLocalRadii(self, cellIds, nDiameter):
+        '''Return ComputeLocalRadius for several cells in one vectorized 
+        pass over their points.'''
+        cellIds = np.asarray(cellIds, dtype=np.int64)
+        if nDiameter == self.localRadiiDiameter and nDiameter > 0.0:
+            return self.localRadii[cellIds]
+        nPoints = self.cellOffsets[cellIds + 1] - self.cellOffsets[cellIds]
+        offsets = np.concatenate(([0], np.cumsum(nPoints)))
+        cells = np.repeat(np.arange(len(cellIds)), nPoints)
+        slots = self.cellOffsets[cellIds][cells] + np.arange(offsets[-1]) \
+            - offsets[cells]
+        geometry = ComputeCellsGeometry(self.points, self.radii, offsets, 
+            self.cellPointIds[slots], 0, len(cellIds), nDiameter=nDiameter)
+        return geometry['localRadii']
+
+
+class HydraulicResistanceIndex(object):
+    '''Prefix sums of the hydraulic resistance along the centerline cells.
+
+    The equivalent radius of a portion of a branch is the radius of the 
+    cylinder having the same length and hydraulic resistance: 
+    r = (sum(dx) / sum(dx / r^4))^(1/4), with r the radius at the beginning
+    of each segment dx. The arc length and the sum of dx / r^4 are
+    accumulated once for all the points of all the cells, so the equivalent
+    radius over any arc length window [start, end] of any cell is the 
+    difference of two prefix sums, found by bisection in O(log n). The 
+    radius is taken constant on each segment, so windows may start and end
+    inside segments. The same sums are kept for the radius derived from the 
+    section area (r^2 = S / pi), ignoring the points with a null area.
+
+    '''
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        nSlots = len(metrics.cellPointIds)
+        # The slot j of a cell is its j-th point: segment j goes from slot j 
+        # to slot j + 1. Slots are concatenated in the cells order so that the
+        # global arc length is monotonic.
+        isSegmentStart = np.ones(nSlots, dtype=bool)
+        isSegmentStart[metrics.cellOffsets[1:] - 1] = False
+        self.segmentStartSlots = np.nonzero(isSegmentStart)[0]
+        dx = np.zeros(nSlots)
+        dx[self.segmentStartSlots] = metrics.segmentLengths
+        self.rates = np.zeros(nSlots)
+        self.rates[self.segmentStartSlots] = 1.0 / \
+            metrics.segmentRadii.astype(np.float64)**4.0
+        self.arcLength = np.concatenate(([0.0], np.cumsum(dx)[:-1]))
+        self.resistance = np.concatenate(([0.0], np.cumsum(dx*self.rates)[:-1]))
+        self.sectionRates = None
+        if metrics.sectionAreas is not None:
+            S = metrics.sectionAreas[metrics.cellPointIds].astype(np.float64)
+            hasSection = (S > 0.0) & isSegmentStart
+            self.sectionLengthRates = hasSection.astype(np.float64)
+            self.sectionRates = np.zeros(nSlots)
+            self.sectionRates[hasSection] = 1.0 / (S[hasSection] / np.pi)**2.0
+            self.sectionLength = np.concatenate(([0.0], 
+                np.cumsum(dx*self.sectionLengthRates)[:-1]))
+            self.sectionResistance = np.concatenate(([0.0], 
+                np.cumsum(dx*self.sectionRates)[:-1]))
+
+    def GetArcLength(self, cellId, index):
+        '''Return the arc length from the beginning of a cell to its 
+        index-th point.'''
+        start = self.metrics.cellOffsets[cellId]
+        return float(self.arcLength[start + index] - self.arcLength[start])
+
+    def _Locate(self, cellIds, positions):
+        '''Return the global arc length and the segment start slot of the 
+        given positions, clipped to their cells.'''
+        cellIds = np.asarray(cellIds, dtype=np.int64)
+        firstSlots = self.metrics.cellOffsets[cellIds]
+        lastSlots = self.metrics.cellOffsets[cellIds + 1] - 1
+        x = self.arcLength[firstSlots] + np.asarray(positions, dtype=np.float64)
+        x = np.clip(x, self.arcLength[firstSlots], self.arcLength[lastSlots])
+        slots = np.searchsorted(self.arcLength, x, side='right') - 1
+        slots = np.clip(slots, firstSlots, np.maximum(firstSlots, lastSlots - 1))
+        return x, slots
+
+    def _Integrate(self, prefix, rates, x, slots):
+        return prefix[slots] + (x - self.arcLength[slots])*rates[slots]
+
+    def ComputeEquivalentRadii(self, cellIds, starts, ends, 
+        useSectionArea=False):
+        '''Return the equivalent radii over the windows [starts, ends].
+
+        The three arguments are sequences of the same size: the cell id and 
+        the arc lengths, from the beginning of the cell, of each window. All
+        the windows are answered in one vectorized call. A window of null 
+        length returns the radius of the segment it is located on.
+
+        '''
+        if useSectionArea and self.sectionRates is None:
+            raise RuntimeError('The array %s is not defined.' % SECTIONARRAYNAME)
+        x0, slots0 = self._Locate(cellIds, starts)
+        x1, slots1 = self._Locate(cellIds, ends)
+        if useSectionArea:
+            length = self._Integrate(self.sectionLength, 
+                self.sectionLengthRates, x1, slots1) - \
+                self._Integrate(self.sectionLength, 
+                self.sectionLengthRates, x0, slots0)
+            resistance = self._Integrate(self.sectionResistance, 
+                self.sectionRates, x1, slots1) - \
+                self._Integrate(self.sectionResistance, 
+                self.sectionRates, x0, slots0)
+            pointRates = self.sectionRates[slots0]
+        else:
+            length = x1 - x0
+            resistance = self._Integrate(self.resistance, self.rates, 
+                x1, slots1) - self._Integrate(self.resistance, self.rates, 
+                x0, slots0)
+            pointRates = self.rates[slots0]
+        radii = np.empty(len(x0))
+        isWindow = (length > 0.0) & (resistance > 0.0)
+        radii[isWindow] = (length[isWindow] / resistance[isWindow])**0.25
+        isPoint = ~isWindow & (pointRates > 0.0)
+        radii[isPoint] = pointRates[isPoint]**(-0.25)
+        radii[~isWindow & ~isPoint] = np.nan
+
+        return radii
+
+    def ComputeRadiusProfile(self, cellId, windowLength, step, 
+        useSectionArea=False):
+        '''Return the sliding window equivalent radius along a cell.
+
+        Windows of length windowLength are centered every step along the 
+        cell (and cut at its extremities). Returns the arc lengths of the
+        windows centers and the equivalent radii.
+
+        '''
+        cellLength = float(self.metrics.cellLengths[cellId])
+        centers = np.arange(0.0, cellLength + 0.5*step, step)
+        centers = centers[centers <= cellLength]
+        cellIds = np.repeat(cellId, len(centers))
+        radii = self.ComputeEquivalentRadii(cellIds, centers - 0.5*windowLength,
+            centers + 0.5*windowLength, useSectionArea=useSectionArea)
+
+        return centers, radii
+
+
 class Element(object):
 
     def __init__(self, Id):
@@ -621,6 +1079,7 @@ class Element(object):
         self.x1Id = -1
         self.behindSegment = None
         self.frontSegment = None
+        self.frontSegments = []
         self.alpha = 1.0
         self.beta = 0.0
         self.gamma = 0.0
@@ -643,6 +1102,13 @@ class Element(object):
     def SetFrontSegment(self, id):
         self.frontSegment = id
 
+    def AddFrontSegment(self, id):
+        '''Add a downstream segment. All of them are kept, the last one is 
+        also returned by GetFrontSegment.'''
+        if not(id in self.frontSegments):
+            self.frontSegments.append(id)
+        self.frontSegment = id
+
     def SetVtkGroupIdList(self, VtkGroupIdList):
         self.vtkGroupIdList = VtkGroupIdList
 
@@ -687,6 +1153,9 @@ class Element(object):
     def GetFrontSegment(self):
         return self.frontSegment
 
+    def GetFrontSegments(self):
+        return self.frontSegments
+
     def GetVtkCellIdList(self):
         return self.vtkCellIdList
 
@@ -708,6 +1177,9 @@ class Element(object):
     def GetInletRadius(self):
         return self.inletRadius
 
+    def GetLocalRadius(self):
+        return self.localRadius
+
     def GetMeanArea(self):
         meanArea = np.pi*(self.meanRadius**2.0)
         return meanArea
@@ -747,6 +1219,8 @@ class Network(object):
         self.numberOfBifurcations = 0
         self.numberOfOutlets = 0
         self.networkInletRadius = 0.0
+        self.centerlineMetrics = None
+        self.topology = None
 
     def AddElement(self, x):
         self.elements.append(x)
@@ -754,6 +1228,20 @@ class Network(object):
 
     def SetNetworkInletRadius(self, radius):
         self.networkInletRadius = radius
+
+    def SetCenterlineMetrics(self, metrics):
+        self.centerlineMetrics = metrics
+
+    def GetCenterlineMetrics(self):
+        return self.centerlineMetrics
+
+    def BuildTopology(self, compact=False):
+        '''Build the topology index. The connectivity has to be computed.'''
+        self.topology = NetworkTopology(self, compact=compact)
+        return self.topology
+
+    def GetTopology(self):
+        return self.topology
     
     def GetNumberOfElements(self):
         return self.numberOfElements
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 ## Christophe.Chnafa@gmail.com
 
+import numpy as np
+
+
 class FlowSplitting(object):
     '''This class computes the flow splitting from a network. See: 
     'Better than nothing: a rational approach for 
@@ -86,10 +89,19 @@ class FlowSplitting(object):
         '''
         if not(self.hasComputedAlphas):
             raise RuntimeError('Alpha coefficients need to be computed first.')
+        topology = network.GetTopology()
         # For each element of the network, ...
         for element in network.elements:
             if not(element.IsAnOutlet()):
                 continue
+            if topology is not None and topology.preorder[element.GetId()] > 0:
+                # The path to the inlet is read from the topology index.
+                beta = 1.0
+                for Id in topology.GetPathToInlet(element.GetId())[1:]:
+                    if network.elements[Id].IsBlanked():
+                        beta *= network.elements[Id].GetAlpha()
+                element.SetBeta(beta)
+                continue
             foundNetworkRoot = False
             beta = 1.0
             currentElement = element
@@ -148,4 +160,374 @@ class FlowSplitting(object):
                     sumGamma += element.GetGamma()
             if abs(sumGamma - 1.0) > tol:
                 raise RuntimeError('Unexpected error, sum(Gamma) coefficients != 1.0')
-    
+
+
+class FlowSplittingUncertainty(object):
+    '''This class estimates the uncertainty of the outlets beta coefficient.
+
+    The radii extracted from the maximum inscribed sphere radius carry the
+    segmentation uncertainty. Instead of running the whole pipeline for each
+    perturbed geometry, the alpha/beta recursion of FlowSplitting is
+    flattened once into matrices: each blanked segment belongs to a division
+    (segments sharing the same x0Id) and each outlet beta is the product of
+    the alpha coefficients of the blanked segments on its path to the inlet.
+    The alphas and betas of all the samples are then computed at once as
+    (samples x elements) array operations.
+
+    '''
+
+    def __init__(self, network, verboseprint, PowerLawUsesLocalRadii=False):
+        if network.GetNumberOfOutlet() < 2:
+            raise RuntimeError('The network is constitued has only one outlet.')
+        self.PowerLawUsesLocalRadii = PowerLawUsesLocalRadii
+        self.numberOfElements = len(network.elements)
+        self.outletIds = []
+        blankedIds = []
+        frontIds = []
+        divisionIds = []
+        divisionKeys = {}
+        for element in network.elements:
+            if element.IsAnOutlet():
+                self.outletIds.append(element.GetId())
+            if not(element.IsBlanked()):
+                continue
+            blankedIds.append(element.GetId())
+            frontIds.append(element.GetFrontSegment())
+            key = element.GetInPointsx0Id()
+            if not(key in divisionKeys):
+                divisionKeys[key] = len(divisionKeys)
+            divisionIds.append(divisionKeys[key])
+        nBlanked = len(blankedIds)
+        nDivisions = len(divisionKeys)
+        self.frontIds = np.array(frontIds, dtype=np.int64)
+        self.divisionIds = np.array(divisionIds, dtype=np.int64)
+        # Division membership of the blanked segments (nBlanked x nDivisions).
+        self.divisionMatrix = np.zeros((nBlanked, nDivisions))
+        self.divisionMatrix[np.arange(nBlanked), self.divisionIds] = 1.0
+        if np.any(self.divisionMatrix.sum(axis=0) < 2.0):
+            raise RuntimeError('Unexpected error, '
+                'adjacent branch not found. Check the connectivity and/or'
+                'the tolerance for the connectivity computation. ')
+        # Blanked segments crossed from each outlet to the inlet
+        # (nBlanked x nOutlets).
+        blankedIndex = dict((Id, i) for i, Id in enumerate(blankedIds))
+        self.pathMatrix = np.zeros((nBlanked, len(self.outletIds)))
+        for j, outletId in enumerate(self.outletIds):
+            currentElement = network.elements[outletId]
+            while not(currentElement.IsAnInlet()):
+                if currentElement.GetBehindSegment() == None:
+                    raise RuntimeError('The network is constitued of one segment '
+                        'or the input centerlines have a hanging segment.')
+                currentElement = network.elements[currentElement.GetBehindSegment()]
+                if currentElement.IsBlanked():
+                    self.pathMatrix[blankedIndex[currentElement.GetId()], j] = 1.0
+        if PowerLawUsesLocalRadii:
+            self.radii = np.array([el.GetLocalRadius() for el in network.elements])
+        else:
+            self.radii = np.array([el.GetMeanRadius() for el in network.elements])
+        verboseprint('> Uncertainty: %i divisions, %i blanked segments and '
+            '%i outlets.' % (nDivisions, nBlanked, len(self.outletIds)))
+
+    def ComputeBetaSamples(self, radii):
+        '''Return the outlets beta coefficient for each sample of radii.
+
+        radii is a (nSamples x nElements) array. The alpha coefficient of
+        each blanked segment is S_i / sum_1^N(S_j) over its division, S being
+        the area of the segment in front of the blanked segment. The betas,
+        returned as a (nSamples x nOutlets) array, are the products of the
+        alphas along the path to the inlet, computed as exp(log(alpha).P).
+
+        '''
+        areas = np.pi*np.asarray(radii)**2.0
+        S = areas[:, self.frontIds]
+        sumSurfaces = np.dot(S, self.divisionMatrix)
+        alphas = S / sumSurfaces[:, self.divisionIds]
+
+        return np.exp(np.dot(np.log(alphas), self.pathMatrix))
+
+    def SampleElementRadii(self, nSamples, relativeError, randomState):
+        '''Return (nSamples x nElements) radii with a multiplicative
+        log-normal perturbation of standard deviation relativeError.'''
+        noise = randomState.standard_normal((nSamples, self.numberOfElements))
+
+        return self.radii[np.newaxis, :]*np.exp(relativeError*noise)
+
+    def SetPointRadiiSampling(self, centerline, network, verboseprint):
+        '''Prepare the perturbation of the centerline radius array.
+
+        The perturbations are then applied on each point of the centerline
+        before the hydraulic resistance averaging of ComputeBranchRadius.
+        Element radii are the mean of their cells radii as in
+        ComputeGroupRadius. Only available for the mean radii.
+
+        '''
+        from . import ImportData
+        if self.PowerLawUsesLocalRadii:
+            raise RuntimeError('The point radii perturbation is not available '
+                'with local radii.')
+        metrics = network.GetCenterlineMetrics()
+        if metrics is None:
+            metrics = ImportData.CenterlineMetrics(centerline)
+        cellIds = sorted(set(cellId for el in network.elements
+            for cellId in el.GetVtkCellIdList()))
+        cellIndex = dict((cellId, i) for i, cellId in enumerate(cellIds))
+        segmentIndex = []
+        for cellId in cellIds:
+            if metrics.segmentOffsets[cellId + 1] == metrics.segmentOffsets[cellId]:
+                raise RuntimeError('The VTK cell %i has less than two points.'
+                    % cellId)
+            segmentIndex.append(np.arange(metrics.segmentOffsets[cellId],
+                metrics.segmentOffsets[cellId + 1]))
+        segmentCounts = np.array([len(k) for k in segmentIndex])
+        segmentIndex = np.concatenate(segmentIndex)
+        self.segmentLength = metrics.segmentLengths[segmentIndex]
+        self.segmentOffsets = np.concatenate(([0], np.cumsum(segmentCounts)[:-1]))
+        self.cellLength = metrics.cellLengths[cellIds]
+        self.perturbedPointIds, self.segmentPointIndex = np.unique(
+            metrics.segmentPointIds[segmentIndex], return_inverse=True)
+        self.pointRadii = metrics.radii[self.perturbedPointIds]
+        # Averaging of the cells radii per element (nCells x nElements).
+        self.cellToElement = np.zeros((len(cellIds), self.numberOfElements))
+        for el in network.elements:
+            elementCells = el.GetVtkCellIdList()
+            for cellId in elementCells:
+                self.cellToElement[cellIndex[cellId], el.GetId()] = \
+                    1.0 / len(elementCells)
+        verboseprint('> Uncertainty: %i perturbed centerline points.'
+            % len(self.perturbedPointIds))
+
+    def SamplePointRadii(self, nSamples, relativeError, randomState):
+        '''Return (nSamples x nElements) radii averaged from perturbed
+        centerline points radii.'''
+        noise = randomState.standard_normal(
+            (nSamples, len(self.perturbedPointIds)))
+        r = self.pointRadii[np.newaxis, :]*np.exp(relativeError*noise)
+        r = r[:, self.segmentPointIndex]
+        resistance = np.add.reduceat(self.segmentLength / r**4.0,
+            self.segmentOffsets, axis=1)
+        cellRadii = (self.cellLength / resistance)**0.25
+
+        return np.dot(cellRadii, self.cellToElement)
+
+    def ComputeBetaPercentiles(self, nSamples, relativeError, verboseprint,
+        perturbPoints=False, percentiles=(5.0, 50.0, 95.0), seed=None,
+        maxChunkValues=10**7):
+        '''Return the percentiles (nPercentiles x nOutlets) of the outlets
+        beta coefficient over nSamples perturbed geometries.
+
+        The samples are processed by chunks so that the temporary arrays
+        hold at most about maxChunkValues values.
+
+        '''
+        randomState = np.random.RandomState(seed)
+        if perturbPoints:
+            if not(hasattr(self, 'segmentLength')):
+                raise RuntimeError('SetPointRadiiSampling has to be called first.')
+            valuesPerSample = len(self.segmentLength)
+        else:
+            valuesPerSample = self.numberOfElements
+        chunkSize = max(1, int(maxChunkValues // max(1, valuesPerSample)))
+        betas = np.zeros((nSamples, len(self.outletIds)))
+        for start in range(0, nSamples, chunkSize):
+            n = min(chunkSize, nSamples - start)
+            if perturbPoints:
+                radii = self.SamplePointRadii(n, relativeError, randomState)
+            else:
+                radii = self.SampleElementRadii(n, relativeError, randomState)
+            betas[start:start + n] = self.ComputeBetaSamples(radii)
+        verboseprint('> Uncertainty: %i samples computed.' % nSamples)
+
+        return np.percentile(betas, list(percentiles), axis=0)
+
+
+class FlowSplittingSensitivity(object):
+    '''This class computes the sensitivity of the outlets beta coefficient
+    to the radii of the elements.
+
+    The alpha coefficient of a blanked segment e of a division D is
+    S_f(e) / sum_D(S_f(k)), f(e) being the segment in front of e and S the
+    area pi r^2. Hence d log(alpha_e) / d r_f(k) = 2 / r_f(k) ([k = e] -
+    alpha_k) for the segments k of D and 0 otherwise. An outlet beta being
+    the product of the alphas of the blanked segments upstream of it,
+    d beta_o / d r_f(k) = beta_o sum(d log(alpha_e) / d r_f(k)) over the
+    blanked segments e upstream of o. The log betas of all the elements
+    are accumulated in one forward (inlet to outlets) traversal, level by
+    level, and the outlets downstream of each blanked segment are a
+    contiguous range of the outlets sorted in the topology preorder, which
+    gives all the non-zero derivatives as array operations. The Jacobian
+    is stored in a sparse (coordinate) form.
+
+    '''
+
+    def __init__(self, network, verboseprint, PowerLawUsesLocalRadii=False):
+        self.topology = network.GetTopology()
+        if self.topology is None:
+            self.topology = network.BuildTopology()
+        if len(self.topology.outletsByPreorder) < 2:
+            raise RuntimeError('The network is constitued has only one outlet.')
+        self.numberOfElements = len(network.elements)
+        blankedIds = []
+        frontIds = []
+        divisionIds = []
+        divisionKeys = {}
+        for element in network.elements:
+            if not(element.IsBlanked()):
+                continue
+            blankedIds.append(element.GetId())
+            frontIds.append(element.GetFrontSegment())
+            key = element.GetInPointsx0Id()
+            if not(key in divisionKeys):
+                divisionKeys[key] = len(divisionKeys)
+            divisionIds.append(divisionKeys[key])
+        self.blankedIds = np.array(blankedIds, dtype=np.int64)
+        self.frontIds = np.array(frontIds, dtype=np.int64)
+        self.divisionIds = np.array(divisionIds, dtype=np.int64)
+        self.numberOfDivisions = len(divisionKeys)
+        # Segments of each division in a compressed sparse row form.
+        self.memberIds = np.argsort(self.divisionIds, kind='mergesort')
+        counts = np.bincount(self.divisionIds, minlength=self.numberOfDivisions)
+        if np.any(counts < 2):
+            raise RuntimeError('Unexpected error, '
+                'adjacent branch not found. Check the connectivity and/or'
+                'the tolerance for the connectivity computation. ')
+        self.memberOffsets = np.concatenate(([0], np.cumsum(counts)))
+        if PowerLawUsesLocalRadii:
+            self.radii = np.array([el.GetLocalRadius() for el in network.elements])
+        else:
+            self.radii = np.array([el.GetMeanRadius() for el in network.elements])
+        self.outletIds = self.topology.outletsByPreorder
+        verboseprint('> Sensitivity: %i divisions, %i blanked segments and '
+            '%i outlets.' % (self.numberOfDivisions, len(blankedIds), 
+            len(self.outletIds)))
+
+    def ComputeAlphas(self, radii):
+        '''Return the alpha coefficient of the blanked segments.'''
+        S = np.pi*np.asarray(radii)[self.frontIds]**2.0
+        sumSurfaces = np.bincount(self.divisionIds, weights=S,
+            minlength=self.numberOfDivisions)
+        return S / sumSurfaces[self.divisionIds]
+
+    def ComputeBetas(self, alphas):
+        '''Return the product of the alphas upstream of every element 
+        (the beta coefficient of the outlets), by a forward traversal.'''
+        topology = self.topology
+        logAlphas = np.zeros(self.numberOfElements)
+        logAlphas[self.blankedIds] = np.log(alphas)
+        logBetas = np.zeros(self.numberOfElements)
+        reached = topology.visitOrder
+        depths = topology.depths[reached]
+        order = np.argsort(depths, kind='mergesort')
+        levels = np.searchsorted(depths[order], np.arange(depths.max() + 2))
+        for d in range(1, len(levels) - 1):
+            ids = reached[order[levels[d]:levels[d + 1]]]
+            parents = topology.parents[ids]
+            logBetas[ids] = logBetas[parents] + logAlphas[parents]
+        return np.exp(logBetas)
+
+    def ComputeJacobian(self, radii=None):
+        '''Return the sparse Jacobian d(beta_outlet) / d(radius_element).
+
+        Returns the outlets betas and the (outlet index, element id,
+        derivative) arrays of the non-zero entries, the outlet index
+        referring to outletIds. The radii of the network are used by 
+        default.
+
+        '''
+        if radii is None:
+            radii = self.radii
+        radii = np.asarray(radii, dtype=np.float64)
+        topology = self.topology
+        alphas = self.ComputeAlphas(radii)
+        betas = self.ComputeBetas(alphas)[self.outletIds]
+
+        # Outlets strictly downstream of each blanked segment.
+        isReached = topology.preorder[self.blankedIds] >= 0
+        blanked = np.nonzero(isReached)[0]
+        first = topology.preorder[self.blankedIds[blanked]]
+        outletsStart = np.searchsorted(topology.outletsPreorder, first + 1)
+        outletsEnd = np.searchsorted(topology.outletsPreorder,
+            first + topology.subtreeSizes[self.blankedIds[blanked]])
+        nOutlets = outletsEnd - outletsStart
+
+        # Pairs (blanked segment e, segment k of its division).
+        divisions = self.divisionIds[blanked]
+        nMembers = self.memberOffsets[divisions + 1] - self.memberOffsets[divisions]
+        pairOffsets = np.concatenate(([0], np.cumsum(nMembers)))
+        pairs = np.repeat(np.arange(len(blanked)), nMembers)
+        memberRanks = np.arange(pairOffsets[-1]) - pairOffsets[pairs]
+        members = self.memberIds[self.memberOffsets[divisions[pairs]] + memberRanks]
+        logDerivatives = 2.0 / radii[self.frontIds[members]] * \
+            ((members == blanked[pairs]) - alphas[members])
+
+        # Entries (outlet o, element f(k)) for the outlets downstream of e.
+        entryCounts = nOutlets[pairs]
+        entryOffsets = np.concatenate(([0], np.cumsum(entryCounts)))
+        entryPairs = np.repeat(np.arange(len(pairs)), entryCounts)
+        rows = outletsStart[pairs[entryPairs]] + \
+            np.arange(entryOffsets[-1]) - entryOffsets[entryPairs]
+        columns = self.frontIds[members[entryPairs]]
+        values = betas[rows]*logDerivatives[entryPairs]
+
+        # Sum the contributions of the divisions crossed by a same outlet.
+        keys, inverse = np.unique(rows*self.numberOfElements + columns,
+            return_inverse=True)
+        values = np.bincount(inverse, weights=values, minlength=len(keys))
+        rows = keys // self.numberOfElements
+        columns = keys % self.numberOfElements
+        isNonZero = values != 0.0
+
+        return betas, rows[isNonZero], columns[isNonZero], values[isNonZero]
+
+    def ComputeElasticities(self, radii=None):
+        '''Return the betas and the sparse relative sensitivities 
+        d log(beta_outlet) / d log(radius_element).'''
+        if radii is None:
+            radii = self.radii
+        betas, rows, columns, values = self.ComputeJacobian(radii)
+        return betas, rows, columns, \
+            values*np.asarray(radii)[columns] / betas[rows]
+
+    def RankElements(self, radii=None, numberOfElements=10):
+        '''Return the elements ids sorted by decreasing influence on the
+        outlets betas, sum over the outlets of |d log(beta) / d log(r)|,
+        with their influence.'''
+        betas, rows, columns, elasticities = self.ComputeElasticities(radii)
+        influence = np.bincount(columns, weights=np.abs(elasticities),
+            minlength=self.numberOfElements)
+        order = np.argsort(-influence, kind='mergesort')[:numberOfElements]
+        order = order[influence[order] > 0.0]
+        return order, influence[order]
+
+
+class FlowSplittingExplorer(object):
+    '''This class recomputes the outlets beta coefficient for another 
+    definition of the radii (mean radii or local radii at nDiameter radii
+    from the divisions) from the cached centerline geometry, without 
+    rebuilding the network. Only the local radii of the segments in front
+    of the divisions are computed, in one vectorized pass, and the alphas
+    and betas are array operations (see FlowSplittingSensitivity).
+
+    '''
+
+    def __init__(self, network, verboseprint):
+        self.splitting = FlowSplittingSensitivity(network, verboseprint)
+        self.metrics = network.GetCenterlineMetrics()
+        if self.metrics is None:
+            raise RuntimeError('The network has no centerline metrics.')
+        self.meanRadii = np.array([el.GetMeanRadius() for el in network.elements])
+        self.frontIds = np.unique(self.splitting.frontIds)
+        self.frontCellIds = np.array([network.elements[Id].GetVtkCellIdList()[0]
+            for Id in self.frontIds], dtype=np.int64)
+
+    def ComputeRadii(self, nDiameter):
+        '''Return the radii of the elements, local when nDiameter > 0.'''
+        radii = self.meanRadii.copy()
+        if nDiameter > 0.0:
+            radii[self.frontIds] = self.metrics.ComputeLocalRadii(
+                self.frontCellIds, nDiameter)
+        return radii
+
+    def ComputeBetas(self, nDiameter, elementIds):
+        '''Return the beta coefficient of the given outlets.'''
+        alphas = self.splitting.ComputeAlphas(self.ComputeRadii(nDiameter))
+        return self.splitting.ComputeBetas(alphas)[np.asarray(elementIds)]
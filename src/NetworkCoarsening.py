@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import numpy as np
+
+from . import ImportData
+
+
+def FindChains(network):
+    '''Return the chains of non-blanked elements joined end to end.
+
+    An element is merged with the element behind it when both are not
+    blanked and it is the only element in front of it. Returns the list of
+    the chains, each one being the list of its elements ids from upstream
+    to downstream, sorted by the id of their first element (the inlet
+    chain is the first one). Every element belongs to exactly one chain.
+
+    '''
+    topology = network.GetTopology()
+    if topology is None:
+        topology = network.BuildTopology()
+    nChildren = np.diff(topology.childOffsets)
+    heads = np.arange(len(network.elements))
+    for i in topology.visitOrder:
+        parent = topology.parents[i]
+        if parent < 0 or topology.isBlanked[i] or topology.isBlanked[parent]:
+            continue
+        if nChildren[parent] == 1:
+            heads[i] = heads[parent]
+    # Elements of each chain in preorder, i.e. from upstream to downstream.
+    preorder = np.where(topology.preorder >= 0, topology.preorder,
+        len(heads) + np.arange(len(heads)))
+    order = np.lexsort((preorder, heads))
+    chainStarts = np.nonzero(np.diff(np.concatenate(([-1], heads[order]))))[0]
+    return [order[start:end].tolist() for start, end in
+        zip(chainStarts, np.append(chainStarts[1:], len(order)))]
+
+def CoarsenNetwork(network, verboseprint):
+    '''Return a network where each chain of non-blanked elements (see
+    FindChains) is collapsed into one equivalent element, with the mapping
+    between the two networks.
+
+    The equivalent element has the summed length and the radius of the
+    cylinder of same length and hydraulic resistance (series resistances:
+    r = (sum(L) / sum(L / r^4))^(1/4)); its inlet and local radii are the
+    ones of its first element, near the upstream division, and its outlet
+    radius the one of its last element. With the mean radii, the alphas of
+    the coarse network use the equivalent radius of the whole chain. The
+    blanked elements are kept as they are. Returns the coarse network,
+    the coarse element id of each element and the elements of each coarse
+    element.
+
+    '''
+    chains = FindChains(network)
+    fineToCoarse = np.zeros(len(network.elements), dtype=np.int64)
+    for coarseId, chain in enumerate(chains):
+        fineToCoarse[chain] = coarseId
+
+    def CoarseId(Id):
+        if Id is None:
+            return None
+        return int(fineToCoarse[Id])
+
+    coarseNetwork = ImportData.Network()
+    for coarseId, chain in enumerate(chains):
+        first = network.elements[chain[0]]
+        last = network.elements[chain[-1]]
+        lengths = np.array([network.elements[Id].GetLength() for Id in chain])
+        radii = np.array([network.elements[Id].GetMeanRadius() for Id in chain])
+        el = ImportData.Element(Id = coarseId)
+        el.SetLength(float(lengths.sum()))
+        if len(chain) == 1 or np.any(radii <= 0.0) or lengths.sum() <= 0.0:
+            el.SetMeanRadius(first.GetMeanRadius())
+        else:
+            el.SetMeanRadius(float((lengths.sum()
+                / (lengths / radii**4.0).sum())**0.25))
+        el.SetInletRadius(first.GetInletRadius())
+        el.SetLocalRadius(first.GetLocalRadius())
+        el.SetOutletRadius(last.outletRadius)
+        el.SetBlanking(first.IsBlanked())
+        el.SetIfInlet(first.IsAnInlet())
+        el.SetIfOutlet(last.IsAnOutlet())
+        el.SetInOutPointsCoordinates(first.GetInPointsx0(), last.GetOutPointsx1())
+        el.SetInOutPointsIds(first.GetInPointsx0Id(), last.GetOutPointsx1Id())
+        el.SetVtkCellIdList([cellId for Id in chain
+            for cellId in network.elements[Id].GetVtkCellIdList()])
+        el.SetVtkGroupIdList([groupId for Id in chain
+            for groupId in network.elements[Id].GetVtkGroupIdList()])
+        el.SetBehindSegment(CoarseId(first.GetBehindSegment()))
+        for Id in last.GetFrontSegments():
+            el.AddFrontSegment(CoarseId(Id))
+        el.SetFrontSegment(CoarseId(last.GetFrontSegment()))
+        el.SetAlpha(first.GetAlpha())
+        el.SetBeta(last.GetBeta())
+        coarseNetwork.AddElement(el)
+    coarseNetwork.SetNetworkInletRadius(network.GetNetworkInletRadius())
+    coarseNetwork.SetCenterlineMetrics(network.GetCenterlineMetrics())
+    if network.GetTopology() is not None:
+        coarseNetwork.BuildTopology()
+    verboseprint('> Coarsening: %i elements -> %i elements.'
+        % (len(network.elements), len(chains)))
+
+    return coarseNetwork, fineToCoarse, chains
+
+def ExpandFlowSplitting(coarseNetwork, network, chains):
+    '''Copy the alpha and beta coefficients computed on a coarse network
+    to the elements of the network it was built from.'''
+    for coarseId, chain in enumerate(chains):
+        coarseElement = coarseNetwork.elements[coarseId]
+        for Id in chain:
+            el = network.elements[Id]
+            el.SetAlpha(coarseElement.GetAlpha() if Id == chain[0] else 1.0)
+            if el.IsAnOutlet():
+                el.SetBeta(coarseElement.GetBeta())
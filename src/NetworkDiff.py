@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import os
+
+import numpy as np
+import vtk
+
+# Maximal distance between the extremities of two matched elements, as a
+# fraction of the element radius.
+MATCHINGTOLERANCE = 0.5
+# Relative change of the length or radius of a changed element.
+CHANGETOLERANCE = 0.01
+# Number of candidate elements considered for each element.
+NUMBEROFCANDIDATEELEMENTS = 8
+
+
+def _GetEndpoints(network):
+    '''Return the first x0 and x1 points and the mean radius of the
+    elements of a network as arrays.'''
+    x0 = np.array([el.GetInPointsx0()[0] for el in network.elements],
+        dtype=np.float64).reshape(-1, 3)
+    x1 = np.array([el.GetOutPointsx1()[0] for el in network.elements],
+        dtype=np.float64).reshape(-1, 3)
+    radii = np.array([el.GetMeanRadius() for el in network.elements],
+        dtype=np.float64)
+    return x0, x1, radii
+
+def MatchElements(network, otherNetwork, tolerance=MATCHINGTOLERANCE,
+    neighbours=NUMBEROFCANDIDATEELEMENTS):
+    '''Match the elements of two networks of the same vasculature.
+
+    The start points x0 of the elements of otherNetwork are put in a k-d
+    tree and the nearest start points of each element of network are
+    queried. A pair is a candidate when both extremities are closer than
+    tolerance times the element radius and the elements have the same
+    blanking. The candidates are then assigned by increasing distance, one
+    element to one element. Returns the matched element of otherNetwork
+    for each element of network (-1 if none) and the distances.
+
+    '''
+    x0, x1, radii = _GetEndpoints(network)
+    otherX0, otherX1, otherRadii = _GetEndpoints(otherNetwork)
+    n = len(network.elements)
+    points = vtk.vtkPoints()
+    for x in otherX0:
+        points.InsertNextPoint(x)
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(points)
+    locator = vtk.vtkKdTreePointLocator()
+    locator.SetDataSet(polyData)
+    locator.BuildLocator()
+
+    k = min(neighbours, len(otherX0))
+    candidates = np.zeros((n, k), dtype=np.int64)
+    idList = vtk.vtkIdList()
+    for i in range(0, n):
+        locator.FindClosestNPoints(k, x0[i], idList)
+        for j in range(0, k):
+            candidates[i, j] = idList.GetId(j)
+    elements = np.repeat(np.arange(n), k)
+    candidates = candidates.ravel()
+    d0 = np.sqrt(((otherX0[candidates] - x0[elements])**2.0).sum(axis=1))
+    d1 = np.sqrt(((otherX1[candidates] - x1[elements])**2.0).sum(axis=1))
+    isBlanked = np.array([el.IsBlanked() for el in network.elements], dtype=bool)
+    otherIsBlanked = np.array([el.IsBlanked() for el in otherNetwork.elements],
+        dtype=bool)
+    maxDistance = tolerance*np.maximum(radii[elements], otherRadii[candidates])
+    isCandidate = (d0 <= maxDistance) & (d1 <= maxDistance) & \
+        (isBlanked[elements] == otherIsBlanked[candidates])
+    elements = elements[isCandidate]
+    candidates = candidates[isCandidate]
+    distances = d0[isCandidate] + d1[isCandidate]
+
+    matches = -np.ones(n, dtype=np.int64)
+    matchDistances = np.zeros(n)
+    isFree = np.ones(len(otherNetwork.elements), dtype=bool)
+    for slot in np.argsort(distances, kind='mergesort'):
+        i = elements[slot]
+        j = candidates[slot]
+        if matches[i] < 0 and isFree[j]:
+            matches[i] = j
+            matchDistances[i] = distances[slot]
+            isFree[j] = False
+    return matches, matchDistances
+
+def DiffNetworks(network, otherNetwork, verboseprint,
+    tolerance=MATCHINGTOLERANCE, changeTolerance=CHANGETOLERANCE,
+    PowerLawUsesLocalRadii=False):
+    '''Compare two networks of the same vasculature, e.g. before and after
+    a treatment.
+
+    The elements are matched by their extremities (MatchElements). A
+    matched element is changed when its length or its radius (mean radius,
+    or local radius with PowerLawUsesLocalRadii) changed by more than
+    changeTolerance in relative terms, or when its front segments are not
+    the matches of the front segments of its match. Returns a dictionary
+    with the matches of the elements of network, the inverse matches, and
+    the lists of removed (ids in network), added (ids in otherNetwork),
+    changed and resized (only the length or radius changed) elements (ids
+    in otherNetwork).
+
+    '''
+    matches, distances = MatchElements(network, otherNetwork,
+        tolerance=tolerance)
+    inverseMatches = -np.ones(len(otherNetwork.elements), dtype=np.int64)
+    isMatched = matches >= 0
+    inverseMatches[matches[isMatched]] = np.nonzero(isMatched)[0]
+
+    def Radius(el):
+        if PowerLawUsesLocalRadii:
+            return el.GetLocalRadius()
+        return el.GetMeanRadius()
+
+    def RelativeChange(a, b):
+        return abs(a - b) / max(abs(a), abs(b), 1e-300)
+
+    changed = []
+    resized = []
+    for Id in np.nonzero(inverseMatches >= 0)[0]:
+        el = otherNetwork.elements[Id]
+        previous = network.elements[inverseMatches[Id]]
+        fronts = sorted(inverseMatches[k] for k in el.GetFrontSegments())
+        isResized = \
+            RelativeChange(el.GetLength(), previous.GetLength()) > changeTolerance \
+            or RelativeChange(Radius(el), Radius(previous)) > changeTolerance
+        if isResized:
+            resized.append(int(Id))
+        if isResized or fronts != sorted(previous.GetFrontSegments()):
+            changed.append(int(Id))
+    diff = {'matches': matches,
+            'inverseMatches': inverseMatches,
+            'distances': distances,
+            'removed': np.nonzero(~isMatched)[0].tolist(),
+            'added': np.nonzero(inverseMatches < 0)[0].tolist(),
+            'changed': changed,
+            'resized': resized}
+    verboseprint('> Network diff: %i matched, %i removed, %i added and %i '
+        'changed elements.' % (np.count_nonzero(isMatched),
+        len(diff['removed']), len(diff['added']), len(changed)))
+    return diff
+
+def UpdateFlowSplitting(network, otherNetwork, diff, verboseprint,
+    PowerLawUsesLocalRadii=False):
+    '''Compute the flow splitting of otherNetwork from the one of network,
+    recomputing only the divisions and outlets affected by the diff.
+
+    network has its alphas and betas computed and otherNetwork its
+    connectivity and topology. A division (blanked elements sharing their
+    x0 point) of otherNetwork is recomputed when one of its elements or of
+    their front segments is added, when one of its elements is changed
+    (e.g. its front segment rewired), when one of the front segments is
+    resized, or when its matched division had another number of elements;
+    the alphas of the other divisions are copied. Only the outlets downstream of a recomputed division, or
+    without a matched outlet, have their beta recomputed; the others keep
+    the beta of their match. Returns the table of the outlets changes
+    (element in otherNetwork, element in network, beta before, beta after),
+    removed outlets having no element in otherNetwork (-1) and a zero beta
+    after, and the number of recomputed divisions.
+
+    '''
+    topology = otherNetwork.GetTopology()
+    if topology is None:
+        topology = otherNetwork.BuildTopology()
+    matches = diff['matches']
+    inverseMatches = diff['inverseMatches']
+    elements = otherNetwork.elements
+    isAdded = inverseMatches < 0
+    isResized = np.zeros(len(elements), dtype=bool)
+    isResized[diff['resized']] = True
+    isChanged = np.zeros(len(elements), dtype=bool)
+    isChanged[diff['changed']] = True
+
+    # Divisions of both networks, by x0 point id.
+    divisionSizes = {}
+    for el in network.elements:
+        if el.IsBlanked():
+            divisionSizes[el.GetInPointsx0Id()] = \
+                divisionSizes.get(el.GetInPointsx0Id(), 0) + 1
+    divisions = {}
+    for el in elements:
+        if el.IsBlanked() and el.GetBehindSegment() is not None:
+            divisions.setdefault(el.GetInPointsx0Id(), []).append(el.GetId())
+
+    recomputedIds = []
+    for members in divisions.values():
+        fronts = [elements[Id].GetFrontSegment() for Id in members]
+        isRecomputed = \
+            any(isAdded[Id] or isChanged[Id] for Id in members) or \
+            any(isAdded[Id] or isResized[Id] for Id in fronts) or \
+            divisionSizes.get(network.elements[inverseMatches[members[0]]]
+                .GetInPointsx0Id()) != len(members)
+        if not(isRecomputed):
+            for Id in members:
+                elements[Id].SetAlpha(
+                    network.elements[inverseMatches[Id]].GetAlpha())
+            continue
+        if len(members) < 2:
+            raise RuntimeError('Unexpected error, '
+                'adjacent branch not found. Check the connectivity and/or'
+                'the tolerance for the connectivity computation. ')
+        if PowerLawUsesLocalRadii:
+            areas = np.array([elements[Id].GetLocalArea() for Id in fronts])
+        else:
+            areas = np.array([elements[Id].GetMeanArea() for Id in fronts])
+        for Id, alpha in zip(members, areas / areas.sum()):
+            elements[Id].SetAlpha(float(alpha))
+        recomputedIds.extend(members)
+
+    # Outlets to recompute.
+    isRecomputedOutlet = np.zeros(len(elements), dtype=bool)
+    for Id in recomputedIds:
+        isRecomputedOutlet[topology.GetDescendantOutlets(Id)] = True
+    for Id in topology.outletsByPreorder:
+        previousId = inverseMatches[Id]
+        if previousId < 0 or not(network.elements[previousId].IsAnOutlet()):
+            isRecomputedOutlet[Id] = True
+    table = []
+    for el in elements:
+        if not(el.IsAnOutlet()):
+            continue
+        Id = el.GetId()
+        previousId = int(inverseMatches[Id])
+        if isRecomputedOutlet[Id]:
+            beta = 1.0
+            for k in topology.GetPathToInlet(Id)[1:]:
+                if elements[k].IsBlanked():
+                    beta *= elements[k].GetAlpha()
+            el.SetBeta(beta)
+        else:
+            el.SetBeta(network.elements[previousId].GetBeta())
+        previousBeta = 0.0
+        if previousId >= 0 and network.elements[previousId].IsAnOutlet():
+            previousBeta = network.elements[previousId].GetBeta()
+        table.append((Id, previousId, previousBeta, el.GetBeta()))
+    for el in network.elements:
+        if el.IsAnOutlet() and (matches[el.GetId()] < 0 or
+            not(elements[matches[el.GetId()]].IsAnOutlet())):
+            table.append((-1, el.GetId(), el.GetBeta(), 0.0))
+
+    if abs(sum(row[3] for row in table) - 1.0) > 0.000001:
+        raise RuntimeError('Unexpected error, sum(Beta) coefficients != 1.0')
+    numberOfRecomputedDivisions = len(set(elements[Id].GetInPointsx0Id()
+        for Id in recomputedIds))
+    verboseprint('> Network diff: %i divisions out of %i and %i outlets out '
+        'of %i recomputed.' % (numberOfRecomputedDivisions, len(divisions),
+        np.count_nonzero(isRecomputedOutlet), len(topology.outletsByPreorder)))
+    return table, numberOfRecomputedDivisions
+
+def WriteNetworkDiff(fileName, table):
+    '''Write the outlets changes of UpdateFlowSplitting in a csv file,
+    atomically.'''
+    temporaryFileName = '%s.%i.tmp' % (fileName, os.getpid())
+    outputFile = open(temporaryFileName, 'w')
+    try:
+        outputFile.write('element_after,element_before,percent_before,'
+            'percent_after,percent_change\n')
+        outputFile.writelines(['%i,%i,%.6f,%.6f,%.6f\n' % (row[0], row[1],
+            100.0*row[2], 100.0*row[3], 100.0*(row[3] - row[2]))
+            for row in table])
+    finally:
+        outputFile.close()
+    os.rename(temporaryFileName, fileName)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import numpy as np
+
+
+class NetworkTopology(object):
+    '''Precomputed topology of a network for path and subtree queries.
+
+    The connectivity of the network (behind segment of each element) is
+    stored as arrays: the parent of each element, the children in a
+    compressed sparse row form (the children of the element i are
+    childIds[childOffsets[i]:childOffsets[i+1]]), the depth from the inlet
+    and a depth-first preorder. The subtree of an element i is made of the
+    elements of preorder index in [preorder[i], preorder[i] + subtreeSizes[i]),
+    which answers the ancestor and subtree queries in O(1). The lowest
+    common ancestor is found in O(1) with a sparse table over the Euler tour
+    of the tree. The path to the inlet costs O(depth).
+    With compact, the index arrays are stored as 32 bits integers.
+
+    '''
+
+    def __init__(self, network, compact=False):
+        n = len(network.elements)
+        self.numberOfElements = n
+        self.parents = -np.ones(n, dtype=np.int64)
+        self.isOutlet = np.zeros(n, dtype=bool)
+        self.isBlanked = np.zeros(n, dtype=bool)
+        self.root = -1
+        for element in network.elements:
+            i = element.GetId()
+            if element.GetBehindSegment() is not None:
+                self.parents[i] = element.GetBehindSegment()
+            self.isOutlet[i] = bool(element.IsAnOutlet())
+            self.isBlanked[i] = bool(element.IsBlanked())
+            if element.IsAnInlet():
+                if self.root >= 0:
+                    raise RuntimeError('The network has several inlets.')
+                self.root = i
+        if self.root < 0:
+            raise RuntimeError('The network has no inlet, the connectivity '
+                'has to be computed first.')
+        self.parents[self.root] = -1
+
+        # Children in a compressed sparse row form.
+        hasParent = np.nonzero(self.parents >= 0)[0]
+        order = np.argsort(self.parents[hasParent], kind='mergesort')
+        self.childIds = hasParent[order]
+        counts = np.bincount(self.parents[hasParent], minlength=n)
+        self.childOffsets = np.concatenate(([0], np.cumsum(counts)))
+
+        # Iterative depth-first traversal: depths, preorder, subtree sizes
+        # and Euler tour.
+        self.depths = -np.ones(n, dtype=np.int64)
+        self.preorder = -np.ones(n, dtype=np.int64)
+        self.subtreeSizes = np.zeros(n, dtype=np.int64)
+        self.eulerFirst = -np.ones(n, dtype=np.int64)
+        euler = []
+        visitOrder = []
+        self.depths[self.root] = 0
+        stack = [(self.root, 0)]
+        while stack:
+            i, nextChild = stack.pop()
+            if nextChild == 0:
+                self.preorder[i] = len(visitOrder)
+                visitOrder.append(i)
+                self.eulerFirst[i] = len(euler)
+            euler.append(i)
+            childIndex = self.childOffsets[i] + nextChild
+            if childIndex < self.childOffsets[i + 1]:
+                child = self.childIds[childIndex]
+                if self.depths[child] >= 0:
+                    raise RuntimeError('The network connectivity has a loop '
+                        'at the element %i.' % child)
+                self.depths[child] = self.depths[i] + 1
+                stack.append((i, nextChild + 1))
+                stack.append((child, 0))
+            else:
+                self.subtreeSizes[i] = len(visitOrder) - self.preorder[i]
+        self.visitOrder = np.array(visitOrder, dtype=np.int64)
+        self.numberOfReachedElements = len(visitOrder)
+
+        # Sparse table of the shallowest element over the Euler tour windows.
+        self.euler = np.array(euler, dtype=np.int64)
+        table = [self.euler]
+        width = 1
+        while 2*width <= len(self.euler):
+            previous = table[-1]
+            left = previous[:-width]
+            right = previous[width:]
+            table.append(np.where(self.depths[left] <= self.depths[right],
+                left, right))
+            width *= 2
+        self.sparseTable = table
+        if compact and n < np.iinfo(np.int32).max:
+            for name in ('parents', 'childIds', 'childOffsets', 'depths',
+                'preorder', 'subtreeSizes', 'eulerFirst', 'visitOrder', 'euler'):
+                setattr(self, name, getattr(self, name).astype(np.int32))
+            self.sparseTable = [level.astype(np.int32) for level in table]
+
+        # Outlets sorted by preorder for the subtree outlets queries.
+        outlets = np.nonzero(self.isOutlet & (self.preorder >= 0))[0]
+        order = np.argsort(self.preorder[outlets])
+        self.outletsByPreorder = outlets[order]
+        self.outletsPreorder = self.preorder[self.outletsByPreorder]
+
+    def GetChildren(self, i):
+        return self.childIds[self.childOffsets[i]:self.childOffsets[i + 1]]
+
+    def GetParent(self, i):
+        return int(self.parents[i])
+
+    def GetDepth(self, i):
+        return int(self.depths[i])
+
+    def GetSubtreeSize(self, i):
+        '''Return the number of elements downstream of i, i included.'''
+        return int(self.subtreeSizes[i])
+
+    def GetSubtree(self, i):
+        '''Return the elements downstream of i, i included, in preorder.'''
+        return self.visitOrder[self.preorder[i]:self.preorder[i] + self.subtreeSizes[i]]
+
+    def IsAncestor(self, i, j):
+        '''Return True if i is j or an element upstream of j.'''
+        if self.preorder[i] < 0 or self.preorder[j] < 0:
+            return False
+        return (self.preorder[i] <= self.preorder[j] <
+            self.preorder[i] + self.subtreeSizes[i])
+
+    def GetPathToInlet(self, i):
+        '''Return the elements from i (included) to the inlet (included).'''
+        if self.preorder[i] < 0:
+            raise RuntimeError('The element %i is not connected to the inlet.' % i)
+        path = np.empty(self.depths[i] + 1, dtype=np.int64)
+        for k in range(0, len(path)):
+            path[k] = i
+            i = self.parents[i]
+        return path
+
+    def GetDescendantOutlets(self, i):
+        '''Return the outlets downstream of i, i included.'''
+        start = np.searchsorted(self.outletsPreorder, self.preorder[i], side='left')
+        end = np.searchsorted(self.outletsPreorder,
+            self.preorder[i] + self.subtreeSizes[i], side='left')
+        return self.outletsByPreorder[start:end]
+
+    def GetLowestCommonAncestor(self, i, j):
+        '''Return the most downstream element upstream of both i and j.'''
+        first = self.eulerFirst[i]
+        last = self.eulerFirst[j]
+        if first < 0 or last < 0:
+            raise RuntimeError('The elements are not connected to the inlet.')
+        if first > last:
+            first, last = last, first
+        level = int(last - first + 1).bit_length() - 1
+        left = self.sparseTable[level][first]
+        right = self.sparseTable[level][last - 2**level + 1]
+        if self.depths[left] <= self.depths[right]:
+            return int(left)
+        return int(right)
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import os
+
+import numpy as np
+
+# Number of time steps written at once by WriteOutletWaveforms.
+CHUNKTIMESTEPS = 1024
+
+
+def LoadWaveform(fileName):
+    '''Load an inflow waveform from a text file with two columns, time and
+    flow rate, over one cycle. Returns the times and flow rates arrays.'''
+    data = np.loadtxt(fileName, dtype=np.float64, ndmin=2)
+    if data.shape[1] < 2 or data.shape[0] < 2:
+        raise RuntimeError('The waveform file should have two columns, '
+            'time and flow rate, and at least two rows.')
+    order = np.argsort(data[:, 0], kind='mergesort')
+    return data[order, 0], data[order, 1]
+
+def ResampleWaveform(times, flow, numberOfTimeSteps):
+    '''Resample a periodic waveform on numberOfTimeSteps uniform time
+    steps of its cycle, the last one excluded: the period is the one of
+    the input times.'''
+    period = times[-1] - times[0]
+    newTimes = times[0] + period*np.arange(numberOfTimeSteps) \
+        / float(numberOfTimeSteps)
+    return newTimes, np.interp(newTimes, times, flow, period=period)
+
+def ComputeMeanFlow(times, flow, period=None):
+    '''Time average of a periodic waveform over its cycle (trapezoidal
+    rule). The cycle is closed from the last time to times[0] + period
+    with the first flow rate, which is needed for the waveforms of
+    ResampleWaveform (last time step excluded); without period, the last
+    time ends the cycle.'''
+    times = np.asarray(times, dtype=np.float64)
+    flow = np.asarray(flow, dtype=np.float64)
+    if period is None:
+        period = times[-1] - times[0]
+    times = np.append(times, times[0] + period)
+    flow = np.append(flow, flow[0])
+    return np.sum(0.5*(flow[1:] + flow[:-1])*np.diff(times)) / period
+
+def ScaleWaveformToInlet(times, flow, inletRadius, coefficient, exponent=1.0,
+    period=None):
+    '''Scale a waveform so that its mean flow rate (ComputeMeanFlow over
+    period) follows the area law Q = coefficient * A^exponent of the
+    network inlet of radius inletRadius. With exponent 1, coefficient is a
+    mean velocity.'''
+    meanFlow = ComputeMeanFlow(times, flow, period=period)
+    if meanFlow == 0.0:
+        raise RuntimeError('The waveform has a zero mean flow rate.')
+    inletArea = np.pi*inletRadius**2.0
+    return flow*(coefficient*inletArea**exponent / meanFlow)
+
+def ComputeOutletWaveforms(betas, flow):
+    '''Return the outlets flow rates, numberOfTimeSteps x numberOfOutlets:
+    Q_i(t) = beta_i Q_in(t).'''
+    return np.asarray(flow)[:, np.newaxis]*np.asarray(betas)[np.newaxis, :]
+
+def WriteOutletWaveforms(fileName, elementIds, betas, times, flow,
+    chunkTimeSteps=CHUNKTIMESTEPS):
+    '''Write the outlets flow rates, one row per time step, atomically.
+
+    The rows are computed and written by chunks of chunkTimeSteps time
+    steps, so the whole matrix is never held in memory. A '.npy' file
+    name gives a binary array (time in the first column), any other a csv
+    file with a header of the outlet element ids.
+
+    '''
+    temporaryFileName = '%s.%i.tmp' % (fileName, os.getpid())
+    nTimeSteps = len(times)
+    betas = np.asarray(betas, dtype=np.float64)
+    if fileName.endswith('.npy'):
+        output = np.lib.format.open_memmap(temporaryFileName, mode='w+',
+            dtype=np.float64, shape=(nTimeSteps, len(betas) + 1))
+        for first in range(0, nTimeSteps, chunkTimeSteps):
+            last = min(nTimeSteps, first + chunkTimeSteps)
+            output[first:last, 0] = times[first:last]
+            output[first:last, 1:] = ComputeOutletWaveforms(betas,
+                flow[first:last])
+        output.flush()
+        del output
+    else:
+        outputFile = open(temporaryFileName, 'w')
+        try:
+            outputFile.write('time,' + ','.join(['outlet_%i' % Id
+                for Id in elementIds]) + '\n')
+            for first in range(0, nTimeSteps, chunkTimeSteps):
+                last = min(nTimeSteps, first + chunkTimeSteps)
+                rows = np.hstack((times[first:last, np.newaxis],
+                    ComputeOutletWaveforms(betas, flow[first:last])))
+                np.savetxt(outputFile, rows, fmt='%.8e', delimiter=',')
+        finally:
+            outputFile.close()
+    os.rename(temporaryFileName, fileName)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import ctypes
+import multiprocessing
+
+import numpy as np
+
+# Per-segment and per-cell outputs of ComputeCellsGeometry, with their
+# double precision ctypes and number of components.
+SEGMENTOUTPUTS = (('segmentLengths', ctypes.c_double, 1),
+                  ('segmentPointIds', ctypes.c_int64, 1))
+CELLOUTPUTS = (('cellLengths', ctypes.c_double, 1),
+               ('resistanceRadii', ctypes.c_double, 1),
+               ('firstPoints', ctypes.c_double, 3),
+               ('lastPoints', ctypes.c_double, 3),
+               ('firstPointRadii', ctypes.c_double, 1),
+               ('lastPointRadii', ctypes.c_double, 1),
+               ('localRadii', ctypes.c_double, 1))
+
+# ctypes of the shared arrays of the numpy types (double precision and
+# compact mode).
+CTYPES = {np.dtype(np.float64): ctypes.c_double,
+          np.dtype(np.float32): ctypes.c_float,
+          np.dtype(np.int64): ctypes.c_int64,
+          np.dtype(np.int32): ctypes.c_int32}
+
+# Shared arrays of the worker processes, set by _InitWorker.
+_sharedArrays = {}
+
+
+def ComputeCellsGeometry(points, radii, cellOffsets, cellPointIds,
+    firstCell, lastCell, nDiameter=0.0):
+    '''Compute the geometry of the cells firstCell to lastCell (excluded).
+
+    Returns a dictionary of numpy arrays: the segments lengths and the ids
+    of the points starting them, and for each cell its length, its
+    hydraulic resistance radius (sum(dx) / sum(dx / r^4))^(1/4), the
+    coordinates and radii of its extremities and, when nDiameter is
+    positive, its local radius at nDiameter radii from the bifurcation
+    (see CenterlineMetrics.ComputeLocalRadius). Each cell should have at
+    least one point. The points and radii may be single precision arrays
+    (compact mode): the outputs are computed in double precision.
+
+    '''
+    offsets = cellOffsets[firstCell:lastCell + 1]
+    nCells = len(offsets) - 1
+    nSegments = np.diff(offsets) - 1
+    segmentOffsets = np.concatenate(([0], np.cumsum(nSegments)))
+    segmentCells = np.repeat(np.arange(nCells), nSegments)
+    segmentRanks = np.arange(segmentOffsets[-1]) - segmentOffsets[segmentCells]
+    segmentStarts = offsets[segmentCells] + segmentRanks
+    startIds = cellPointIds[segmentStarts]
+    endIds = cellPointIds[segmentStarts + 1]
+    segmentLengths = np.sqrt(((np.asarray(points[endIds], dtype=np.float64)
+        - points[startIds])**2.0).sum(axis=1))
+
+    cellLengths = np.bincount(segmentCells, weights=segmentLengths,
+        minlength=nCells)
+    resistances = np.bincount(segmentCells,
+        weights=segmentLengths / radii[startIds].astype(np.float64)**4.0,
+        minlength=nCells)
+    firstIds = cellPointIds[offsets[:-1]]
+    lastIds = cellPointIds[offsets[1:] - 1]
+    firstPointRadii = radii[firstIds].astype(np.float64)
+    lastPointRadii = radii[lastIds].astype(np.float64)
+    resistanceRadii = firstPointRadii.copy()
+    hasResistance = resistances > 0.0
+    resistanceRadii[hasResistance] = (cellLengths[hasResistance]
+        / resistances[hasResistance])**0.25
+
+    localRadii = np.zeros(nCells)
+    if nDiameter > 0.0:
+        localRadii = firstPointRadii.copy()
+        hasSegments = nSegments > 0
+        if np.any(hasSegments):
+            # Arc length before and after each segment.
+            cumulative = np.cumsum(segmentLengths)
+            cellStart = np.concatenate(([0.0], cumulative))[segmentOffsets[:-1]]
+            lengthAfter = cumulative - cellStart[segmentCells]
+            lengthBefore = lengthAfter - segmentLengths
+            isBackward = lastPointRadii > firstPointRadii
+            desiredLength = nDiameter*np.where(isBackward, lastPointRadii,
+                firstPointRadii)
+            desired = desiredLength[segmentCells]
+            # Walking from the first point: first segment reaching the length.
+            forward = np.where(lengthAfter >= desired, segmentRanks,
+                nSegments[segmentCells] - 1)
+            # Walking from the last point: the point k + 1 of the last
+            # segment k such as the remaining length reaches the length.
+            backward = np.where(cellLengths[segmentCells] - lengthBefore >= desired,
+                segmentRanks + 1, 1)
+            starts = segmentOffsets[:-1][hasSegments]
+            index = np.where(isBackward[hasSegments],
+                np.maximum.reduceat(backward, starts),
+                np.minimum.reduceat(forward, starts))
+            localRadii[hasSegments] = radii[
+                cellPointIds[offsets[:-1][hasSegments] + index]]
+
+    return {'segmentLengths': segmentLengths,
+            'segmentPointIds': startIds,
+            'cellLengths': cellLengths,
+            'resistanceRadii': resistanceRadii,
+            'firstPoints': points[firstIds].astype(np.float64),
+            'lastPoints': points[lastIds].astype(np.float64),
+            'firstPointRadii': firstPointRadii,
+            'lastPointRadii': lastPointRadii,
+            'localRadii': localRadii}
+
+def _SharedArray(ctype, shape):
+    '''Return a shared memory array and its numpy view.'''
+    size = int(np.prod(shape))
+    shared = multiprocessing.RawArray(ctype, max(1, size))
+    return shared, _NumpyView(shared, ctype, shape)
+
+def _NumpyView(shared, ctype, shape):
+    return np.frombuffer(shared, dtype=np.dtype(ctype))[
+        :int(np.prod(shape))].reshape(shape)
+
+def _InitWorker(sharedArrays):
+    '''Map the shared arrays in the worker process.'''
+    for name, (shared, ctype, shape) in sharedArrays.items():
+        _sharedArrays[name] = _NumpyView(shared, ctype, shape)
+
+def _ComputeTask(task):
+    '''Compute the geometry of a range of cells and write it in place.'''
+    firstCell, lastCell, nDiameter = task
+    arrays = _sharedArrays
+    cellOffsets = arrays['cellOffsets']
+    results = ComputeCellsGeometry(arrays['points'], arrays['radii'],
+        cellOffsets, arrays['cellPointIds'], firstCell, lastCell, nDiameter)
+    # A cell with n points has n - 1 segments.
+    firstSegment = cellOffsets[firstCell] - firstCell
+    lastSegment = cellOffsets[lastCell] - lastCell
+    for name, ctype, nComponents in SEGMENTOUTPUTS:
+        arrays[name][firstSegment:lastSegment] = results[name]
+    for name, ctype, nComponents in CELLOUTPUTS:
+        arrays[name][firstCell:lastCell] = results[name]
+    return lastCell - firstCell
+
+def ComputeCellsGeometryParallel(points, radii, cellOffsets, cellPointIds,
+    numberOfWorkers, nDiameter=0.0, tasksPerWorker=4):
+    '''Compute ComputeCellsGeometry for all the cells with a worker pool.
+
+    The centerline arrays are copied once in shared memory and mapped by
+    the workers when the pool starts, so the tasks only carry a range of
+    cells. The workers write their results in place in shared output
+    arrays, which are returned as numpy views. The shared arrays keep the
+    types of the inputs: with the single precision points and 32 bits ids
+    of the compact mode, the inputs and the per-segment outputs are shared
+    with these types.
+
+    '''
+    nCells = len(cellOffsets) - 1
+    nSegments = int(cellOffsets[-1]) - nCells
+    sharedArrays = {}
+    views = {}
+    for name, values in (('points', points), ('radii', radii),
+        ('cellOffsets', cellOffsets), ('cellPointIds', cellPointIds)):
+        ctype = CTYPES[values.dtype]
+        shared, view = _SharedArray(ctype, values.shape)
+        view[...] = values
+        sharedArrays[name] = (shared, ctype, values.shape)
+    outputTypes = {'segmentLengths': CTYPES[points.dtype],
+                   'segmentPointIds': CTYPES[cellPointIds.dtype]}
+    for outputs, n in ((SEGMENTOUTPUTS, nSegments), (CELLOUTPUTS, nCells)):
+        for name, ctype, nComponents in outputs:
+            ctype = outputTypes.get(name, ctype)
+            shape = (n, nComponents) if nComponents > 1 else (n,)
+            shared, views[name] = _SharedArray(ctype, shape)
+            sharedArrays[name] = (shared, ctype, shape)
+
+    # Tasks of balanced number of points.
+    nTasks = max(1, min(nCells, numberOfWorkers*tasksPerWorker))
+    bounds = np.searchsorted(cellOffsets[:-1],
+        np.linspace(0, cellOffsets[-1], nTasks + 1)[1:-1])
+    bounds = np.unique(np.concatenate(([0], bounds, [nCells])))
+    tasks = [(int(bounds[i]), int(bounds[i + 1]), nDiameter)
+        for i in range(0, len(bounds) - 1) if bounds[i + 1] > bounds[i]]
+    pool = multiprocessing.Pool(numberOfWorkers, initializer=_InitWorker,
+        initargs=(sharedArrays,))
+    try:
+        pool.map(_ComputeTask, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    return views
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import collections
+import copy
+import hashlib
+import json
+import os
+import time
+
+from . import ImportData
+from .CenterlineResampling import ResampleCenterline
+from .NetworkBoundaryConditions import FlowSplitting
+from .ResultStore import GetNetworkTables
+
+# Default value of the parameters of the stages.
+DEFAULTPARAMETERS = {'fileName': '',
+                     'resampleSpacing': 0.0,
+                     'resampleRelative': False,
+                     'localRadii': 0.0}
+
+
+def _CopyNetwork(network):
+    '''Return a copy of a network to be modified by a stage, sharing its
+    centerline metrics and topology, which are not modified.'''
+    memo = {}
+    for shared in (network.GetCenterlineMetrics(), network.GetTopology()):
+        if shared is not None:
+            memo[id(shared)] = shared
+    return copy.deepcopy(network, memo)
+
+def _Load(pipeline, fileName):
+    return ImportData.loadFile(fileName)
+
+def _Resample(pipeline, centerline, resampleSpacing, resampleRelative):
+    if resampleSpacing <= 0.0:
+        return centerline
+    resampled, report = ResampleCenterline(centerline, resampleSpacing,
+        pipeline.verboseprint, relativeToRadius=resampleRelative)
+    return resampled
+
+def _Split(pipeline, centerline):
+    if ImportData.IsArrayDefined(centerline, ImportData.GROUPIDSARRAYNAME):
+        return centerline
+    return ImportData.SplitCenterline(centerline, pipeline.verboseprint)
+
+def _Metrics(pipeline, centerline):
+    # The local radii are computed by their own stage.
+    return ImportData.CenterlineMetrics(centerline,
+        numberOfWorkers=pipeline.numberOfWorkers)
+
+def _Network(pipeline, centerline, metrics):
+    network = ImportData.Network()
+    ImportData.BuildNetworkElements(centerline, network,
+        pipeline.verboseprint, metrics)
+    network.SetCenterlineMetrics(metrics)
+    return network
+
+def _Connectivity(pipeline, network, centerline, metrics):
+    network = _CopyNetwork(network)
+    ImportData.SetNetworkConnectivity(network, metrics, pipeline.verboseprint)
+    ImportData.SetRadiusX0(centerline, network, pipeline.verboseprint,
+        metrics=metrics)
+    network.SetNetworkInletRadius(ImportData.ComputeInletAverageRadius(
+        centerline, 0.0, pipeline.verboseprint, metrics=metrics))
+    return network
+
+def _LocalRadii(pipeline, network, centerline, metrics, localRadii):
+    if localRadii <= 0.0:
+        return network
+    network = _CopyNetwork(network)
+    ImportData.SetLocalBifurcationRadius(centerline, network, localRadii,
+        pipeline.verboseprint, metrics=metrics)
+    return network
+
+def _Alphas(pipeline, network, localRadii):
+    network = _CopyNetwork(network)
+    FlowSplitting().ComputeAlphas(network, pipeline.verboseprint,
+        PowerLawUsesLocalRadii=localRadii > 0.0)
+    return network
+
+def _Betas(pipeline, network):
+    network = _CopyNetwork(network)
+    flowSplitting = FlowSplitting()
+    flowSplitting.hasComputedAlphas = True
+    flowSplitting.ComputeBetas(network, pipeline.verboseprint)
+    flowSplitting.CheckTotalFlowRate(network, pipeline.verboseprint)
+    return network
+
+def _Output(pipeline, network):
+    return GetNetworkTables(network)
+
+# Stages of the outlets flow splitting: name, upstream stages, parameters
+# and function (called with the pipeline, the upstream outputs and the
+# parameters).
+STAGES = collections.OrderedDict((
+    ('load', ((), ('fileName',), _Load)),
+    ('resample', (('load',), ('resampleSpacing', 'resampleRelative'),
+        _Resample)),
+    ('split', (('resample',), (), _Split)),
+    ('metrics', (('split',), (), _Metrics)),
+    ('network', (('split', 'metrics'), (), _Network)),
+    ('connectivity', (('network', 'split', 'metrics'), (), _Connectivity)),
+    ('localRadii', (('connectivity', 'split', 'metrics'), ('localRadii',),
+        _LocalRadii)),
+    ('alphas', (('localRadii',), ('localRadii',), _Alphas)),
+    ('betas', (('alphas',), (), _Betas)),
+    ('output', (('betas',), (), _Output))))
+
+
+class Pipeline(object):
+    '''In-process memoized pipeline of the outlets flow splitting.
+
+    The computation is a DAG of stages (see STAGES). The output of each
+    stage is memoized under a key hashing the stage name, its parameters
+    and the keys of its upstream stages; the key of the load stage also
+    holds the modification time and size of the file. Evaluating a stage
+    only computes the stages whose key changed, so changing localRadii
+    in a scripted session recomputes the local radii, alphas and betas
+    but not the loading, split, metrics or connectivity. The stages never
+    modify their inputs: the network is copied by the stages changing it.
+    At most maxEntries outputs are kept per stage (least recently used).
+
+    '''
+
+    def __init__(self, verboseprint, numberOfWorkers=1, maxEntries=4):
+        self.verboseprint = verboseprint
+        self.numberOfWorkers = numberOfWorkers
+        self.maxEntries = max(1, maxEntries)
+        self.cache = dict((name, collections.OrderedDict()) for name in STAGES)
+        self.statistics = dict((name, [0, 0, 0.0]) for name in STAGES)
+
+    def Clear(self):
+        for name in STAGES:
+            self.cache[name].clear()
+
+    def Run(self, stage, parameters):
+        '''Return the output of a stage for the parameters (see
+        DEFAULTPARAMETERS), computing only the outdated stages.'''
+        if stage not in STAGES:
+            raise RuntimeError('Unknown stage %s.' % stage)
+        key, output = self._Evaluate(stage, parameters, {})
+        return output
+
+    def GetKey(self, stage, parameters):
+        '''Return the memoization key of a stage, without computing it.'''
+        upstream, parameterNames, function = STAGES[stage]
+        return self._ComputeKey(stage, parameters,
+            [self.GetKey(name, parameters) for name in upstream])
+
+    def _ComputeKey(self, stage, parameters, upstreamKeys):
+        upstream, parameterNames, function = STAGES[stage]
+        values = [[name, parameters.get(name, DEFAULTPARAMETERS[name])]
+            for name in parameterNames]
+        if stage == 'load':
+            status = os.stat(values[0][1])
+            values.append(['file', status.st_mtime, status.st_size])
+        description = json.dumps([stage, values, upstreamKeys], sort_keys=True)
+        return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+    def _Evaluate(self, stage, parameters, evaluated):
+        if stage in evaluated:
+            return evaluated[stage]
+        upstream, parameterNames, function = STAGES[stage]
+        inputs = [self._Evaluate(name, parameters, evaluated)
+            for name in upstream]
+        key = self._ComputeKey(stage, parameters, [k for k, o in inputs])
+        cache = self.cache[stage]
+        statistics = self.statistics[stage]
+        if key in cache:
+            output = cache.pop(key)
+            statistics[0] += 1
+            self.verboseprint('> Stage %s: memoized.' % stage)
+        else:
+            start = time.time()
+            output = function(self, *[o for k, o in inputs],
+                **dict((name, parameters.get(name, DEFAULTPARAMETERS[name]))
+                    for name in parameterNames))
+            elapsed = time.time() - start
+            statistics[1] += 1
+            statistics[2] += elapsed
+            self.verboseprint('> Stage %s: computed in %.3f s.'
+                % (stage, elapsed))
+            while len(cache) >= self.maxEntries:
+                cache.popitem(last=False)
+        cache[key] = output
+        evaluated[stage] = (key, output)
+        return key, output
+
+    def PrintStatistics(self):
+        print('{:^14}  {:^8}  {:^8}  {:^10}'.format('Stage', 'Memoized',
+            'Computed', 'Time (s)'))
+        for name in STAGES:
+            hits, computed, elapsed = self.statistics[name]
+            print('{:^14}  {:^8d}  {:^8d}  {:^10.3f}'.format(name, hits,
+                computed, elapsed))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    case_name TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    input_hash TEXT NOT NULL,
+    parameters TEXT NOT NULL,
+    local_radii REAL NOT NULL,
+    code_version TEXT NOT NULL,
+    created REAL NOT NULL,
+    UNIQUE (input_hash, parameters, code_version));
+CREATE INDEX IF NOT EXISTS runs_case ON runs (case_name);
+CREATE INDEX IF NOT EXISTS runs_parameters ON runs (parameters, local_radii);
+CREATE TABLE IF NOT EXISTS outlets (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    element INTEGER NOT NULL,
+    x REAL, y REAL, z REAL,
+    beta REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS outlets_run ON outlets (run_id);
+CREATE TABLE IF NOT EXISTS elements (
+    run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    element INTEGER NOT NULL,
+    cell_id INTEGER,
+    blanking INTEGER,
+    outlet INTEGER,
+    length REAL,
+    mean_radius REAL,
+    local_radius REAL,
+    alpha REAL,
+    beta REAL);
+CREATE INDEX IF NOT EXISTS elements_run ON elements (run_id);
+'''
+
+
+def ComputeFileHash(fileName):
+    '''Return the sha1 of the content of a file.'''
+    sha = hashlib.sha1()
+    inputFile = open(fileName, 'rb')
+    try:
+        for block in iter(lambda: inputFile.read(1 << 20), b''):
+            sha.update(block)
+    finally:
+        inputFile.close()
+    return sha.hexdigest()
+
+def ComputeCodeVersion():
+    '''Return the sha1 of the sources of the package (the .py files of
+    src), so that any change of the computations changes the version.'''
+    sha = hashlib.sha1()
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for fileName in sorted(f for f in os.listdir(directory)
+        if f.endswith('.py')):
+        sha.update(fileName.encode('utf-8'))
+        sha.update(b'\0')
+        inputFile = open(os.path.join(directory, fileName), 'rb')
+        try:
+            sha.update(inputFile.read())
+        finally:
+            inputFile.close()
+    return sha.hexdigest()
+
+# Version of the computations, recorded with each stored run. Runs of
+# another version are not served from the store.
+CODEVERSION = ComputeCodeVersion()
+
+def GetNetworkTables(network):
+    '''Return the outlets and elements tables of a network whose betas are
+    computed, in the format stored by ResultStore.'''
+    outlets = []
+    elements = []
+    for element in network.elements:
+        if element.IsAnOutlet():
+            x = element.GetOutPointsx1()[0]
+            outlets.append((element.GetId(), x[0], x[1], x[2], element.GetBeta()))
+        elements.append((element.GetId(), element.GetVtkCellIdList()[0],
+            int(element.IsBlanked()), int(element.IsAnOutlet()),
+            element.GetLength(), element.GetMeanRadius(),
+            element.GetLocalRadius(), element.GetAlpha(), element.GetBeta()))
+
+    return {'outlets': outlets, 'elements': elements}
+
+
+class ResultStore(object):
+    '''Local SQLite store of the computed cases.
+
+    Each run is recorded with its case name, the hash of the input file,
+    its parameters (canonical json, localRadii also as a column) and the
+    code version, together with its outlets and elements tables. A run
+    with the same input hash, parameters and version is served from the
+    store, and cohort statistics are queried without the VTK files.
+
+    '''
+
+    def __init__(self, fileName):
+        self.connection = sqlite3.connect(fileName, timeout=60.0)
+        self.connection.execute('PRAGMA foreign_keys = ON')
+        self.connection.executescript(SCHEMA)
+        self.connection.commit()
+
+    def Close(self):
+        self.connection.close()
+
+    @staticmethod
+    def _Parameters(parameters):
+        return json.dumps(parameters, sort_keys=True)
+
+    def _GetRunId(self, inputHash, parameters):
+        row = self.connection.execute('SELECT id FROM runs WHERE input_hash = ? '
+            'AND parameters = ? AND code_version = ?',
+            (inputHash, self._Parameters(parameters), CODEVERSION)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def HasRun(self, inputHash, parameters):
+        return self._GetRunId(inputHash, parameters) is not None
+
+    def GetRun(self, inputHash, parameters):
+        '''Return the stored tables of a run, or None.'''
+        runId = self._GetRunId(inputHash, parameters)
+        if runId is None:
+            return None
+        outlets = self.connection.execute('SELECT element, x, y, z, beta '
+            'FROM outlets WHERE run_id = ? ORDER BY element', (runId,)).fetchall()
+        elements = self.connection.execute('SELECT element, cell_id, blanking, '
+            'outlet, length, mean_radius, local_radius, alpha, beta '
+            'FROM elements WHERE run_id = ? ORDER BY element', (runId,)).fetchall()
+        return {'outlets': [tuple(row) for row in outlets],
+                'elements': [tuple(row) for row in elements]}
+
+    def AddRun(self, caseName, fileName, inputHash, parameters, result):
+        '''Store the tables of a run, replacing a previous identical run.'''
+        with self.connection:
+            runId = self._GetRunId(inputHash, parameters)
+            if runId is not None:
+                self.connection.execute('DELETE FROM runs WHERE id = ?', (runId,))
+            cursor = self.connection.execute('INSERT INTO runs (case_name, '
+                'file_name, input_hash, parameters, local_radii, code_version, '
+                'created) VALUES (?, ?, ?, ?, ?, ?, ?)', (caseName, fileName,
+                inputHash, self._Parameters(parameters),
+                float(parameters.get('localRadii', 0.0)), CODEVERSION,
+                time.time()))
+            runId = cursor.lastrowid
+            self.connection.executemany('INSERT INTO outlets VALUES '
+                '(?, ?, ?, ?, ?, ?)', [(runId,) + tuple(row)
+                for row in result['outlets']])
+            self.connection.executemany('INSERT INTO elements VALUES '
+                '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [(runId,) + tuple(row)
+                for row in result['elements']])
+        return runId
+
+    def GetCohortStatistics(self, parameters):
+        '''Return, for each stored case computed with the parameters, the
+        number of outlets and the min, mean and max outlet beta.'''
+        return self.connection.execute('SELECT runs.case_name, COUNT(*), '
+            'MIN(outlets.beta), AVG(outlets.beta), MAX(outlets.beta) '
+            'FROM runs JOIN outlets ON outlets.run_id = runs.id '
+            'WHERE runs.parameters = ? AND runs.code_version = ? '
+            'GROUP BY runs.id ORDER BY runs.case_name',
+            (self._Parameters(parameters), CODEVERSION)).fetchall()
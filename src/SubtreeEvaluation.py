@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import numpy as np
+import vtk
+
+from . import ImportData
+
+
+def FindRootElement(network, metrics, cellId=None, point=None):
+    '''Return the id of the element holding the VTK cell cellId or, if
+    cellId is None, of the element nearest to point. For a point shared by
+    several elements (at a division), the elements starting at the point
+    are downstream of it and the other one is chosen (the parent of the
+    division); the lowest id is chosen among equal candidates.'''
+    cellToElement = {}
+    for el in network.elements:
+        for k in el.GetVtkCellIdList():
+            cellToElement.setdefault(k, el.GetId())
+    if cellId is not None:
+        if not(cellId in cellToElement):
+            raise RuntimeError('The VTK cell %i is not part of the network.'
+                % cellId)
+        return cellToElement[cellId]
+    if point is None:
+        raise RuntimeError('A root cell id or point is needed.')
+    distances = ((metrics.points - np.asarray(point, dtype=np.float64))**2.0) \
+        .sum(axis=1)
+    slots = np.nonzero(metrics.cellPointIds == np.argmin(distances))[0]
+    cellIds = np.searchsorted(metrics.cellOffsets, slots, side='right') - 1
+    isStart = slots == metrics.cellOffsets[cellIds]
+    candidates = sorted(set(cellToElement[k] for k in cellIds
+        if k in cellToElement))
+    if len(candidates) == 0:
+        raise RuntimeError('No element found near the point %s.' % repr(point))
+    upstream = sorted(set(cellToElement[k] for k, start in zip(cellIds, isStart)
+        if k in cellToElement and not(start)))
+    if len(upstream) > 0:
+        return upstream[0]
+    return candidates[0]
+
+
+class SubtreeFlowSplitting(object):
+    '''Connectivity and flow splitting restricted to the subtree of a root
+    element.
+
+    Instead of comparing the extremities of all the elements pairs
+    (ComputeConnectivity), the start points x0 and end points x1 of the
+    elements are put in two point locators and only the needed elements
+    are connected: the subtree of the root, found downstream from the
+    root, the path from the root to the inlet, found upstream, and at each
+    division of the path the sibling segments and the segments in front of
+    them, whose areas enter the alphas. The same tolerance and points ids
+    as ComputeConnectivity are used. The cost of the connectivity, of the
+    local radii and of the flow splitting is proportional to the size of
+    the subtree and the depth of the root; the locators are built once
+    over the extremities of all the elements.
+
+    '''
+
+    def __init__(self, network, metrics, rootId, verboseprint):
+        self.network = network
+        self.metrics = metrics
+        self.rootId = rootId
+        minLength, maxLength = metrics.GetGeometricTolerance()
+        # Squared distance tolerance of ComputeConnectivity.
+        self.tolerance = minLength
+        self.radius = np.sqrt(25.0*minLength)
+        self.x0Locator, self.x0Owners = self._BuildLocator(
+            [el.GetInPointsx0() for el in network.elements])
+        self.x1Locator, self.x1Owners = self._BuildLocator(
+            [el.GetOutPointsx1() for el in network.elements])
+        self.isConnected = np.zeros(len(network.elements), dtype=bool)
+
+        inlet = network.elements[0]
+        inlet.SetIfInlet(True)
+        inlet.SetInOutPointsIds(1, 2)
+        # Path from the root to the inlet.
+        self.pathIds = [rootId]
+        while self.pathIds[-1] != 0:
+            parents = self._Find(self.x1Locator, self.x1Owners,
+                network.elements[self.pathIds[-1]].GetInPointsx0(),
+                self.pathIds[-1])
+            if len(parents) == 0 or parents[0] in self.pathIds:
+                raise RuntimeError('The element %i is not connected to the '
+                    'inlet.' % self.pathIds[-1])
+            self.pathIds.append(parents[0])
+        # Divisions of the path: siblings and their front segments.
+        evaluated = set(self.pathIds)
+        for parentId in self.pathIds[:0:-1]:
+            for childId in self._Connect(parentId):
+                evaluated.add(childId)
+                if network.elements[childId].IsBlanked():
+                    evaluated.update(self._Connect(childId, markOutlets=False))
+        # Subtree of the root.
+        self.subtreeIds = []
+        stack = [rootId]
+        while stack:
+            Id = stack.pop()
+            self.subtreeIds.append(Id)
+            stack.extend(self._Connect(Id))
+        evaluated.update(self.subtreeIds)
+        self.evaluatedIds = sorted(evaluated)
+        self.outletIds = [Id for Id in self.subtreeIds
+            if network.elements[Id].IsAnOutlet()]
+        verboseprint('> Subtree of the element %i: %i elements, %i outlets, '
+            '%i elements evaluated out of %i.' % (rootId, len(self.subtreeIds),
+            len(self.outletIds), len(self.evaluatedIds), len(network.elements)))
+
+    def _BuildLocator(self, pointsLists):
+        points = vtk.vtkPoints()
+        owners = []
+        for Id, pointsList in enumerate(pointsLists):
+            for x in pointsList:
+                points.InsertNextPoint(x)
+                owners.append(Id)
+        polyData = vtk.vtkPolyData()
+        polyData.SetPoints(points)
+        locator = vtk.vtkPointLocator()
+        locator.SetDataSet(polyData)
+        locator.BuildLocator()
+        return locator, np.array(owners, dtype=np.int64)
+
+    def _Find(self, locator, owners, points, excludedId):
+        '''Return the elements with a point matching one of points.'''
+        found = []
+        idList = vtk.vtkIdList()
+        dataSet = locator.GetDataSet()
+        for x in points:
+            locator.FindPointsWithinRadius(self.radius, x, idList)
+            for k in range(0, idList.GetNumberOfIds()):
+                pointId = idList.GetId(k)
+                Id = int(owners[pointId])
+                if Id == excludedId or Id in found:
+                    continue
+                if vtk.vtkMath.Distance2BetweenPoints(
+                    dataSet.GetPoint(pointId), x) < 25.0*self.tolerance:
+                    found.append(Id)
+        return sorted(found)
+
+    def _Connect(self, Id, markOutlets=True):
+        '''Connect an element to the elements in front of it, as
+        ComputeConnectivity does, and return them.'''
+        el = self.network.elements[Id]
+        if self.isConnected[Id]:
+            children = list(el.GetFrontSegments())
+        else:
+            children = self._Find(self.x0Locator, self.x0Owners,
+                el.GetOutPointsx1(), Id)
+        for childId in children:
+            child = self.network.elements[childId]
+            child.SetInOutPointsIds(el.GetOutPointsx1Id(), childId + 2)
+            child.SetBehindSegment(Id)
+            el.AddFrontSegment(childId)
+        if len(children) == 0 and markOutlets:
+            el.SetIfOutlet(True)
+            el.SetInOutPointsIds(el.GetInPointsx0Id(), Id + 2)
+        self.isConnected[Id] = True
+        return children
+
+    def SetLocalRadii(self, nDiameter):
+        '''Compute the local radii of the evaluated elements only.'''
+        cellIds = [self.network.elements[Id].GetVtkCellIdList()[0]
+            for Id in self.evaluatedIds]
+        radii = self.metrics.ComputeLocalRadii(cellIds, nDiameter)
+        for Id, r in zip(self.evaluatedIds, radii):
+            self.network.elements[Id].SetLocalRadius(float(r))
+
+    def ComputeFlowSplitting(self, verboseprint, PowerLawUsesLocalRadii=False):
+        '''Compute the alphas of the evaluated divisions and the betas of
+        the subtree outlets. Returns the fraction of the inflow reaching
+        the root and the fraction of the root flow of each subtree outlet
+        (summing to 1).'''
+        elements = self.network.elements
+        divisions = {}
+        for Id in self.evaluatedIds:
+            el = elements[Id]
+            if el.IsBlanked() and el.GetBehindSegment() is not None:
+                divisions.setdefault(el.GetInPointsx0Id(), []).append(Id)
+        for members in divisions.values():
+            if len(members) < 2:
+                raise RuntimeError('Unexpected error, '
+                    'adjacent branch not found. Check the connectivity and/or'
+                    'the tolerance for the connectivity computation. ')
+            areas = []
+            for Id in members:
+                front = elements[elements[Id].GetFrontSegment()]
+                if PowerLawUsesLocalRadii:
+                    areas.append(front.GetLocalArea())
+                else:
+                    areas.append(front.GetMeanArea())
+            for Id, S in zip(members, areas):
+                elements[Id].SetAlpha(S / sum(areas))
+
+        def Product(Id, lastId):
+            product = 1.0
+            while Id != lastId:
+                if elements[Id].IsBlanked():
+                    product *= elements[Id].GetAlpha()
+                Id = elements[Id].GetBehindSegment()
+            return product
+
+        rootInflow = Product(self.rootId, 0)
+        fractions = []
+        for Id in self.outletIds:
+            # Alphas between the outlet (excluded) and the root (included
+            # in rootInflow).
+            fraction = Product(elements[Id].GetBehindSegment(), self.rootId) \
+                if Id != self.rootId else 1.0
+            fractions.append(fraction)
+            elements[Id].SetBeta(rootInflow*fraction)
+        if abs(sum(fractions) - 1.0) > 0.000001:
+            raise RuntimeError('Unexpected error, the subtree outflows do not '
+                'sum to the root flow.')
+        verboseprint('> Subtree of the element %i: %.4f of the inflow.'
+            % (self.rootId, rootInflow))
+        return rootInflow, fractions
+
+
+def SetSubtreeNetworkStructure(centerline, network, verboseprint,
+    rootCellId=None, rootPoint=None, localRadii=0.0, numberOfWorkers=1,
+    compact=False):
+    '''Fill a network as SetNetworkStructure, with the connectivity, the
+    local radii and the flow splitting restricted to the subtree of a
+    root element given by a VTK cell id or a point. The centerline
+    metrics and the elements (lengths, mean radii, x0 radii) are still
+    computed for the whole centerline, in passes linear in its size (the
+    redundant blanked segments are found with a grid of their x0 points):
+    only the pairwise connectivity, the local radii and the flow splitting
+    are restricted. Returns the centerline (split if needed) and the
+    SubtreeFlowSplitting.'''
+    if not(ImportData.IsArrayDefined(centerline, ImportData.GROUPIDSARRAYNAME)):
+        centerline = ImportData.SplitCenterline(centerline, verboseprint)
+    metrics = ImportData.CenterlineMetrics(centerline,
+        numberOfWorkers=numberOfWorkers, compact=compact)
+    ImportData.BuildNetworkElements(centerline, network, verboseprint, metrics)
+    ImportData.SetRadiusX0(centerline, network, verboseprint, metrics=metrics)
+    network.SetNetworkInletRadius(ImportData.ComputeInletAverageRadius(
+        centerline, 0.0, verboseprint, metrics=metrics))
+    network.SetCenterlineMetrics(metrics)
+    rootId = FindRootElement(network, metrics, cellId=rootCellId,
+        point=rootPoint)
+    subtree = SubtreeFlowSplitting(network, metrics, rootId, verboseprint)
+    if localRadii > 0.0:
+        subtree.SetLocalRadii(localRadii)
+
+    return centerline, subtree
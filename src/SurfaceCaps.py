@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import os
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy
+
+# Number of nearest caps considered for each outlet by MatchOutletsToCaps.
+NUMBEROFCANDIDATECAPS = 4
+
+
+def _GetLinesArrays(polyData):
+    '''Return the lines connectivity of a vtkPolyData in the compressed form
+    of ImportData.GetCenterlineArrays (offsets and point ids).'''
+    lines = polyData.GetLines()
+    if hasattr(lines, 'GetOffsetsArray'):
+        offsets = vtk_to_numpy(lines.GetOffsetsArray()).astype(np.int64)
+        pointIds = vtk_to_numpy(lines.GetConnectivityArray()).astype(np.int64)
+        return offsets, pointIds
+    # Legacy layout: n, id_1, ..., id_n, n, ...
+    legacy = vtk_to_numpy(lines.GetData()).astype(np.int64)
+    nLines = lines.GetNumberOfCells()
+    offsets = np.zeros(nLines + 1, dtype=np.int64)
+    headers = np.zeros(nLines, dtype=np.int64)
+    position = 0
+    for i in range(0, nLines):
+        headers[i] = position
+        offsets[i + 1] = offsets[i] + legacy[position]
+        position += legacy[position] + 1
+    isHeader = np.zeros(len(legacy), dtype=bool)
+    isHeader[headers] = True
+    return offsets, legacy[~isHeader]
+
+def ExtractSurfaceCaps(surface):
+    '''Return the open boundary loops (caps) of a surface model.
+
+    The boundary edges are extracted and joined in loops, each loop in one
+    closed polyline (an open polyline raises an error), then the geometry
+    of all the loops is computed in one numpy pass from a fan triangulation
+    around the mean point of each loop. Returns a dictionary of arrays, one
+    row per cap: centroid, unit normal, area, equivalent radius
+    sqrt(area / pi) and number of points.
+
+    '''
+    boundaries = vtk.vtkFeatureEdges()
+    if vtk.VTK_MAJOR_VERSION <= 5:
+        boundaries.SetInput(surface)
+    else:
+        boundaries.SetInputData(surface)
+    boundaries.BoundaryEdgesOn()
+    boundaries.FeatureEdgesOff()
+    boundaries.NonManifoldEdgesOff()
+    boundaries.ManifoldEdgesOff()
+    boundaries.Update()
+    # Each loop in one polyline: no length limit, contiguous lines joined.
+    stripper = vtk.vtkStripper()
+    stripper.SetInputConnection(boundaries.GetOutputPort())
+    stripper.SetMaximumLength(boundaries.GetOutput().GetNumberOfPoints() + 1)
+    stripper.JoinContiguousSegmentsOn()
+    stripper.Update()
+    loops = stripper.GetOutput()
+    if loops.GetNumberOfLines() == 0:
+        raise RuntimeError('The surface model has no open boundary.')
+
+    points = vtk_to_numpy(loops.GetPoints().GetData()).astype(np.float64)
+    offsets, pointIds = _GetLinesArrays(loops)
+    # The closed loops repeat their first point at the end.
+    isClosing = np.zeros(len(pointIds), dtype=bool)
+    lastSlots = offsets[1:] - 1
+    isClosed = (np.diff(offsets) > 1) & \
+        (pointIds[lastSlots] == pointIds[offsets[:-1]])
+    if not(isClosed.all()):
+        raise RuntimeError('%i boundaries of the surface model are not closed '
+            'loops.' % np.count_nonzero(~isClosed))
+    isClosing[lastSlots[isClosed]] = True
+    nPoints = np.diff(offsets) - isClosed
+    pointIds = pointIds[~isClosing]
+    offsets = np.concatenate(([0], np.cumsum(nPoints)))
+    nCaps = len(nPoints)
+
+    # Fan triangles (center, p_k, p_k+1) of each loop.
+    loopIds = np.repeat(np.arange(nCaps), nPoints)
+    nextSlots = np.arange(len(pointIds)) + 1
+    nextSlots[offsets[1:] - 1] = offsets[:-1]
+    p0 = points[pointIds]
+    p1 = points[pointIds[nextSlots]]
+    centers = np.zeros((nCaps, 3))
+    for k in range(0, 3):
+        centers[:, k] = np.bincount(loopIds, weights=p0[:, k],
+            minlength=nCaps) / nPoints
+    c = centers[loopIds]
+    crossProducts = 0.5*np.cross(p0 - c, p1 - c)
+    vectorAreas = np.zeros((nCaps, 3))
+    for k in range(0, 3):
+        vectorAreas[:, k] = np.bincount(loopIds, weights=crossProducts[:, k],
+            minlength=nCaps)
+    areas = np.sqrt((vectorAreas**2.0).sum(axis=1))
+    normals = vectorAreas / np.maximum(areas, 1e-300)[:, np.newaxis]
+
+    # Area weighted centroid of the triangles, projected on the normal.
+    triangleAreas = (crossProducts*normals[loopIds]).sum(axis=1)
+    triangleCentroids = (c + p0 + p1) / 3.0
+    centroids = centers.copy()
+    hasArea = areas > 0.0
+    for k in range(0, 3):
+        moments = np.bincount(loopIds,
+            weights=triangleAreas*triangleCentroids[:, k], minlength=nCaps)
+        centroids[hasArea, k] = moments[hasArea] / areas[hasArea]
+
+    return {'centroids': centroids,
+            'normals': normals,
+            'areas': areas,
+            'radii': np.sqrt(areas / np.pi),
+            'numberOfPoints': nPoints}
+
+def MatchOutletsToCaps(caps, outletPoints, inletPoint=None,
+    neighbours=NUMBEROFCANDIDATECAPS):
+    '''Match the outlet points of the centerline to the surface caps.
+
+    The caps centroids are put in a k-d tree and the nearest caps of each
+    outlet are queried. The candidate pairs are then assigned by
+    increasing distance, one cap per outlet. Returns the cap index of each
+    outlet (-1 if none is left), the distances, and the index of the inlet
+    cap (the free cap nearest to inletPoint, -1 without inletPoint).
+
+    '''
+    outletPoints = np.asarray(outletPoints, dtype=np.float64).reshape(-1, 3)
+    nCaps = len(caps['areas'])
+    nOutlets = len(outletPoints)
+    centroids = vtk.vtkPoints()
+    for x in caps['centroids']:
+        centroids.InsertNextPoint(x)
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(centroids)
+    locator = vtk.vtkKdTreePointLocator()
+    locator.SetDataSet(polyData)
+    locator.BuildLocator()
+
+    k = min(neighbours, nCaps)
+    candidates = np.zeros((nOutlets, k), dtype=np.int64)
+    idList = vtk.vtkIdList()
+    for i in range(0, nOutlets):
+        locator.FindClosestNPoints(k, outletPoints[i], idList)
+        for j in range(0, k):
+            candidates[i, j] = idList.GetId(j)
+    outlets = np.repeat(np.arange(nOutlets), k)
+    candidates = candidates.ravel()
+    distances = np.sqrt(((caps['centroids'][candidates]
+        - outletPoints[outlets])**2.0).sum(axis=1))
+
+    capIds = -np.ones(nOutlets, dtype=np.int64)
+    capDistances = np.zeros(nOutlets)
+    isFree = np.ones(nCaps, dtype=bool)
+    for slot in np.argsort(distances, kind='mergesort'):
+        i = outlets[slot]
+        cap = candidates[slot]
+        if capIds[i] < 0 and isFree[cap]:
+            capIds[i] = cap
+            capDistances[i] = distances[slot]
+            isFree[cap] = False
+
+    inletCapId = -1
+    if inletPoint is not None and np.any(isFree):
+        freeCaps = np.nonzero(isFree)[0]
+        inletDistances = ((caps['centroids'][freeCaps]
+            - np.asarray(inletPoint))**2.0).sum(axis=1)
+        inletCapId = int(freeCaps[np.argmin(inletDistances)])
+
+    return capIds, capDistances, inletCapId
+
+def ComputeCapsFlowFractions(caps, outlets, inletPoint=None):
+    '''Return the table of the caps flow fractions.
+
+    outlets is the outlets table of GetNetworkTables (element, x, y, z,
+    beta). Each row is (cap, role, element, centroid x, y, z, normal x, y,
+    z, area, flow fraction, distance to the matched centerline outlet),
+    with the role 'inlet', 'outlet' or 'wall' for the unmatched caps.
+
+    '''
+    outletPoints = [row[1:4] for row in outlets]
+    capIds, capDistances, inletCapId = MatchOutletsToCaps(caps, outletPoints,
+        inletPoint=inletPoint)
+    nCaps = len(caps['areas'])
+    roles = ['wall']*nCaps
+    elements = -np.ones(nCaps, dtype=np.int64)
+    fractions = np.zeros(nCaps)
+    distances = np.zeros(nCaps)
+    isMatched = capIds >= 0
+    elements[capIds[isMatched]] = [row[0] for row, matched in
+        zip(outlets, isMatched) if matched]
+    fractions[capIds[isMatched]] = [row[4] for row, matched in
+        zip(outlets, isMatched) if matched]
+    distances[capIds[isMatched]] = capDistances[isMatched]
+    for cap in capIds[isMatched]:
+        roles[cap] = 'outlet'
+    if inletCapId >= 0:
+        roles[inletCapId] = 'inlet'
+        fractions[inletCapId] = 1.0
+
+    table = []
+    for cap in range(0, nCaps):
+        table.append((cap, roles[cap], int(elements[cap]))
+            + tuple(caps['centroids'][cap]) + tuple(caps['normals'][cap])
+            + (caps['areas'][cap], fractions[cap], distances[cap]))
+    return table, int(np.count_nonzero(~isMatched))
+
+def WriteCapsTable(fileName, table):
+    '''Write the caps table in a csv file, atomically.'''
+    temporaryFileName = '%s.%i.tmp' % (fileName, os.getpid())
+    outputFile = open(temporaryFileName, 'w')
+    try:
+        outputFile.write('cap,role,element,x,y,z,nx,ny,nz,area,'
+            'percent_outflow,distance\n')
+        outputFile.writelines(['%i,%s,%i,%.6f,%.6f,%.6f,%.6f,%.6f,%.6f,'
+            '%.6f,%.6f,%.6f\n' % (row[:10] + (100.0*row[10], row[11]))
+            for row in table])
+    finally:
+        outputFile.close()
+    os.rename(temporaryFileName, fileName)
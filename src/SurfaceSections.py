@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import ctypes
+import multiprocessing
+
+import numpy as np
+import vtk
+from vtk.util.numpy_support import vtk_to_numpy, numpy_to_vtk, \
+    numpy_to_vtkIdTypeArray
+
+from .ParallelGeometry import ComputeCellsGeometry, _SharedArray, _NumpyView
+
+# Half size of the box of the surface cells sliced around a point, in
+# radii, and number of times the box is doubled when the section is cut.
+BOXFACTOR = 2.0
+NUMBEROFBOXRETRIES = 3
+
+# Surface arrays, sample arrays and cell locator of the worker processes,
+# set by _InitWorker.
+_worker = {}
+
+
+def ComputeCenterlineTangents(metrics):
+    '''Return the unit tangent of the centerline at every point, by
+    central differences along the cells (one-sided at their extremities).
+    The points shared by several cells get the tangent of the last one.'''
+    slots = np.arange(len(metrics.cellPointIds))
+    cells = np.repeat(np.arange(metrics.numberOfCells),
+        np.diff(metrics.cellOffsets))
+    previousSlots = np.maximum(slots - 1, metrics.cellOffsets[cells])
+    nextSlots = np.minimum(slots + 1, metrics.cellOffsets[cells + 1] - 1)
+    slotTangents = np.asarray(metrics.points[metrics.cellPointIds[nextSlots]],
+        dtype=np.float64) - metrics.points[metrics.cellPointIds[previousSlots]]
+    norms = np.sqrt((slotTangents**2.0).sum(axis=1))
+    slotTangents /= np.maximum(norms, 1e-300)[:, np.newaxis]
+    tangents = np.zeros((len(metrics.points), 3))
+    tangents[metrics.cellPointIds] = slotTangents
+    return tangents
+
+def GetSurfaceTriangles(surface):
+    '''Return the points and the triangles (nTriangles x 3 point ids) of a
+    surface, triangulated first.'''
+    triangulation = vtk.vtkTriangleFilter()
+    if vtk.VTK_MAJOR_VERSION <= 5:
+        triangulation.SetInput(surface)
+    else:
+        triangulation.SetInputData(surface)
+    triangulation.PassLinesOff()
+    triangulation.PassVertsOff()
+    triangulation.Update()
+    triangulated = triangulation.GetOutput()
+    points = vtk_to_numpy(triangulated.GetPoints().GetData()).astype(np.float64)
+    polys = triangulated.GetPolys()
+    if hasattr(polys, 'GetConnectivityArray'):
+        triangles = vtk_to_numpy(polys.GetConnectivityArray()).astype(np.int64)
+    else:
+        # Legacy layout: 3, id_1, id_2, id_3, 3, ...
+        triangles = vtk_to_numpy(polys.GetData()).astype(np.int64) \
+            .reshape(-1, 4)[:, 1:]
+    return points, triangles.reshape(-1, 3)
+
+def _BuildLocator(points, triangles):
+    '''Return a cell locator of the triangles.'''
+    vtkPoints = vtk.vtkPoints()
+    vtkPoints.SetData(numpy_to_vtk(np.ascontiguousarray(points), deep=1))
+    legacy = np.hstack((3*np.ones((len(triangles), 1), dtype=np.int64),
+        triangles)).ravel()
+    cells = vtk.vtkCellArray()
+    cells.SetCells(len(triangles), numpy_to_vtkIdTypeArray(legacy, deep=1))
+    polyData = vtk.vtkPolyData()
+    polyData.SetPoints(vtkPoints)
+    polyData.SetPolys(cells)
+    locator = vtk.vtkCellLocator()
+    locator.SetDataSet(polyData)
+    locator.BuildLocator()
+    return locator
+
+def SliceSurface(points, triangles, locator, center, normal, radius,
+    boxFactor=BOXFACTOR):
+    '''Return the area of the section of the surface by the plane of
+    normal through center, 0 if it was not found.
+
+    The triangles in a box of half size boxFactor radius around the center
+    are found with the cell locator and cut by the plane in one numpy
+    pass. Each cut triangle gives a segment, oriented by the triangle
+    winding, between the points of its two cut edges; the segments are
+    chained by their shared edges in loops. The section is the closed loop
+    winding around the center, its area the one of the polygon. When the
+    loop is cut by the box, the box is doubled.
+
+    '''
+    idList = vtk.vtkIdList()
+    for retry in range(0, NUMBEROFBOXRETRIES + 1):
+        h = boxFactor*radius*2.0**retry
+        locator.FindCellsWithinBounds([center[0] - h, center[0] + h,
+            center[1] - h, center[1] + h, center[2] - h, center[2] + h], idList)
+        cellIds = np.array([idList.GetId(k)
+            for k in range(0, idList.GetNumberOfIds())], dtype=np.int64)
+        area, isClosed = _SliceTriangles(points, triangles[cellIds], center,
+            normal)
+        if isClosed:
+            return area
+    return 0.0
+
+def _SliceTriangles(points, triangles, center, normal):
+    '''Return the area of the loop of the plane section of triangles
+    winding around center, and False if this loop is not closed.'''
+    if len(triangles) == 0:
+        return 0.0, False
+    distances = np.dot(points[triangles] - center, normal)
+    isAbove = distances >= 0.0
+    # Edge k of a triangle goes from its vertex k to its vertex k + 1.
+    starts = np.array([0, 1, 2])
+    ends = np.array([1, 2, 0])
+    isEntering = ~isAbove[:, starts] & isAbove[:, ends]
+    isLeaving = isAbove[:, starts] & ~isAbove[:, ends]
+    isCut = isEntering.any(axis=1)
+    if not(np.any(isCut)):
+        return 0.0, False
+    triangles = triangles[isCut]
+    distances = distances[isCut]
+    entering = np.argmax(isEntering[isCut], axis=1)
+    leaving = np.argmax(isLeaving[isCut], axis=1)
+    rows = np.arange(len(triangles))
+
+    def EdgePoints(edges):
+        a = triangles[rows, starts[edges]]
+        b = triangles[rows, ends[edges]]
+        da = distances[rows, starts[edges]]
+        db = distances[rows, ends[edges]]
+        t = (da / (da - db))[:, np.newaxis]
+        keys = np.minimum(a, b)*len(points) + np.maximum(a, b)
+        return points[a] + t*(points[b] - points[a]), keys
+
+    p0, keys0 = EdgePoints(entering)
+    p1, keys1 = EdgePoints(leaving)
+    crossProducts = np.dot(np.cross(p0 - center, p1 - center), normal)
+    angles = np.arctan2(crossProducts, ((p0 - center)*(p1 - center)).sum(axis=1))
+
+    # Chain the segments: the next segment starts on the edge where the
+    # current one ends.
+    nextSegments = dict(zip(keys0.tolist(), range(len(keys0))))
+    successors = [nextSegments.get(key, -1) for key in keys1.tolist()]
+    loops = -np.ones(len(keys0), dtype=np.int64)
+    isClosedLoop = []
+    for first in range(0, len(keys0)):
+        if loops[first] >= 0:
+            continue
+        label = len(isClosedLoop)
+        segment = first
+        while segment >= 0 and loops[segment] < 0:
+            loops[segment] = label
+            segment = successors[segment]
+        isClosedLoop.append(segment == first)
+        if segment >= 0 and loops[segment] != label:
+            # Joined an already labelled chain: merge the labels.
+            loops[loops == label] = loops[segment]
+            isClosedLoop.pop()
+    windings = np.bincount(loops, weights=angles) / (2.0*np.pi)
+    areas = 0.5*np.bincount(loops, weights=crossProducts)
+    around = np.nonzero(np.abs(windings) > 0.5)[0]
+    if len(around) == 0:
+        return 0.0, False
+    loop = around[np.argmin(np.abs(areas[around]))]
+    if not(isClosedLoop[loop]):
+        return 0.0, False
+    return float(abs(areas[loop])), True
+
+def _InitWorker(sharedArrays):
+    '''Map the shared arrays and build the cell locator in the worker.'''
+    for name, (shared, ctype, shape) in sharedArrays.items():
+        _worker[name] = _NumpyView(shared, ctype, shape)
+    _worker['locator'] = _BuildLocator(_worker['points'], _worker['triangles'])
+
+def _SliceTask(task):
+    '''Slice the surface at a range of samples and write the areas in
+    place.'''
+    first, last, boxFactor = task
+    for i in range(first, last):
+        _worker['areas'][i] = SliceSurface(_worker['points'],
+            _worker['triangles'], _worker['locator'], _worker['centers'][i],
+            _worker['normals'][i], _worker['radii'][i], boxFactor=boxFactor)
+    return last - first
+
+def ComputeSurfaceSections(surface, centers, normals, radii,
+    numberOfWorkers=1, boxFactor=BOXFACTOR, tasksPerWorker=4):
+    '''Return the areas of the sections of the surface by the planes of
+    normals through centers (see SliceSurface), 0 where no closed section
+    was found. The radii set the size of the sliced boxes.
+
+    The surface is triangulated and its cell locator built once (once per
+    worker with numberOfWorkers processes, which map the surface and the
+    samples arrays in shared memory and write the areas in place).
+
+    '''
+    points, triangles = GetSurfaceTriangles(surface)
+    nSamples = len(centers)
+    sharedArrays = {}
+    for name, values, ctype in (
+        ('points', points, ctypes.c_double),
+        ('triangles', triangles, ctypes.c_int64),
+        ('centers', np.asarray(centers, dtype=np.float64), ctypes.c_double),
+        ('normals', np.asarray(normals, dtype=np.float64), ctypes.c_double),
+        ('radii', np.asarray(radii, dtype=np.float64), ctypes.c_double),
+        ('areas', np.zeros(nSamples), ctypes.c_double)):
+        if numberOfWorkers > 1:
+            shared, view = _SharedArray(ctype, values.shape)
+            view[...] = values
+            sharedArrays[name] = (shared, ctype, values.shape)
+            values = view
+        _worker[name] = values
+
+    nTasks = max(1, min(nSamples, numberOfWorkers*tasksPerWorker))
+    bounds = np.linspace(0, nSamples, nTasks + 1).astype(np.int64)
+    tasks = [(int(bounds[i]), int(bounds[i + 1]), boxFactor)
+        for i in range(0, nTasks) if bounds[i + 1] > bounds[i]]
+    if numberOfWorkers > 1:
+        pool = multiprocessing.Pool(numberOfWorkers, initializer=_InitWorker,
+            initargs=(sharedArrays,))
+        try:
+            pool.map(_SliceTask, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        _worker['locator'] = _BuildLocator(points, triangles)
+        for task in tasks:
+            _SliceTask(task)
+    areas = np.array(_worker['areas'])
+    _worker.clear()
+    return areas
+
+def SetSurfaceSectionAreas(surface, metrics, verboseprint, numberOfWorkers=1,
+    boxFactor=BOXFACTOR):
+    '''Slice the surface model at every point of the centerline, normal to
+    the centerline, and set the section areas of the centerline metrics.
+
+    The areas replace the CenterlineSectionArea array: the points without
+    a closed section (e.g. at the caps) get a null area, which the
+    hydraulic resistance index ignores. Returns the areas.
+
+    '''
+    pointIds = np.unique(metrics.cellPointIds)
+    tangents = ComputeCenterlineTangents(metrics)
+    areas = np.zeros(len(metrics.points))
+    areas[pointIds] = ComputeSurfaceSections(surface,
+        metrics.points[pointIds], tangents[pointIds], metrics.radii[pointIds],
+        numberOfWorkers=numberOfWorkers, boxFactor=boxFactor)
+    verboseprint('> Surface sections: %i of %i points sliced.'
+        % (np.count_nonzero(areas[pointIds] > 0.0), len(pointIds)))
+    metrics.sectionAreas = areas.astype(metrics.radii.dtype)
+    metrics.resistanceIndex = None
+    return areas
+
+def SetSectionMeanRadius(network, metrics, verboseprint):
+    '''Set the mean radius of the elements to the hydraulic resistance
+    radius of the section areas along their cells (r^2 = S / pi), averaged
+    over the cells as CenterlineMetrics.GetGroupRadius. The elements
+    without a section keep their inscribed sphere radius.'''
+    index = metrics.GetResistanceIndex()
+    cellIds = np.array([k for el in network.elements
+        for k in el.GetVtkCellIdList()], dtype=np.int64)
+    owners = np.repeat(np.arange(len(network.elements)),
+        [len(el.GetVtkCellIdList()) for el in network.elements])
+    radii = index.ComputeEquivalentRadii(cellIds, np.zeros(len(cellIds)),
+        metrics.cellLengths[cellIds], useSectionArea=True)
+    hasSection = ~np.isnan(radii)
+    sums = np.bincount(owners[hasSection], weights=radii[hasSection],
+        minlength=len(network.elements))
+    counts = np.bincount(owners[hasSection], minlength=len(network.elements))
+    for el, total, count in zip(network.elements, sums, counts):
+        if count > 0:
+            el.SetMeanRadius(float(total / count))
+    verboseprint('> Mean radius of %i of %i elements from the surface '
+        'sections.' % (np.count_nonzero(counts), len(network.elements)))
+
+def SetSectionLocalRadius(network, metrics, nDiameter, verboseprint):
+    '''Set the local radius of the elements to the radius of the section
+    areas (r^2 = S / pi) at nDiameter radii from the bifurcation, as
+    CenterlineMetrics.ComputeLocalRadius on the first cell of each element
+    with the section radii instead of the inscribed sphere radii (they also
+    give the distance from the bifurcation). The points without a section
+    keep their inscribed sphere radius.'''
+    areas = metrics.sectionAreas.astype(np.float64)
+    radii = np.where(areas > 0.0, np.sqrt(np.maximum(areas, 0.0) / np.pi),
+        metrics.radii)
+    cellIds = np.array([el.GetVtkCellIdList()[0] for el in network.elements],
+        dtype=np.int64)
+    nPoints = metrics.cellOffsets[cellIds + 1] - metrics.cellOffsets[cellIds]
+    offsets = np.concatenate(([0], np.cumsum(nPoints)))
+    cells = np.repeat(np.arange(len(cellIds)), nPoints)
+    slots = metrics.cellOffsets[cellIds][cells] + np.arange(offsets[-1]) \
+        - offsets[cells]
+    localRadii = ComputeCellsGeometry(metrics.points, radii, offsets,
+        metrics.cellPointIds[slots], 0, len(cellIds),
+        nDiameter=nDiameter)['localRadii']
+    for el, r in zip(network.elements, localRadii):
+        el.SetLocalRadius(float(r))
+    verboseprint('> Local radius of %i elements from the surface sections.'
+        % len(network.elements))
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import numpy as np
+
+from .DiameterProfile import WriteDiameterProfiles
+
+# Relaxation factor of the Laplacian smoothing of the centerline points.
+SMOOTHINGFACTOR = 0.5
+# Number of points on each side of a point in the local polynomial fits of
+# the derivatives, and degree of the polynomials.
+FITHALFWIDTH = 4
+FITDEGREE = 4
+
+
+def _Neighbours(offsets):
+    '''Return the branch, previous and next point of every point of
+    branches concatenated with offsets, the extremities being their own
+    previous or next point.'''
+    nPoints = np.diff(offsets)
+    branches = np.repeat(np.arange(len(nPoints)), nPoints)
+    slots = np.arange(offsets[-1])
+    previous = np.maximum(slots - 1, offsets[:-1][branches])
+    following = np.minimum(slots + 1, offsets[1:][branches] - 1)
+    return branches, previous, following
+
+def SmoothBranches(points, offsets, iterations, factor=SMOOTHINGFACTOR):
+    '''Laplacian smoothing of the points of the branches, the extremities
+    being kept: x_j += factor (0.5 (x_j-1 + x_j+1) - x_j).'''
+    branches, previous, following = _Neighbours(offsets)
+    isInterior = (previous < np.arange(len(points))) & \
+        (following > np.arange(len(points)))
+    points = np.array(points, dtype=np.float64)
+    for i in range(0, iterations):
+        laplacian = 0.5*(points[previous] + points[following]) - points
+        points[isInterior] += factor*laplacian[isInterior]
+    return points
+
+def _ArcLength(points, offsets):
+    '''Return the arc length of the points along their branches, and the
+    same shifted to be increasing over all the branches (a gap of 1
+    between two branches), for the interpolations of all the branches at
+    once.'''
+    branches, previous, following = _Neighbours(offsets)
+    dx = np.sqrt(((points - points[previous])**2.0).sum(axis=1))
+    cumulative = np.cumsum(dx)
+    arcLength = cumulative - cumulative[offsets[:-1]][branches]
+    return arcLength, cumulative + branches
+
+def FitBranches(points, arcLength, offsets, halfWidth=FITHALFWIDTH):
+    '''Least squares fit of a polynomial of degree FITDEGREE of the arc
+    length to the 2 halfWidth + 1 points around every point of the
+    branches (the window is clamped at the extremities of the branches).
+    The fit uses the actual spacing of the points, so it stays accurate on
+    an irregular spacing, where finite differences of finite differences
+    do not. Returns the coefficients (nPoints x FITDEGREE + 1 x k) in
+    u = (s - s_j) / scale_j and the scales.'''
+    branches, previous, following = _Neighbours(offsets)
+    slots = np.arange(len(arcLength))
+    windows = np.clip(slots[:, np.newaxis] + np.arange(-halfWidth,
+        halfWidth + 1), offsets[:-1][branches][:, np.newaxis],
+        offsets[1:][branches][:, np.newaxis] - 1)
+    u = arcLength[windows] - arcLength[:, np.newaxis]
+    scales = np.abs(u).max(axis=1)
+    scales[scales == 0.0] = 1.0
+    u /= scales[:, np.newaxis]
+    vandermonde = u[:, :, np.newaxis]**np.arange(FITDEGREE + 1)
+    coefficients = np.einsum('npw,nwk->npk', np.linalg.pinv(vandermonde),
+        points[windows])
+    return coefficients, scales
+
+def ResampleBranches(points, offsets, halfWidth=FITHALFWIDTH):
+    '''Resample the branches to a uniform arc length spacing with the same
+    numbers of points, the extremities being kept. The new points are
+    given by the fit (FitBranches) of the nearest point. Returns the
+    points and the arc length of the new points along the old branches.'''
+    arcLength, globalArcLength = _ArcLength(points, offsets)
+    coefficients, scales = FitBranches(points, arcLength, offsets,
+        halfWidth=halfWidth)
+    branches, previous, following = _Neighbours(offsets)
+    nPoints = np.diff(offsets)
+    lengths = arcLength[offsets[1:] - 1]
+    ranks = np.arange(offsets[-1]) - offsets[:-1][branches]
+    uniform = lengths[branches]*ranks / np.maximum(nPoints[branches] - 1, 1)
+    # Nearest point of the same branch.
+    nearest = np.searchsorted(globalArcLength, uniform
+        + globalArcLength[offsets[:-1]][branches])
+    nearest = np.clip(nearest, offsets[:-1][branches] + 1,
+        offsets[1:][branches] - 1)
+    nearest = np.where(uniform - arcLength[nearest - 1] < arcLength[nearest]
+        - uniform, nearest - 1, nearest)
+    nearest = np.clip(nearest, offsets[:-1][branches],
+        offsets[1:][branches] - 1)
+    u = (uniform - arcLength[nearest]) / scales[nearest]
+    powers = u[:, np.newaxis]**np.arange(FITDEGREE + 1)
+    resampled = np.einsum('np,npk->nk', powers, coefficients[nearest])
+    resampled[offsets[:-1]] = points[offsets[:-1]]
+    resampled[offsets[1:] - 1] = points[offsets[1:] - 1]
+    return resampled, uniform
+
+def ComputeCurvatureTorsion(points, offsets, smoothingIterations=0,
+    smoothingFactor=SMOOTHINGFACTOR, halfWidth=FITHALFWIDTH):
+    '''Return the arc length, curvature and torsion at every point of
+    branches concatenated with offsets (the points of the branch i are
+    points[offsets[i]:offsets[i+1]]).
+
+    With the first, second and third derivatives d1, d2, d3 along the arc
+    length, taken from the local fits of FitBranches, the curvature is
+    |d1 x d2| / |d1|^3 and the torsion (d1 x d2) . d3 / |d1 x d2|^2, 0
+    where the curvature vanishes. The fits follow the actual spacing of
+    the points. The Laplacian smoothing, if smoothingIterations is
+    positive, is done on the branches resampled to a uniform spacing
+    (ResampleBranches), the equal weights giving large errors on an
+    irregular spacing, and the curvature and torsion are interpolated back
+    to the points. Limitations: the smoothing shrinks the curves (by about
+    factor h^2 curvature / 2 per iteration, h the spacing), and without it
+    the torsion, a third derivative, is very sensitive to the noise of the
+    points. All the branches are computed in one pass.
+
+    '''
+    points = np.asarray(points, dtype=np.float64)
+    arcLength, globalArcLength = _ArcLength(points, offsets)
+    if smoothingIterations > 0:
+        samples, sampleArcLength = ResampleBranches(points, offsets,
+            halfWidth=halfWidth)
+        samples = SmoothBranches(samples, offsets, smoothingIterations,
+            factor=smoothingFactor)
+        sampleCurvature, sampleTorsion = _CurvatureTorsion(samples,
+            _ArcLength(samples, offsets)[0], offsets, halfWidth)
+        branches = _Neighbours(offsets)[0]
+        globalSampleArcLength = sampleArcLength \
+            + globalArcLength[offsets[:-1]][branches]
+        curvature = np.interp(globalArcLength, globalSampleArcLength,
+            sampleCurvature)
+        torsion = np.interp(globalArcLength, globalSampleArcLength,
+            sampleTorsion)
+        return arcLength, curvature, torsion
+    curvature, torsion = _CurvatureTorsion(points, arcLength, offsets,
+        halfWidth)
+    return arcLength, curvature, torsion
+
+def _CurvatureTorsion(points, arcLength, offsets, halfWidth):
+    coefficients, scales = FitBranches(points, arcLength, offsets,
+        halfWidth=halfWidth)
+    d1 = coefficients[:, 1] / scales[:, np.newaxis]
+    d2 = 2.0*coefficients[:, 2] / scales[:, np.newaxis]**2.0
+    d3 = 6.0*coefficients[:, 3] / scales[:, np.newaxis]**3.0
+    crossProducts = np.cross(d1, d2)
+    crossNorms2 = (crossProducts**2.0).sum(axis=1)
+    speeds = np.sqrt((d1**2.0).sum(axis=1))
+    curvature = np.zeros(len(points))
+    torsion = np.zeros(len(points))
+    isCurved = (speeds > 0.0) & (crossNorms2 > 1e-24*speeds**6.0)
+    curvature[isCurved] = np.sqrt(crossNorms2[isCurved]) / speeds[isCurved]**3.0
+    torsion[isCurved] = (crossProducts[isCurved]*d3[isCurved]).sum(axis=1) \
+        / crossNorms2[isCurved]
+    return curvature, torsion
+
+def ComputeMorphometry(network, metrics, smoothingIterations=0,
+    smoothingFactor=SMOOTHINGFACTOR, elementIds=None):
+    '''Return the curvature, torsion and tortuosity of the non-blanked
+    branches.
+
+    As ComputeDiameterProfiles, each non-blanked element is described by
+    its first VTK cell and all the branches are done in one vectorized
+    pass over the centerline arrays. Returns two dictionaries of columns:
+    the points (branch index, arc length, curvature, torsion, coordinates)
+    and the branches (element id, VTK cell id, length, chord, tortuosity
+    length / chord - 1, mean and maximum curvature, total curvature and
+    mean absolute torsion; the means are weighted by the arc length).
+    elementIds restricts the computation to some elements.
+
+    '''
+    if elementIds is None:
+        elementIds = range(0, len(network.elements))
+    elements = [network.elements[Id] for Id in elementIds
+        if not(network.elements[Id].IsBlanked())]
+    elementIds = np.array([el.GetId() for el in elements], dtype=np.int64)
+    cellIds = np.array([el.GetVtkCellIdList()[0] for el in elements],
+        dtype=np.int64)
+    nBranches = len(cellIds)
+    if nBranches == 0:
+        raise RuntimeError('The network has no non-blanked branch.')
+    firstSlots = metrics.cellOffsets[cellIds]
+    nPoints = metrics.cellOffsets[cellIds + 1] - firstSlots
+    offsets = np.concatenate(([0], np.cumsum(nPoints)))
+    branches = np.repeat(np.arange(nBranches), nPoints)
+    ranks = np.arange(offsets[-1]) - offsets[branches]
+    coordinates = np.asarray(metrics.points[
+        metrics.cellPointIds[firstSlots[branches] + ranks]], dtype=np.float64)
+    arcLength, curvature, torsion = ComputeCurvatureTorsion(coordinates,
+        offsets, smoothingIterations=smoothingIterations,
+        smoothingFactor=smoothingFactor)
+
+    # Per-branch integrals, with the trapezoidal rule.
+    lengths = arcLength[offsets[1:] - 1]
+    chords = np.sqrt(((coordinates[offsets[1:] - 1]
+        - coordinates[offsets[:-1]])**2.0).sum(axis=1))
+    isInside = ranks > 0
+    ds = np.zeros(len(arcLength))
+    ds[isInside] = arcLength[isInside] - arcLength[np.nonzero(isInside)[0] - 1]
+
+    def Integrate(values):
+        integrand = np.zeros(len(values))
+        integrand[isInside] = 0.5*ds[isInside]*(values[isInside]
+            + values[np.nonzero(isInside)[0] - 1])
+        return np.bincount(branches, weights=integrand, minlength=nBranches)
+
+    hasLength = lengths > 0.0
+    totalCurvature = Integrate(curvature)
+    meanCurvature = np.zeros(nBranches)
+    meanCurvature[hasLength] = totalCurvature[hasLength] / lengths[hasLength]
+    meanTorsion = np.zeros(nBranches)
+    meanTorsion[hasLength] = Integrate(np.abs(torsion))[hasLength] \
+        / lengths[hasLength]
+    tortuosity = np.zeros(nBranches)
+    hasChord = chords > 0.0
+    tortuosity[hasChord] = lengths[hasChord] / chords[hasChord] - 1.0
+    maxCurvature = np.zeros(nBranches)
+    np.maximum.at(maxCurvature, branches, curvature)
+
+    points = {'branch': branches.astype(np.int32),
+              'arcLength': arcLength,
+              'curvature': curvature,
+              'torsion': torsion,
+              'x': coordinates[:, 0],
+              'y': coordinates[:, 1],
+              'z': coordinates[:, 2]}
+    branchesTable = {'element': elementIds.astype(np.int32),
+                     'cellId': cellIds.astype(np.int32),
+                     'length': lengths,
+                     'chord': chords,
+                     'tortuosity': tortuosity,
+                     'meanCurvature': meanCurvature,
+                     'maxCurvature': maxCurvature,
+                     'totalCurvature': totalCurvature,
+                     'meanTorsion': meanTorsion}
+    return points, branchesTable
+
+def WriteMorphometry(fileName, points, branchesTable):
+    '''Write the morphometry tables as WriteDiameterProfiles (npz).'''
+    WriteDiameterProfiles(fileName, points, branchesTable)
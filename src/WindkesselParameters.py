@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import os
+
+import numpy as np
+
+# Proximal resistance of the RCR models as a fraction of the outlet total
+# resistance, when no wave speed is given.
+PROXIMALFRACTION = 0.056
+
+
+def GetOutletsArrays(result):
+    '''Return the outlet element ids, betas and mean areas (pi r^2 of the
+    mean radius, as Element.GetMeanArea) of the tables of GetNetworkTables,
+    and the mean area of the inlet element.'''
+    radii = dict((row[0], row[5]) for row in result['elements'])
+    elementIds = np.array([row[0] for row in result['outlets']], dtype=np.int64)
+    betas = np.array([row[4] for row in result['outlets']], dtype=np.float64)
+    areas = np.pi*np.array([radii[Id] for Id in elementIds],
+        dtype=np.float64)**2.0
+    inletArea = np.pi*radii[0]**2.0
+    return elementIds, betas, areas, inletArea
+
+def ComputeWindkesselParameters(betas, areas, meanInflow, meanPressure,
+    totalCompliance, venousPressure=0.0, proximalFraction=PROXIMALFRACTION,
+    density=0.0, waveSpeed=0.0):
+    '''Compute the lumped parameters of all the outlets at once.
+
+    The outlet i receives the mean flow Q_i = beta_i Q_in, so its total
+    resistance giving the target mean pressure is
+    R_i = (meanPressure - venousPressure) / Q_i, i.e. the network total
+    resistance times 1 / beta_i. R_i is split in a proximal resistance,
+    the characteristic impedance rho c / A_i of the outlet area when
+    waveSpeed is positive, proximalFraction R_i otherwise, and a distal
+    resistance R_i - Rp_i. The total compliance is distributed in
+    proportion of the flows, C_i = beta_i C. The units are the ones of the
+    inputs, which should be consistent: the areas are in the length unit
+    of the centerline (often mm), so the density (needed with waveSpeed,
+    there is no default) and the wave speed should use the same length
+    unit, e.g. 1.06e-6 kg/mm^3 and mm/s. Returns a dictionary of arrays
+    (flows, resistances, proximal and distal resistances, compliances).
+
+    '''
+    betas = np.asarray(betas, dtype=np.float64)
+    areas = np.asarray(areas, dtype=np.float64)
+    if meanInflow <= 0.0:
+        raise RuntimeError('The mean inflow should be positive.')
+    if meanPressure <= venousPressure:
+        raise RuntimeError('The mean pressure should be above the venous '
+            'pressure.')
+    if np.any(betas <= 0.0):
+        raise RuntimeError('An outlet has no outflow, its resistance is '
+            'infinite.')
+    flows = betas*meanInflow
+    resistances = (meanPressure - venousPressure) / flows
+    if waveSpeed > 0.0:
+        if density <= 0.0:
+            raise RuntimeError('The characteristic impedance needs the blood '
+                'density, in the units of the centerline and wave speed.')
+        if np.any(areas <= 0.0):
+            raise RuntimeError('An outlet has a null area.')
+        proximal = density*waveSpeed / areas
+        if np.any(proximal >= resistances):
+            raise RuntimeError('The characteristic impedance of %i outlets '
+                'is above their total resistance.'
+                % np.count_nonzero(proximal >= resistances))
+    else:
+        proximal = proximalFraction*resistances
+    return {'flows': flows,
+            'resistances': resistances,
+            'proximalResistances': proximal,
+            'distalResistances': resistances - proximal,
+            'compliances': betas*totalCompliance}
+
+def WriteWindkesselParameters(fileName, elementIds, parameters,
+    venousPressure=0.0):
+    '''Write the outlets lumped parameters, atomically.
+
+    A '.dat' file name gives a rcrt.dat boundary conditions file (one
+    block Rp, C, Rd and constant distal pressure per outlet, in the order
+    of the outlets table, to be matched with the solver outlet faces), any
+    other a csv table.
+
+    '''
+    temporaryFileName = '%s.%i.tmp' % (fileName, os.getpid())
+    rows = np.column_stack((parameters['flows'], parameters['resistances'],
+        parameters['proximalResistances'], parameters['compliances'],
+        parameters['distalResistances']))
+    outputFile = open(temporaryFileName, 'w')
+    try:
+        if fileName.endswith('.dat'):
+            outputFile.write('2\n')
+            outputFile.writelines(['2\n%.8e\n%.8e\n%.8e\n'
+                '0.0 %.8e\n1.0 %.8e\n' % (Rp, C, Rd, venousPressure,
+                venousPressure) for Q, R, Rp, C, Rd in rows])
+        else:
+            outputFile.write('element,flow,resistance,proximal_resistance,'
+                'compliance,distal_resistance\n')
+            outputFile.writelines(['%i,%.8e,%.8e,%.8e,%.8e,%.8e\n'
+                % ((Id,) + tuple(row)) for Id, row in zip(elementIds, rows)])
+    finally:
+        outputFile.close()
+    os.rename(temporaryFileName, fileName)
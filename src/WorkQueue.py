@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+## Christophe.Chnafa@gmail.com
+
+import errno
+import os
+import socket
+import threading
+import time
+
+# Time (s) after which the claim of a case not renewed by its worker is
+# considered as left by a crashed worker.
+LEASEDURATION = 600.0
+# Number of claims of a case before it is marked as failed, e.g. when it
+# crashes all its workers.
+MAXIMUMATTEMPTS = 3
+# Waiting time (s) between two polls of the queue when all the remaining
+# cases are claimed by other workers.
+POLLINTERVAL = 10.0
+
+
+def _GetTaskName(fileName):
+    return os.path.splitext(os.path.basename(fileName))[0]
+
+
+class WorkQueue(object):
+    '''Work queue of cases shared by workers on several nodes through a
+    common filesystem, without any broker.
+
+    The queue directory holds one task file per case (giving the input
+    file name), the claims of the cases, and the done and failed markers.
+    A worker claims the case c by creating the file claims/c@k, k being
+    the attempt number: the creation is a hard link of a temporary file,
+    atomic also on NFS, so only one worker gets each attempt. The worker
+    renews its claims (modification time) every quarter of the lease
+    duration while it processes them. A claim not renewed for
+    leaseDuration is stale and the case is claimed again with the attempt
+    k + 1, up to maximumAttempts. The times are compared to the time of
+    the filesystem (modification time of a file just touched), not to the
+    clocks of the nodes. A case is finished when its done or failed
+    marker is written (atomically); the results should be written
+    atomically before, so that a case recomputed after a crash overwrites
+    them safely.
+
+    '''
+
+    def __init__(self, queueDirectory, leaseDuration=LEASEDURATION,
+        maximumAttempts=MAXIMUMATTEMPTS):
+        self.queueDirectory = queueDirectory
+        self.leaseDuration = float(leaseDuration)
+        self.maximumAttempts = maximumAttempts
+        self.workerName = '%s.%i' % (socket.gethostname(), os.getpid())
+        self.directories = {}
+        for name in ('tasks', 'claims', 'done', 'failed', 'workers'):
+            self.directories[name] = os.path.join(queueDirectory, name)
+            try:
+                os.makedirs(self.directories[name])
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+        self.claims = {}
+        self.lock = threading.Lock()
+        self.heartbeat = None
+        self.stopHeartbeat = threading.Event()
+
+    def _GetPath(self, directory, name):
+        return os.path.join(self.directories[directory], name)
+
+    def _CreateExclusive(self, path, content):
+        '''Create a file only if it does not exist. Returns False if it
+        exists.'''
+        temporaryFileName = os.path.join(os.path.dirname(path),
+            '.%s.tmp' % self.workerName)
+        outputFile = open(temporaryFileName, 'w')
+        try:
+            outputFile.write(content)
+        finally:
+            outputFile.close()
+        try:
+            os.link(temporaryFileName, path)
+            return True
+        except OSError as error:
+            # A retransmitted link on NFS can fail, even with EEXIST, after
+            # its success: the link count tells.
+            if os.stat(temporaryFileName).st_nlink == 2:
+                return True
+            if error.errno == errno.EEXIST:
+                return False
+            raise
+        finally:
+            os.remove(temporaryFileName)
+
+    def _WriteMarker(self, directory, name, content):
+        path = self._GetPath(directory, name)
+        temporaryFileName = '%s.%s.tmp' % (path, self.workerName)
+        outputFile = open(temporaryFileName, 'w')
+        try:
+            outputFile.write(content)
+        finally:
+            outputFile.close()
+        os.rename(temporaryFileName, path)
+
+    def _GetTime(self):
+        '''Current time of the filesystem.'''
+        path = self._GetPath('workers', self.workerName)
+        open(path, 'a').close()
+        os.utime(path, None)
+        return os.stat(path).st_mtime
+
+    def Submit(self, fileNames):
+        '''Add the cases of the files to the queue. The cases already in
+        the queue (submitted by another worker) are kept. Returns the
+        number of new cases.'''
+        nSubmitted = 0
+        for fileName in fileNames:
+            name = _GetTaskName(fileName)
+            if '@' in name:
+                raise RuntimeError('The case name %s contains @.' % name)
+            if self._CreateExclusive(self._GetPath('tasks', name),
+                os.path.abspath(fileName)):
+                nSubmitted += 1
+        return nSubmitted
+
+    def _GetFinished(self):
+        return set(os.listdir(self.directories['done'])) | \
+            set(os.listdir(self.directories['failed']))
+
+    def _GetAttempts(self):
+        attempts = {}
+        for claimName in os.listdir(self.directories['claims']):
+            if claimName.startswith('.'):
+                continue
+            name, attempt = claimName.rsplit('@', 1)
+            attempts[name] = max(attempts.get(name, 0), int(attempt))
+        return attempts
+
+    def Claim(self):
+        '''Claim the next unfinished case not claimed by a live worker.
+        Returns (name, input file name), or None if there is no such
+        case.'''
+        finished = self._GetFinished()
+        attempts = self._GetAttempts()
+        now = None
+        for name in sorted(os.listdir(self.directories['tasks'])):
+            if name.startswith('.') or name in finished or name in self.claims:
+                continue
+            attempt = attempts.get(name, 0)
+            if attempt > 0:
+                if now is None:
+                    now = self._GetTime()
+                try:
+                    renewal = os.stat(self._GetPath('claims',
+                        '%s@%i' % (name, attempt))).st_mtime
+                except OSError:
+                    continue
+                if now - renewal < self.leaseDuration:
+                    continue
+                if attempt >= self.maximumAttempts:
+                    self._WriteMarker('failed', name, 'Lease expired %i '
+                        'times, the case crashed its workers.\n' % attempt)
+                    continue
+            claimPath = self._GetPath('claims', '%s@%i' % (name, attempt + 1))
+            if not(self._CreateExclusive(claimPath, self.workerName + '\n')):
+                continue
+            # The case may have been finished since the listing.
+            if os.path.exists(self._GetPath('done', name)) or \
+                os.path.exists(self._GetPath('failed', name)):
+                os.remove(claimPath)
+                continue
+            inputFile = open(self._GetPath('tasks', name))
+            try:
+                fileName = inputFile.read().strip()
+            finally:
+                inputFile.close()
+            with self.lock:
+                self.claims[name] = claimPath
+            return name, fileName
+        return None
+
+    def Complete(self, name, error=None):
+        '''Mark a claimed case as done, or as failed with error, and
+        release its claim.'''
+        if error is None:
+            self._WriteMarker('done', name, self.workerName + '\n')
+        else:
+            self._WriteMarker('failed', name, '%s\n%s\n' % (self.workerName,
+                error))
+        self.Release(name)
+
+    def Release(self, name=None):
+        '''Release the claim of a case, or all the claims of the worker,
+        so that other workers take them without waiting for the lease.'''
+        with self.lock:
+            names = list(self.claims) if name is None else [name]
+            for name in names:
+                if not(name in self.claims):
+                    continue
+                try:
+                    os.remove(self.claims.pop(name))
+                except OSError:
+                    pass
+
+    def Abandon(self):
+        '''Stop renewing the claims of the worker without releasing them:
+        they expire and count as attempts, e.g. after a crash.'''
+        with self.lock:
+            self.claims.clear()
+
+    def _Heartbeat(self):
+        while not(self.stopHeartbeat.wait(0.25*self.leaseDuration)):
+            with self.lock:
+                for claimPath in self.claims.values():
+                    try:
+                        os.utime(claimPath, None)
+                    except OSError:
+                        pass
+
+    def StartHeartbeat(self):
+        '''Start the thread renewing the claims of the worker.'''
+        self.stopHeartbeat.clear()
+        self.heartbeat = threading.Thread(target=self._Heartbeat)
+        self.heartbeat.daemon = True
+        self.heartbeat.start()
+
+    def StopHeartbeat(self):
+        self.stopHeartbeat.set()
+        if self.heartbeat is not None:
+            self.heartbeat.join()
+            self.heartbeat = None
+
+    def GetStatus(self):
+        '''Return the numbers of cases, done cases and failed cases.'''
+        nTasks = len([name for name in os.listdir(self.directories['tasks'])
+            if not(name.startswith('.'))])
+        nDone = len([name for name in os.listdir(self.directories['done'])
+            if not(name.endswith('.tmp'))])
+        nFailed = len([name for name in os.listdir(self.directories['failed'])
+            if not(name.endswith('.tmp'))])
+        return nTasks, nDone, nFailed
+
+    def IsFinished(self):
+        nTasks, nDone, nFailed = self.GetStatus()
+        return nDone + nFailed >= nTasks
+
+
+def ProcessQueue(workQueue, processFile, verboseprint,
+    pollInterval=POLLINTERVAL):
+    '''Claim and process the cases of a work queue one after the other,
+    until all the cases of the queue are finished (by this worker or
+    others). processFile(fileName) should write its results atomically;
+    an exception marks the case as failed. Returns the list of (name,
+    error) of the cases failed in this worker.'''
+    failures = []
+    workQueue.StartHeartbeat()
+    try:
+        while True:
+            task = workQueue.Claim()
+            if task is None:
+                if workQueue.IsFinished():
+                    break
+                verboseprint('> Waiting for the cases claimed by other '
+                    'workers.')
+                time.sleep(pollInterval)
+                continue
+            name, fileName = task
+            start = time.time()
+            try:
+                processFile(fileName)
+                error = None
+                status = 'done in %.2f s' % (time.time() - start)
+            except Exception as exception:
+                error = repr(exception)
+                failures.append((name, error))
+                status = 'FAILED: ' + error
+            workQueue.Complete(name, error=error)
+            nTasks, nDone, nFailed = workQueue.GetStatus()
+            print('> [%i/%i] %s %s' % (nDone + nFailed, nTasks, name, status))
+    except:
+        workQueue.Release()
+        raise
+    finally:
+        workQueue.StopHeartbeat()
+    return failures